@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+"""aggregation.py: Running grouped accumulators for watershed and land use statistics."""
+
+__copyright__ = """
+    Copyright (C) 2018 San Francisco Estuary Institute (SFEI)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy
+
+# Scalar running sums held by every accumulator
+SCALARS = ["area", "runoff_volume", "precipitation_area", "slope_area", "count"]
+
+# Per-category running sums, with the category list each is indexed by
+CATEGORY_SUMS = [
+    ("slope_bin_area", "slope_bins"),
+    ("soil_area", "soil_types"),
+    ("land_use_class_area", "land_use_classes"),
+    ("land_use_class_runoff", "land_use_classes"),
+    ("land_use_code_area", "land_use_codes"),
+    ("load", "pollutants")
+]
+
+
+def category_index(values, categories):
+    """Position of each value within a list of categories
+
+    Arguments:
+        values {array} -- values to look up
+        categories {list} -- category values
+
+    Returns:
+        array -- index into categories per value, -1 for values not in categories
+    """
+
+    positions = dict((category, i) for (i, category) in enumerate(categories))
+    (unique, inverse) = numpy.unique(numpy.asarray(values), return_inverse=True)
+    unique_positions = numpy.array(
+        [positions.get(value, -1) for value in unique.tolist()], dtype=int)
+    return unique_positions[inverse]
+
+
+def category_sums(index, weights, n_categories):
+    """Sum weights by category index, ignoring values outside the categories
+
+    Arguments:
+        index {array} -- category index per value, from category_index
+        weights {array} -- weights to sum
+        n_categories {int} -- number of categories
+
+    Returns:
+        array -- sum per category
+    """
+
+    valid = index >= 0
+    return numpy.bincount(index[valid], weights=numpy.asarray(weights)[valid],
+                          minlength=n_categories)[:n_categories]
+
+
+class Watershed_Accumulator(object):
+    """Additive sums from which watershed and land use statistics are derived
+
+    Tables are folded in chunk by chunk, so memory use does not depend on table size.
+    Accumulators of different chunks, tiles or watersheds combine with merge.
+
+    Arguments:
+        object {object} -- Remenant of python 2.7, declares new-style class
+
+    Returns:
+        Watershed_Accumulator -- Watershed_Accumulator instance
+    """
+
+    def __init__(self, categories, fields):
+        """Class initialization
+
+        Arguments:
+            categories {dictionary} -- category lists keyed by slope_bins, soil_types, land_use_classes and land_use_codes,
+                and optionally pollutants
+            fields {dictionary} -- table field names keyed by area, runoff_volume, precipitation, slope, soil,
+                land_use_class and land_use_code, plus either slope_bin or slope_fractions (one field per slope bin),
+                and loads (one field per pollutant) if there are pollutants
+        """
+
+        self.categories = categories
+        self.fields = fields
+        # NumPy scalars, ratios over an empty watershed are NaN rather than ZeroDivisionError
+        for name in SCALARS:
+            setattr(self, name, numpy.float64(0.0))
+        for (name, category_name) in CATEGORY_SUMS:
+            setattr(self, name, numpy.zeros(len(categories.get(category_name, []))))
+
+    def add(self, fc_table):
+        """Fold a table chunk into the running sums
+
+        Arguments:
+            fc_table {array} -- NumPy structured array containing the configured fields
+        """
+
+        if len(fc_table) == 0:
+            return
+        fields = self.fields
+        area = numpy.asarray(fc_table[fields["area"]], dtype=numpy.float64)
+        runoff_volume = numpy.asarray(
+            fc_table[fields["runoff_volume"]], dtype=numpy.float64)
+
+        self.count += len(fc_table)
+        self.area += numpy.sum(area)
+        self.runoff_volume += numpy.sum(runoff_volume)
+        self.precipitation_area += numpy.sum(
+            fc_table[fields["precipitation"]] * area)
+        self.slope_area += numpy.sum(fc_table[fields["slope"]] * area)
+
+        if fields.get("slope_fractions"):
+            self.slope_bin_area += numpy.array([numpy.sum(fc_table[field] * area)
+                                                for field in fields["slope_fractions"]])
+        else:
+            self.slope_bin_area += category_sums(category_index(
+                fc_table[fields["slope_bin"]], self.categories["slope_bins"]),
+                area, len(self.slope_bin_area))
+
+        self.soil_area += category_sums(category_index(
+            fc_table[fields["soil"]], self.categories["soil_types"]),
+            area, len(self.soil_area))
+
+        land_use_class = category_index(
+            fc_table[fields["land_use_class"]], self.categories["land_use_classes"])
+        self.land_use_class_area += category_sums(
+            land_use_class, area, len(self.land_use_class_area))
+        self.land_use_class_runoff += category_sums(
+            land_use_class, runoff_volume, len(self.land_use_class_runoff))
+
+        self.land_use_code_area += category_sums(category_index(
+            fc_table[fields["land_use_code"]], self.categories["land_use_codes"]),
+            area, len(self.land_use_code_area))
+
+        if fields.get("loads"):
+            self.load += numpy.array([numpy.sum(fc_table[field])
+                                      for field in fields["loads"]])
+
+    def merge(self, other):
+        """Add the sums of another accumulator with the same categories
+
+        Arguments:
+            other {Watershed_Accumulator} -- accumulator to add
+        """
+
+        for name in SCALARS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for (name, category_name) in CATEGORY_SUMS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def copy(self):
+        """Independent copy of the accumulator
+
+        Returns:
+            Watershed_Accumulator -- copy
+        """
+
+        accumulator = Watershed_Accumulator(self.categories, self.fields)
+        accumulator.merge(self)
+        return accumulator
+
+    def to_dict(self):
+        """Plain representation of the sums, for persisting accumulators
+
+        Returns:
+            dictionary -- sums keyed by name
+        """
+
+        sums = dict((name, float(getattr(self, name))) for name in SCALARS)
+        for (name, category_name) in CATEGORY_SUMS:
+            sums[name] = getattr(self, name).tolist()
+        return sums
+
+    def load_dict(self, sums):
+        """Restore sums written by to_dict
+
+        Arguments:
+            sums {dictionary} -- sums keyed by name
+        """
+
+        for name in SCALARS:
+            setattr(self, name, numpy.float64(sums[name]))
+        for (name, category_name) in CATEGORY_SUMS:
+            # Sums added since the accumulators were saved stay zero
+            if name in sums:
+                setattr(self, name, numpy.array(sums[name], dtype=numpy.float64))
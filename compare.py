@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+
+"""compare.py: Runs two engine configurations on the same inputs and compares their results and runtimes."""
+
+__copyright__ = """
+    Copyright (C) 2018 San Francisco Estuary Institute (SFEI)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import csv
+import time
+import argparse
+import numpy
+import core
+import results_store
+
+# Statistics tables compared row by row, keyed by their first column
+TABLE_FILE_NAMES = ("results_wsStats.csv", "results_luStats.csv")
+
+# Results store columns identifying polygons rather than holding results
+STORE_KEY_COLUMNS = ("uID", "watershed")
+
+REPORT_HEADERS = ["Table", "Column", "Compared", "Exceeding", "Max Abs. Deviation",
+                  "Max Rel. Deviation", "Worst Key", "Baseline Value", "Candidate Value"]
+
+
+def run_engine(config_file_name, options):
+    """Run the analysis with configuration overrides, timing it
+
+    Arguments:
+        config_file_name {string} -- path to configuration file
+        options {dictionary} -- parameter values overriding the configuration file
+
+    Returns:
+        tuple -- workspace path and elapsed seconds
+    """
+
+    import rwsm  # only runs need arcpy
+
+    config = core.load_config(config_file_name)
+    for (option, value) in options.items():
+        config.set("RWSM", option, str(value))
+    # Both engines compute every watershed and keep per-polygon results
+    config.set("RWSM", "previous_run", "")
+    config.set("RWSM", "results_store", "True")
+
+    start_time = time.time()
+    (workspace, intersected_watersheds) = rwsm.run_analysis(config=config)
+    return (workspace, time.time() - start_time)
+
+
+def to_float(value):
+    """Numeric value of a table cell, blank cells are zero (e.g. land use percentages)
+
+    Arguments:
+        value {string} -- cell value
+
+    Returns:
+        float -- value, None if the cell is not numeric
+    """
+
+    if value == "":
+        return 0.0
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_deviations(baseline, candidate, abs_tol, rel_tol):
+    """Absolute and relative deviations of candidate values, and whether they exceed tolerance
+
+    Values are within tolerance when |candidate - baseline| <= abs_tol + rel_tol * |baseline|,
+    matching NaNs are equal.
+
+    Arguments:
+        baseline {array} -- baseline values
+        candidate {array} -- candidate values
+        abs_tol {float} -- absolute tolerance
+        rel_tol {float} -- relative tolerance
+
+    Returns:
+        tuple -- absolute deviations, relative deviations and exceeding flags
+    """
+
+    baseline = numpy.asarray(baseline, dtype=numpy.float64)
+    candidate = numpy.asarray(candidate, dtype=numpy.float64)
+    both_nan = numpy.isnan(baseline) & numpy.isnan(candidate)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        abs_dev = numpy.where(both_nan, 0.0, numpy.abs(candidate - baseline))
+        rel_dev = numpy.where(abs_dev == 0, 0.0, abs_dev / numpy.abs(baseline))
+    abs_dev[numpy.isnan(abs_dev)] = numpy.inf
+    rel_dev[numpy.isnan(rel_dev)] = numpy.inf
+    exceeds = abs_dev > abs_tol + rel_tol * numpy.nan_to_num(numpy.abs(baseline))
+    return (abs_dev, rel_dev, exceeds)
+
+
+class Comparison(object):
+    """Column by column deviations between a baseline and a candidate run
+
+    Arguments:
+        object {object} -- Remenant of python 2.7, declares new-style class
+
+    Returns:
+        Comparison -- Comparison instance
+    """
+
+    def __init__(self, abs_tol=0.0, rel_tol=1e-6):
+        """Class initialization
+
+        Keyword Arguments:
+            abs_tol {float} -- absolute tolerance (default: {0.0})
+            rel_tol {float} -- relative tolerance (default: {1e-6})
+        """
+
+        self.abs_tol = abs_tol
+        self.rel_tol = rel_tol
+        self.columns = []
+        self.watersheds = set()
+        self.missing = []
+        self.times = None
+
+    def add_column(self, table, column, keys, baseline, candidate, watersheds=None):
+        """Compare the values of one column
+
+        Arguments:
+            table {string} -- table name
+            column {string} -- column name
+            keys {list} -- row key of every value
+            baseline {array} -- baseline values
+            candidate {array} -- candidate values
+
+        Keyword Arguments:
+            watersheds {list} -- watershed of every value, exceeding watersheds are recorded (default: {None})
+        """
+
+        (abs_dev, rel_dev, exceeds) = get_deviations(
+            baseline, candidate, self.abs_tol, self.rel_tol)
+        row = [table, column, len(abs_dev), int(numpy.sum(exceeds)), 0.0, 0.0, "", "", ""]
+        if len(abs_dev) > 0:
+            worst = int(numpy.argmax(abs_dev))
+            row[4:] = [abs_dev[worst], numpy.max(rel_dev), keys[worst],
+                       baseline[worst], candidate[worst]]
+        self.columns.append(row)
+        if watersheds is not None:
+            self.watersheds.update(numpy.asarray(watersheds)[exceeds].tolist())
+
+    def add_missing(self, table, key, run):
+        """Record a row present in one run only
+
+        Arguments:
+            table {string} -- table name
+            key {string} -- row key
+            run {string} -- run holding the row, baseline or candidate
+        """
+
+        self.missing.append((table, key, run))
+
+    def compare_tables(self, baseline_file_name, candidate_file_name, table, watershed_columns=False):
+        """Compare statistics tables, rows keyed by their first column
+
+        Arguments:
+            baseline_file_name {string} -- baseline CSV file
+            candidate_file_name {string} -- candidate CSV file
+            table {string} -- table name
+
+        Keyword Arguments:
+            watershed_columns {bool} -- columns are watersheds (luStats), rather than rows (default: {False})
+        """
+
+        baseline_rows = core.load_csv(baseline_file_name)
+        candidate_rows = core.load_csv(candidate_file_name)
+        baseline = dict((row[0], row) for row in baseline_rows[1:] if row)
+        candidate = dict((row[0], row) for row in candidate_rows[1:] if row)
+        for key in sorted(set(baseline).symmetric_difference(candidate)):
+            self.add_missing(table, key, "baseline" if key in baseline else "candidate")
+            if not watershed_columns:
+                self.watersheds.add(key)
+
+        keys = sorted(set(baseline).intersection(candidate))
+        candidate_columns = dict((header, i) for (i, header) in enumerate(candidate_rows[0]))
+        for (i, header) in enumerate(baseline_rows[0]):
+            if i == 0:
+                continue
+            if header not in candidate_columns:
+                self.add_missing(table, header, "baseline")
+                if watershed_columns:
+                    self.watersheds.add(header)
+                continue
+            j = candidate_columns[header]
+            pairs = [(key, to_float(baseline[key][i]), to_float(candidate[key][j]))
+                     for key in keys]
+            numeric = [(key, base, cand) for (key, base, cand) in pairs
+                       if base is not None and cand is not None]
+            if not numeric:
+                continue
+            self.add_column(
+                table, header, [key for (key, base, cand) in numeric],
+                numpy.array([base for (key, base, cand) in numeric]),
+                numpy.array([cand for (key, base, cand) in numeric]),
+                [header] * len(numeric) if watershed_columns else [key for (key, base, cand) in numeric])
+
+    def compare_stores(self, baseline_path, candidate_path):
+        """Compare per-polygon results, polygons matched by watershed and uID
+
+        Arguments:
+            baseline_path {string} -- baseline results store directory
+            candidate_path {string} -- candidate results store directory
+        """
+
+        baseline = results_store.Results_Store(baseline_path)
+        candidate = results_store.Results_Store(candidate_path)
+        columns = [name for name in baseline.column_names
+                   if name in candidate.column_names and name not in STORE_KEY_COLUMNS]
+
+        keys = []
+        watersheds = []
+        matched = ([], [])
+        for watershed_name in sorted(set(baseline.categories["watershed"]).union(
+                candidate.categories["watershed"])):
+            rows = [store.rows({"watershed": watershed_name}) for store in (baseline, candidate)]
+            uids = [numpy.asarray(store.column("uID"))[store_rows]
+                    for (store, store_rows) in zip((baseline, candidate), rows)]
+            common = numpy.intersect1d(uids[0], uids[1])
+            if len(common) < max(len(uids[0]), len(uids[1])):
+                self.add_missing("polygons", "{}: {} of {} / {} polygons matched".format(
+                    watershed_name, len(common), len(uids[0]), len(uids[1])), "both")
+                self.watersheds.add(watershed_name)
+            for (k, (store_rows, store_uids)) in enumerate(zip(rows, uids)):
+                order = numpy.argsort(store_uids)
+                matched[k].append(store_rows[order[numpy.searchsorted(
+                    store_uids[order], common)]])
+            keys += ["{}:{}".format(watershed_name, uid) for uid in common.tolist()]
+            watersheds += [watershed_name] * len(common)
+
+        baseline_rows = numpy.concatenate(matched[0]) if matched[0] else numpy.zeros(0, dtype=int)
+        candidate_rows = numpy.concatenate(matched[1]) if matched[1] else numpy.zeros(0, dtype=int)
+        for name in columns:
+            if name in baseline.categories:
+                # Categories are compared as values, codes may differ between stores
+                equal = baseline.column(name, decode=True)[baseline_rows] == \
+                    candidate.column(name, decode=True)[candidate_rows]
+                self.add_column("polygons", name, keys, numpy.zeros(len(keys)),
+                                numpy.where(equal, 0.0, numpy.inf), watersheds)
+            else:
+                self.add_column("polygons", name, keys,
+                                numpy.asarray(baseline.column(name))[baseline_rows],
+                                numpy.asarray(candidate.column(name))[candidate_rows], watersheds)
+
+    def compare_workspaces(self, baseline_workspace, candidate_workspace):
+        """Compare statistics tables and results stores of two run workspaces
+
+        Arguments:
+            baseline_workspace {string} -- baseline run workspace
+            candidate_workspace {string} -- candidate run workspace
+        """
+
+        for file_name in TABLE_FILE_NAMES:
+            self.compare_tables(os.path.join(baseline_workspace, file_name),
+                                os.path.join(candidate_workspace, file_name),
+                                file_name, watershed_columns=file_name == "results_luStats.csv")
+        stores = [os.path.join(workspace, "results_store")
+                  for workspace in (baseline_workspace, candidate_workspace)]
+        if all(os.path.isdir(store) for store in stores):
+            self.compare_stores(*stores)
+
+    def has_failures(self):
+        """Whether any value exceeds tolerance or any row is missing
+
+        Returns:
+            bool -- True if the runs differ
+        """
+
+        return bool(self.missing) or any(row[3] > 0 for row in self.columns)
+
+    def report(self):
+        """Summary lines: speedup, columns exceeding tolerance and their watersheds
+
+        Returns:
+            list -- report lines
+        """
+
+        lines = []
+        if self.times is not None:
+            (baseline_time, candidate_time) = self.times
+            lines.append("Baseline {:.1f} s, candidate {:.1f} s, speedup {:.2f}x".format(
+                baseline_time, candidate_time,
+                baseline_time / candidate_time if candidate_time > 0 else float("inf")))
+        lines.append("Tolerance: abs {:g}, rel {:g}".format(self.abs_tol, self.rel_tol))
+        for row in sorted(self.columns, key=lambda row: -row[4]):
+            if row[3] > 0:
+                lines.append("{} {}: {} of {} values exceed, max abs {:g} (rel {:g}) at {}".format(
+                    row[0], row[1], row[3], row[2], row[4], row[5], row[6]))
+        for (table, key, run) in self.missing:
+            lines.append("{}: {} only in {}".format(table, key, run))
+        if self.watersheds:
+            lines.append("Watersheds exceeding tolerance: {}".format(
+                ", ".join(sorted(self.watersheds))))
+        lines.append("Runs differ" if self.has_failures() else "Runs agree within tolerance")
+        return lines
+
+    def write_report(self, output_file_name):
+        """Write per-column deviations to CSV
+
+        Arguments:
+            output_file_name {string} -- CSV file name
+        """
+
+        with open(output_file_name, "wb") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(REPORT_HEADERS)
+            for row in self.columns:
+                writer.writerow(row)
+
+
+def parse_options(assignments):
+    """Option overrides from OPTION=VALUE assignments
+
+    Arguments:
+        assignments {list} -- OPTION=VALUE strings
+
+    Returns:
+        dictionary -- values keyed by option
+    """
+
+    return dict(assignment.split("=", 1) for assignment in assignments)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run two engine configurations on the same inputs and compare their results.")
+    parser.add_argument("config", nargs="?", default="rwsm.ini",
+                        help="configuration file (default: rwsm.ini)")
+    parser.add_argument("--baseline", action="append", default=[], metavar="OPTION=VALUE",
+                        help="configuration override of the baseline engine")
+    parser.add_argument("--candidate", action="append", default=[], metavar="OPTION=VALUE",
+                        help="configuration override of the candidate engine")
+    parser.add_argument("--workspaces", nargs=2, metavar=("BASELINE", "CANDIDATE"),
+                        help="compare two finished run workspaces instead of running")
+    parser.add_argument("--abs-tol", type=float, default=0.0,
+                        help="absolute tolerance (default: 0)")
+    parser.add_argument("--rel-tol", type=float, default=1e-6,
+                        help="relative tolerance (default: 1e-6)")
+    parser.add_argument("--output", help="CSV file for per-column deviations")
+    args = parser.parse_args()
+
+    comparison = Comparison(args.abs_tol, args.rel_tol)
+    if args.workspaces:
+        (baseline_workspace, candidate_workspace) = args.workspaces
+    else:
+        (baseline_workspace, baseline_time) = run_engine(
+            args.config, parse_options(args.baseline))
+        (candidate_workspace, candidate_time) = run_engine(
+            args.config, parse_options(args.candidate))
+        comparison.times = (baseline_time, candidate_time)
+
+    comparison.compare_workspaces(baseline_workspace, candidate_workspace)
+    for line in comparison.report():
+        print(line)
+    comparison.write_report(args.output or os.path.join(
+        candidate_workspace, "compare_report.csv"))
+    sys.exit(1 if comparison.has_failures() else 0)
@@ -0,0 +1,587 @@
+#!/usr/bin/env python
+
+"""core.py: Model logic needing only the standard library and NumPy, importable without arcpy."""
+
+__copyright__ = """
+    Copyright (C) 2018 San Francisco Estuary Institute (SFEI)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import math
+import csv
+import ConfigParser
+import datetime
+import logging
+import time
+import numpy
+
+# Soil type codes of the runoff coefficient table
+SOIL_TYPE_VALUES = {'A': 10, 'B': 20, 'C': 30, 'D': 40,
+                    'ROCK': 50, 'UNCLASS': 60, 'WATER': 70, 'null': 0}
+
+
+def strip_chars(watershed_name, strip_set):
+    """Strips illegal characters from watershed name
+    
+    Arguments:
+        watershed_name {string} -- name for the watershed of interest, should avoid numeric as first character
+        strip_set {string} -- characters to remove from watershed name
+    
+    Returns:
+        string -- watershed name with characters from strip_set removed
+    """
+
+    watershed_name_tmp = ''.join(watershed_name.split())
+    for char in strip_set:
+        watershed_name_tmp = watershed_name_tmp.replace(char, '')
+    return watershed_name_tmp
+
+
+def get_logger(logger_level):
+    """Initialize a logger instance
+    
+    Arguments:
+        logger_level {level} -- enumerated, numeric value corresponding to logging level
+    
+    Returns:
+        instance -- instance of python logger
+    """
+    
+    logging.basicConfig(level=logger_level)
+    logger = logging.getLogger(__name__)
+    return logger
+
+
+def get_raster_maximum(file_name):
+    """Integer maximum of a raster, arcpy is imported only when this is called
+
+    Arguments:
+        file_name {string} -- raster path
+
+    Returns:
+        int -- raster maximum
+    """
+
+    import arcpy
+    return int(arcpy.sa.Raster(file_name).maximum)
+
+
+def load_slope_bins(config, get_dict=False, slope_raster_max=None):
+    """Populate slope bin list structure. Reteurn dictionary if specified.
+    
+    Arguments:
+        config {instance} -- ConfigParser instance holding RWSM parameters
+    
+    Keyword Arguments:
+        get_dict {bool} -- Choose to return a dictionary of slope values, default is a list (default: {False})
+        slope_raster_max {int} -- upper bound of open ended bins, read from the slope raster if needed and None (default: {None})
+    
+    Returns:
+        dictionary or list -- slope bins contained within a dictionary or list
+    """
+
+    runoff_coeff_file_name = config.get("RWSM", "runoff_coeff_file_name")
+    slope_file_name = config.get("RWSM", "slope_file_name")
+    slope_bin_field = config.get("RWSM", "runoff_coeff_slope_bin_field")
+
+    if get_dict:
+        slope_bins = {}
+    else:
+        slope_bins = []
+
+    slope_bins_strs = []
+
+    # Gather unique slope bin values
+    with open(runoff_coeff_file_name, 'rb') as csvfile:
+        reader = csv.reader(csvfile)
+        headers = next(reader, None)  # skip the headers
+        slope_idx = headers.index(slope_bin_field)
+        for row in reader:
+            slope = row[slope_idx]
+            if slope not in slope_bins_strs:
+                slope_bins_strs.append(slope)
+
+    # Open ended bins (e.g. "30+%") stop at the slope raster maximum
+    if slope_raster_max is None and any("+" in slope_bin for slope_bin in slope_bins_strs):
+        slope_raster_max = get_raster_maximum(slope_file_name)
+
+    # Convert strings to numeric values
+    if get_dict:
+        for slope_bin in slope_bins_strs:
+            if "+" in slope_bin:
+                slope_bins[slope_bin] = [
+                    int(slope_bin.strip("+").strip("%")), slope_raster_max]
+            else:
+                slope_bins[slope_bin] = map(lambda x: int(
+                    x), slope_bin.strip("%").split("-"))
+    else:
+        for slope_bin in slope_bins_strs:
+            if "+" in slope_bin:
+                slope_bins.append(
+                    [int(slope_bin.strip("+").strip("%")), slope_raster_max])
+            else:
+                slope_bins.append(
+                    map(lambda x: int(x), slope_bin.strip("%").split("-")))
+
+    return slope_bins
+
+
+def load_land_use_table(config):
+    """Load unique sets of land use codes, land use descriptions, and classifications
+    
+    Arguments:
+        config {instance} -- ConfigParser instance containing RWSM parameters
+    
+    Returns:
+        list -- list of triplets containing each observed code, description and classification combination
+    """
+
+
+    # Gather relevant parameter values
+    file_name = config.get("RWSM", "land_use_LU_file_name")
+    code_field = config.get("RWSM", "land_use_field")
+    description_field = config.get("RWSM", "land_use_LU_desc_field")
+    classification_field = config.get("RWSM", "land_use_LU_class_field")
+
+    # Populate values structure with unique triples
+    values = []
+    with open(file_name, 'rb') as csvfile:
+        reader = csv.reader(csvfile)
+        headers = reader.next()
+        code_idx = headers.index(code_field)
+        description_idx = headers.index(description_field)
+        classification_idx = headers.index(classification_field)
+
+        for row in reader:
+            code = row[code_idx]
+            description = row[description_idx]
+            classification = row[classification_idx]
+            if (code, description, classification) not in values:
+                values.append((code, description, classification))
+
+    return values
+
+
+# TODO: Check if we want to dynamically apply coefficient fields based on location category
+
+
+def load_runoff_coeff_lu(file_name, coefficient_field):
+    """Helper function for populating land use data structure
+    
+    Arguments:
+        file_name {string} -- path to runoff coefficient file
+        coefficient_field {string} -- field name for column containing runoff coefficients
+    
+    Returns:
+        dictionary -- dictionary containing two dictionaries; dict of triplets for each set of runoff parameters
+            (i.e. slope, soil, category) assigned to coefficients, dict for converting codes to coefficients.
+    """
+
+
+    # Initialize data structure, dictionary with three valued tuples
+    runoff_lu = {
+        "sets": {},
+        "codes": {}
+    }
+
+    # Read and loop through CSV, populate structure
+    with open(file_name, 'rb') as csvfile:
+        reader = csv.reader(csvfile)
+        headers = reader.next()
+        coeff_index = headers.index(coefficient_field)
+        for row in reader:
+            slope = row[1]
+            soil = row[2]
+            category = row[3]
+            code = row[7]
+            coeff = row[coeff_index]
+            runoff_set = (slope, soil, category)
+            if runoff_set not in runoff_lu["sets"].keys():
+                runoff_lu["sets"][runoff_set] = coeff
+            runoff_lu["codes"][code] = coeff
+    return runoff_lu
+
+
+# Read parameter values from configuration file
+
+
+def load_config(file_name):
+    """Instantiate and return ConfigParser instance containing RWSM parameters
+    
+    Arguments:
+        file_name {string} -- path to configuration file
+    
+    Returns:
+        instance -- ConfigParser instance containing RWSM parameters
+    """
+
+    config = ConfigParser.ConfigParser()
+    config.readfp(open(file_name))
+    return config
+
+
+def get_empty_config():
+    """Instantiate blank ConfigParser instance
+    
+    Returns:
+        instance -- blank ConfigParser instance
+    """
+
+    config = ConfigParser.ConfigParser()
+    return config
+
+
+def get_config_option(config, option, default=None):
+    """Read an optional RWSM parameter, falling back to a default when absent
+
+    Arguments:
+        config {instance} -- ConfigParser instance containing RWSM parameters
+        option {string} -- name of the parameter
+
+    Keyword Arguments:
+        default {object} -- value returned when the parameter is not set (default: {None})
+
+    Returns:
+        string -- parameter value, or default
+    """
+
+    if config.has_option("RWSM", option) and config.get("RWSM", option) not in ("", "None"):
+        return config.get("RWSM", option)
+    return default
+
+
+def get_config_boolean(config, option, default=False):
+    """Read an optional boolean RWSM parameter
+
+    Arguments:
+        config {instance} -- ConfigParser instance containing RWSM parameters
+        option {string} -- name of the parameter
+
+    Keyword Arguments:
+        default {bool} -- value returned when the parameter is not set (default: {False})
+
+    Returns:
+        bool -- parameter value, or default
+    """
+
+    value = get_config_option(config, option)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def get_covariates(config):
+    """Additional rasters reduced to per-polygon means, from covariates = name=path;name=path
+
+    Arguments:
+        config {instance} -- ConfigParser instance containing RWSM parameters
+
+    Raises:
+        ValueError -- an entry is not of the form name=path
+
+    Returns:
+        list -- (name, raster path) tuples, names reduced to letters, digits and underscores
+    """
+
+    value = get_config_option(config, "covariates")
+    if value is None:
+        return []
+    covariates = []
+    for entry in value.split(";"):
+        if not entry.strip():
+            continue
+        if "=" not in entry:
+            raise ValueError("covariates entry '{}' is not of the form name=path".format(entry.strip()))
+        (name, file_name) = entry.split("=", 1)
+        covariates.append((re.sub("[^0-9a-zA-Z_]", "_", name.strip()), file_name.strip()))
+    return covariates
+
+
+def get_modified_time(path):
+    """Modification time of a file, or of the nearest existing parent of a dataset path
+
+    Datasets within a geodatabase are not files, the geodatabase folder is used instead.
+
+    Arguments:
+        path {string} -- file or dataset path
+
+    Returns:
+        float -- modification time, None if no part of the path exists
+    """
+
+    if not path:
+        return None
+    while path and not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+    if not path:
+        return None
+    return os.path.getmtime(path)
+
+
+# Write configuration file using user supplied values
+
+
+def write_config(file_name, params):
+    """Writes config instance to file for future use.
+    
+    Arguments:
+        file_name {string} -- path for output file
+        params {list} -- list of arcpy parameter instances, object obtained from GUI
+    """
+
+    config = ConfigParser.RawConfigParser()
+
+    config.add_section("RWSM")
+
+    for param in params:
+        config.set("RWSM", param.name, param.valueAsText)
+
+
+def load_csv(file_name):
+    """Read in CSV file
+    
+    Arguments:
+        file_name {string} -- path to CSV file
+    
+    Returns:
+        list -- list from CSV reader
+    """
+
+    with open(file_name, "r") as csv_file:
+        reader = csv.reader(csv_file, delimiter=",")
+        return list(reader)
+
+
+def calculateCode(slpValue, geolValue, luValue, geolName):
+    """Calculates code for each unique land unit, used in runoff coeff lookup table
+    
+    Arguments:
+        slpValue {string} -- slope bin value
+        geolValue {string} -- geologic bin value (e.g. soils bin value)
+        luValue {float} -- land use lookup value
+        geolName {string} -- field name for geologic values (e.g. soil)
+    
+    Returns:
+        float -- numeric code represneting combination of slope, geologic, and lookup values
+    """
+
+
+    geolValues = {'A': 10, 'B': 20, 'C': 30, 'D': 40,
+                  'ROCK': 50, 'UNCLASS': 60, 'WATER': 70}
+
+    if geolValue in geolValues:
+        geolValueOut = geolValues[geolValue]
+    else:
+        geolValueOut = 0
+    if not slpValue:
+        slpValue = 0
+    if not luValue:
+        luValue = 0.0
+
+    return slpValue + geolValueOut + luValue
+
+
+def format_time(t):
+    """Date formatting for arcpy message output
+    
+    Arguments:
+        t {time} -- time to format
+    
+    Returns:
+        string -- fomatted time for display within arcpy console output
+    """
+
+    return str(datetime.timedelta(seconds=round(time.clock() - t)))
+
+
+def get_code_to_coeff_lookup(config, slope_raster_max=None):
+    """Obtain code to coefficient dictionary
+    
+    Arguments:
+        config {instance} -- ConfigParser instance containing RWSM parameters
+    
+    Keyword Arguments:
+        slope_raster_max {int} -- upper bound of open ended slope bins, see load_slope_bins (default: {None})
+    
+    Returns:
+        dictionary -- dictionary for converting codes to coefficients.
+    """
+
+
+    # Output data structure
+    code_to_coeff_lookup = {}
+
+    # Load values from config
+    runoff_coeff_file_name = config.get("RWSM", "runoff_coeff_file_name")
+    runoff_coeff_slope_bin_field = config.get(
+        "RWSM", "runoff_coeff_slope_bin_field")
+    runoff_coeff_field = config.get("RWSM", "runoff_coeff_field")
+    runoff_coeff_soil_type_field = config.get(
+        "RWSM", "runoff_coeff_soil_type_field")
+    runoff_coeff_land_use_class_code_field = config.get(
+        "RWSM", "runoff_coeff_land_use_class_code_field")
+
+    # Specify soil values, only remaining hard-coded references
+    soil_type_values = SOIL_TYPE_VALUES
+
+    # Obtain dictionary mapping slope bins observed in runoff file with codes
+    slope_bins = load_slope_bins(
+        config=config, get_dict=True, slope_raster_max=slope_raster_max)
+    slope_bins_w_codes = {}
+    slope_bin_code = 100
+    for slope_bin in slope_bins.keys():
+        slope_bins_w_codes[slope_bin] = slope_bin_code
+        slope_bin_code += 100
+
+    with open(runoff_coeff_file_name, 'rb') as csvfile:
+        reader = csv.reader(csvfile)
+        headers = next(reader, None)
+
+        # Get indicies
+        slope_bin_idx = headers.index(runoff_coeff_slope_bin_field)
+        coeff_idx = headers.index(runoff_coeff_field)
+        soil_type_idx = headers.index(runoff_coeff_soil_type_field)
+        land_use_class_code_idx = headers.index(
+            runoff_coeff_land_use_class_code_field)
+
+        for row in reader:
+            slope_bin_val = row[slope_bin_idx]
+            coeff_val = float(row[coeff_idx])
+            soil_type = row[soil_type_idx]
+            land_use_class_code = float(row[land_use_class_code_idx])
+
+            # Get code for slope bin, convert string and lookup in structure
+            slope_bin_code = slope_bins_w_codes[slope_bin_val]
+
+            soil_type_code = soil_type_values[soil_type]
+            code = slope_bin_code + soil_type_code + land_use_class_code
+            code_to_coeff_lookup[code] = coeff_val
+
+    return code_to_coeff_lookup
+
+
+def slope_fraction_field(slope_bin_code):
+    """Name of the field holding a polygon's area fraction within a slope bin
+
+    Arguments:
+        slope_bin_code {int} -- slope bin code (e.g. 100, 200, ...)
+
+    Returns:
+        string -- field name
+    """
+
+    return "slope_frac_{}".format(int(slope_bin_code))
+
+
+def calculateCodes(slpValues, geolValues, luValues):
+    """Vectorized calculateCode, values are broadcast against each other
+
+    Arguments:
+        slpValues {array} -- slope bin codes
+        geolValues {array} -- geologic bin values (e.g. soils bin values)
+        luValues {array} -- land use lookup values
+
+    Returns:
+        array -- numeric codes representing combinations of slope, geologic, and lookup values
+    """
+
+    geolValues = numpy.asarray(geolValues)
+    geol_unique, geol_inverse = numpy.unique(geolValues, return_inverse=True)
+    geol_codes = numpy.array(
+        [calculateCode(0, value, 0.0, None) for value in geol_unique])
+    geolCodes = geol_codes[geol_inverse].reshape(geolValues.shape)
+
+    luValues = numpy.asarray(luValues)
+    lu_unique, lu_inverse = numpy.unique(luValues, return_inverse=True)
+    lu_codes = numpy.array(
+        [float(value) if value not in ('', None) else 0.0 for value in lu_unique])
+    luCodes = lu_codes[lu_inverse].reshape(luValues.shape)
+
+    # Same order of addition as calculateCode, keeps codes identical to lookup keys
+    return (numpy.asarray(slpValues) + geolCodes) + luCodes
+
+
+def lookupCoefficients(codes, codes_to_coeff_lookup):
+    """Vectorized code to runoff coefficient lookup
+
+    Arguments:
+        codes {array} -- codes from calculateCodes
+        codes_to_coeff_lookup {dictionary} -- output of get_code_to_coeff_lookup
+
+    Returns:
+        array -- runoff coefficients, NaN where a code is missing from the lookup
+    """
+
+    codes = numpy.asarray(codes)
+    code_unique, code_inverse = numpy.unique(codes, return_inverse=True)
+    coeffs = numpy.array([codes_to_coeff_lookup.get(code, numpy.nan)
+                          for code in code_unique.tolist()])
+    return coeffs[code_inverse].reshape(codes.shape)
+
+
+def get_tile_count(area, n_features, max_area=0, max_features=0):
+    """Number of tiles a watershed is split into so that each is within the thresholds
+
+    Arguments:
+        area {float} -- watershed area, in square map units
+        n_features {int} -- land use and soils features within the watershed
+
+    Keyword Arguments:
+        max_area {float} -- largest tile area, no area threshold if 0 (default: {0})
+        max_features {int} -- most features per tile, no feature threshold if 0 (default: {0})
+
+    Returns:
+        int -- number of tiles, 1 when the watershed is within both thresholds
+    """
+
+    n_tiles = 1
+    if max_area > 0:
+        n_tiles = max(n_tiles, int(math.ceil(float(area) / max_area)))
+    if max_features > 0:
+        n_tiles = max(n_tiles, int(math.ceil(float(n_features) / max_features)))
+    return n_tiles
+
+
+def split_extent(xmin, ymin, xmax, ymax, n_tiles):
+    """Grid of at least n_tiles tiles, as close to square as the extent allows
+
+    Arguments:
+        xmin {float} -- extent minimum x
+        ymin {float} -- extent minimum y
+        xmax {float} -- extent maximum x
+        ymax {float} -- extent maximum y
+        n_tiles {int} -- number of tiles wanted
+
+    Returns:
+        tuple -- (xmin, ymin, xmax, ymax) of every tile, row by row, and the x and y of the
+            grid lines between tiles
+    """
+
+    (width, height) = (float(xmax - xmin), float(ymax - ymin))
+    if height > 0 and width > 0:
+        n_columns = max(int(round(math.sqrt(n_tiles * width / height))), 1)
+    else:
+        n_columns = n_tiles if width > 0 else 1
+    n_columns = min(n_columns, n_tiles)
+    n_rows = int(math.ceil(float(n_tiles) / n_columns))
+    xs = [xmin + width * i / n_columns for i in range(n_columns)] + [xmax]
+    ys = [ymin + height * j / n_rows for j in range(n_rows)] + [ymax]
+    tiles = [(xs[i], ys[j], xs[i + 1], ys[j + 1]) for j in range(n_rows) for i in range(n_columns)]
+    return (tiles, xs[1:-1], ys[1:-1])
@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+
+"""daemon.py: Long-lived analysis service keeping inputs and lookup tables resident between requests."""
+
+__copyright__ = """
+    Copyright (C) 2018 San Francisco Estuary Institute (SFEI)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import csv
+import time
+import argparse
+from multiprocessing.connection import Listener, Client
+import core
+import results_store
+
+# Service listens on the local machine only
+DEFAULT_HOST = "localhost"
+DEFAULT_PORT = 6543
+DEFAULT_AUTHKEY = "rwsm"
+
+
+def get_address(config):
+    """Local address of the service
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+
+    Returns:
+        tuple -- host and port
+    """
+
+    return (DEFAULT_HOST, int(core.get_config_option(config, "daemon_port", DEFAULT_PORT)))
+
+
+def get_authkey(config):
+    """Key shared by the service and its clients
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+
+    Returns:
+        string -- authentication key
+    """
+
+    return core.get_config_option(config, "daemon_authkey", DEFAULT_AUTHKEY)
+
+
+def get_options(config):
+    """RWSM parameter values of a configuration
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+
+    Returns:
+        dictionary -- parameter values keyed by option
+    """
+
+    return dict((option, config.get("RWSM", option, raw=True))
+                for option in config.options("RWSM"))
+
+
+def to_rows(rows):
+    """Statistics rows with NumPy scalars converted to plain values
+
+    Arguments:
+        rows {list} -- statistics rows
+
+    Returns:
+        list -- converted rows
+    """
+
+    return [[results_store.to_json_value(value) for value in row] for row in rows]
+
+
+class Analysis_Service(object):
+    """Loads inputs once, then analyses watershed subsets on request
+
+    Requests are dictionaries with a command: "analyze" (with optional "watersheds" and
+    "options" overriding configuration values for that request), "reload", "ping" or
+    "shutdown". The configuration file is re-read before every request; rasters, slope
+    bins, lookup tables and dissolved watersheds are reloaded only when their options or
+    files change. arcpy is imported by the service only, clients need just core.
+
+    Arguments:
+        object {object} -- Remenant of python 2.7, declares new-style class
+
+    Returns:
+        Analysis_Service -- Analysis_Service instance
+    """
+
+    def __init__(self, config_file_name):
+        """Class initialization
+
+        Arguments:
+            config_file_name {string} -- path to configuration file
+        """
+
+        self.config_file_name = os.path.abspath(config_file_name)
+        self.config = core.load_config(self.config_file_name)
+        self.inputs = None
+        self.validated_options = None
+        self.n_requests = 0
+        self.running = False
+
+    def get_config(self, options=None):
+        """Current configuration file values with request overrides
+
+        Keyword Arguments:
+            options {dictionary} -- parameter values overriding the configuration file (default: {None})
+
+        Returns:
+            instance -- ConfigParser instance
+        """
+
+        config = core.load_config(self.config_file_name)
+        for (option, value) in (options or {}).items():
+            config.set("RWSM", option, str(value))
+        return config
+
+    def validate(self, config):
+        """Validate inputs if the configuration differs from the last validated one
+
+        Arguments:
+            config {instance} -- ConfigParser instance holding parameter values
+        """
+
+        import rwsm
+
+        options = get_options(config)
+        if options != self.validated_options and core.get_config_boolean(config, "preflight"):
+            rwsm.validate_inputs(config)
+        self.validated_options = options
+
+    def load(self):
+        """Import arcpy and load the configured inputs"""
+
+        import helpers
+        import rwsm
+
+        self.validate(self.config)
+        workspace = os.path.join(
+            self.config.get("RWSM", "workspace"), "rwsm_daemon")
+        (temp_file_name, out_file_name, workspace) = helpers.init_workspace(workspace)
+        self.inputs = rwsm.Analysis_Inputs(self.config)
+        self.inputs.load(workspace, os.path.join(workspace, temp_file_name))
+
+    def reload(self, options=None):
+        """Reload resources whose options or files changed
+
+        Keyword Arguments:
+            options {dictionary} -- parameter values overriding the configuration file (default: {None})
+
+        Returns:
+            list -- names of the reloaded resources
+        """
+
+        config = self.get_config(options)
+        self.validate(config)
+        return self.inputs.reload(config)
+
+    def analyze(self, watershed_names=None, options=None):
+        """Analyse a subset of watersheds with the resident inputs
+
+        Keyword Arguments:
+            watershed_names {list} -- watersheds to analyse, all watersheds if None (default: {None})
+            options {dictionary} -- parameter values overriding the configuration file (default: {None})
+
+        Returns:
+            dictionary -- workspace, reloaded resources, statistics rows and watershed errors
+        """
+
+        import rwsm
+
+        reloaded = self.reload(options)
+        config = self.inputs.config
+
+        # Each request writes to its own workspace, numbered as timestamps may repeat
+        self.n_requests += 1
+        run = rwsm.Analysis_Run(config, workspace=os.path.join(
+            config.get("RWSM", "workspace"), "rwsm_request{:04d}".format(self.n_requests)))
+        run.open(self.inputs, self.inputs.select_watersheds(watershed_names))
+        rwsm.run_watersheds(self.inputs, run, run.watershed_names)
+        run.close()
+
+        return {
+            "workspace": run.workspace,
+            "reloaded": reloaded,
+            "ws_headers": run.writer.ws_headers,
+            "ws_stats": to_rows(run.writer.ws_stats),
+            "lu_stats": to_rows(run.writer.lu_stats),
+            "errors": [(watershed_name, str(error)) for (watershed_name, error) in run.watershed_errors]
+        }
+
+    def handle(self, request):
+        """Answer one request
+
+        Arguments:
+            request {dictionary} -- request holding a command and its arguments
+
+        Returns:
+            dictionary -- response with a status and, for errors, an error message
+        """
+
+        start_time = time.time()
+        command = request.get("command")
+        try:
+            if command == "analyze":
+                response = self.analyze(request.get(
+                    "watersheds"), request.get("options"))
+            elif command == "reload":
+                response = {"reloaded": self.reload(request.get("options"))}
+            elif command == "ping":
+                response = {"watersheds": self.inputs.watershed_names}
+            elif command == "shutdown":
+                self.running = False
+                response = {}
+            else:
+                raise ValueError("Unknown command: {}".format(command))
+            response["status"] = "ok"
+        except Exception as error:
+            response = {"status": "error", "error": "{}: {}".format(
+                type(error).__name__, error)}
+        response["seconds"] = round(time.time() - start_time, 3)
+        return response
+
+    def serve_forever(self):
+        """Load inputs, then answer requests one at a time until shut down"""
+
+        self.load()
+        address = get_address(self.config)
+        listener = Listener(address, authkey=get_authkey(self.config))
+        print("RWSM service listening on {}:{}".format(*address))
+        self.running = True
+        try:
+            while self.running:
+                connection = listener.accept()
+                try:
+                    while self.running:
+                        try:
+                            request = connection.recv()
+                        except EOFError:
+                            break
+                        connection.send(self.handle(request))
+                finally:
+                    connection.close()
+        finally:
+            listener.close()
+
+
+def send_request(request, config):
+    """Send a request to a running service
+
+    Arguments:
+        request {dictionary} -- request holding a command and its arguments
+        config {instance} -- ConfigParser instance holding the service address
+
+    Returns:
+        dictionary -- service response
+    """
+
+    connection = Client(get_address(config), authkey=get_authkey(config))
+    try:
+        connection.send(request)
+        return connection.recv()
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the RWSM analysis service, or send it a request.")
+    parser.add_argument("config", nargs="?", default="rwsm.ini",
+                        help="configuration file (default: rwsm.ini)")
+    parser.add_argument("--watersheds", nargs="*",
+                        help="analyse these watersheds (all if no names are given) with a running service")
+    parser.add_argument("--set", action="append", default=[], metavar="OPTION=VALUE",
+                        help="override a configuration value for the request")
+    parser.add_argument("--reload", action="store_true",
+                        help="reload changed inputs of a running service")
+    parser.add_argument("--shutdown", action="store_true",
+                        help="stop a running service")
+    args = parser.parse_args()
+
+    config = core.load_config(args.config)
+    options = dict(option.split("=", 1) for option in args.set)
+    if args.watersheds is not None:
+        request = {"command": "analyze",
+                   "watersheds": args.watersheds or None, "options": options}
+    elif args.reload:
+        request = {"command": "reload", "options": options}
+    elif args.shutdown:
+        request = {"command": "shutdown"}
+    else:
+        Analysis_Service(args.config).serve_forever()
+        sys.exit(0)
+
+    response = send_request(request, config)
+    if response["status"] != "ok":
+        sys.stderr.write(response["error"] + "\n")
+        sys.exit(1)
+    if "ws_stats" in response:
+        writer = csv.writer(sys.stdout, lineterminator="\n")
+        writer.writerow(response["ws_headers"])
+        writer.writerows(response["ws_stats"])
+        for (watershed_name, error) in response["errors"]:
+            sys.stderr.write("{}: {}\n".format(watershed_name, error))
+    else:
+        print(response)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+"""data_plane.py: Rasters and lookup tables published once to memory mapped files, attached by worker processes as read-only NumPy views."""
+
+__copyright__ = """
+    Copyright (C) 2018 San Francisco Estuary Institute (SFEI)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import numpy
+import raster_stack
+
+HEADER_FILE_NAME = "data_plane.json"
+
+# Arrays of the plane, each written to <name>.npy
+ARRAY_NAMES = ("slope_bins", "slope_bins_w_codes", "coeff_codes", "coeff_values")
+
+
+class Shared_Lookup(object):
+    """Read-only code to coefficient mapping over sorted key and value arrays
+
+    Stands in for the dictionary of core.get_code_to_coeff_lookup; keys are found by
+    binary search, so memory mapped arrays are used in place without building a dictionary.
+
+    Arguments:
+        object {object} -- Remenant of python 2.7, declares new-style class
+
+    Returns:
+        Shared_Lookup -- Shared_Lookup instance
+    """
+
+    def __init__(self, codes, values):
+        """Class initialization
+
+        Arguments:
+            codes {array} -- sorted codes
+            values {array} -- coefficient of each code
+        """
+
+        self.codes = codes
+        self.values = values
+
+    def find(self, code):
+        """Position of a code
+
+        Arguments:
+            code {number} -- code
+
+        Returns:
+            int -- index into codes and values, None if the code is absent
+        """
+
+        i = int(numpy.searchsorted(self.codes, code))
+        if i < len(self.codes) and self.codes[i] == code:
+            return i
+        return None
+
+    def __getitem__(self, code):
+        i = self.find(code)
+        if i is None:
+            raise KeyError(code)
+        return float(self.values[i])
+
+    def __contains__(self, code):
+        return self.find(code) is not None
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        return iter(self.codes.tolist())
+
+    def get(self, code, default=None):
+        """Coefficient of a code
+
+        Arguments:
+            code {number} -- code
+
+        Keyword Arguments:
+            default {object} -- returned when the code is absent (default: {None})
+
+        Returns:
+            float -- coefficient, or default
+        """
+
+        i = self.find(code)
+        return default if i is None else float(self.values[i])
+
+
+def publish_data_plane(inputs, directory, messages=None):
+    """Write the lookup tables of loaded inputs to memory mapped arrays, with a header for workers
+
+    The raster stack is published when the run opened one (raster_stack or covariates set),
+    so workers reduce the same rasters as a single process run. Feature classes, the model
+    rasters and the reclassified slope raster are shared by path.
+
+    Arguments:
+        inputs {Analysis_Inputs} -- loaded inputs
+        directory {string} -- folder receiving the arrays and header
+
+    Keyword Arguments:
+        messages {Tool_Messages} -- receiver of messages (default: {None})
+
+    Returns:
+        string -- header file name
+    """
+
+    import arcpy  # publishing reads arcpy handles, attaching does not
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    stack = inputs.raster_stack
+
+    codes = sorted(inputs.codes_to_coeff_lookup)
+    arrays = {
+        "slope_bins": numpy.array(inputs.slope_bins, dtype=numpy.int64),
+        "slope_bins_w_codes": numpy.array(inputs.slope_bins_w_codes, dtype=numpy.int64),
+        "coeff_codes": numpy.array(codes, dtype=numpy.float64),
+        "coeff_values": numpy.array([inputs.codes_to_coeff_lookup[code] for code in codes],
+                                    dtype=numpy.float64)
+    }
+    for name in ARRAY_NAMES:
+        numpy.save(os.path.join(directory, name + ".npy"), arrays[name])
+
+    header = {
+        "arrays": dict((name, name + ".npy") for name in ARRAY_NAMES),
+        "dissolved_watersheds": arcpy.Describe(inputs.dissolved_watersheds).catalogPath,
+        "watershed_names": list(inputs.watershed_names),
+        "slope_file_name": inputs.config.get("RWSM", "slope_file_name"),
+        "precipitation_file_name": inputs.config.get("RWSM", "precipitation_file_name"),
+        "slope_histogram": inputs.slope_histogram,
+        "slope_classes": None if inputs.slope_classes is None else arcpy.Describe(inputs.slope_classes).catalogPath,
+        "raster_stack": None if stack is None else stack.header_file_name
+    }
+    # The header is written last, workers never attach to a partly written plane
+    header_file_name = os.path.join(directory, HEADER_FILE_NAME)
+    with open(header_file_name, "w") as header_file:
+        json.dump(header, header_file, indent=2)
+    if messages is not None:
+        messages.add_message("Data plane: published {} ({:.1f} MB of rasters)".format(
+            header_file_name, 0.0 if stack is None else stack.data.nbytes / 1048576.0))
+    return header_file_name
+
+
+class Data_Plane(object):
+    """Read-only views of a published data plane
+
+    Arrays are opened memory mapped, so every worker attaching to a plane shares the
+    operating system's page cache rather than holding its own copy.
+
+    Arguments:
+        object {object} -- Remenant of python 2.7, declares new-style class
+
+    Returns:
+        Data_Plane -- Data_Plane instance
+    """
+
+    def __init__(self, header_file_name):
+        """Class initialization, attaches to every array of the plane
+
+        Arguments:
+            header_file_name {string} -- header written by publish_data_plane
+        """
+
+        with open(header_file_name) as header_file:
+            self.header = json.load(header_file)
+        directory = os.path.dirname(header_file_name)
+        self.arrays = dict((str(name), numpy.load(os.path.join(directory, file_name), mmap_mode="r"))
+                           for (name, file_name) in self.header["arrays"].items())
+        self.raster_stack = None
+        if self.header["raster_stack"]:
+            self.raster_stack = raster_stack.Raster_Stack(self.header["raster_stack"])
+        self.codes_to_coeff_lookup = Shared_Lookup(
+            self.arrays["coeff_codes"], self.arrays["coeff_values"])
+
+    def get_slope_bins(self):
+        """Slope bins as loaded by core.load_slope_bins, a small list rebuilt without parsing tables
+
+        Returns:
+            list -- [lower, upper] bounds per bin
+        """
+
+        return self.arrays["slope_bins"].tolist()
+
+    def get_slope_bins_w_codes(self):
+        """Slope bins with their codes
+
+        Returns:
+            list -- [lower, upper, code] per bin
+        """
+
+        return self.arrays["slope_bins_w_codes"].tolist()
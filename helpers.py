@@ -22,14 +22,25 @@ __copyright__ = """
 __copyright__ = "Copyright 2017, San Francisco Estuary Institute"
 
 import os
-import sys
-import csv
-import ConfigParser
 import arcpy
 import arcinfo
 import datetime
-import logging
-import time
+import threading
+import numpy
+import zonal
+
+# Table, configuration and code logic needing no arcpy lives in core,
+# re-exported here for existing callers.
+from core import (strip_chars, get_logger, get_raster_maximum, load_slope_bins,
+                  load_land_use_table,
+                  load_runoff_coeff_lu, load_config, get_empty_config,
+                  get_config_option, get_config_boolean, get_covariates, get_modified_time,
+                  write_config, load_csv, calculateCode, format_time,
+                  get_code_to_coeff_lookup, slope_fraction_field, calculateCodes,
+                  lookupCoefficients, get_tile_count, split_extent, SOIL_TYPE_VALUES)
+
+# Geoprocessing is not thread-safe, threads sharing a run hold this lock around arcpy calls
+GEOPROCESSING_LOCK = threading.RLock()
 
 # Log levels are for debugging the application via Python command line,
 # which is outside the scope of this initial beta release.
@@ -38,230 +49,6 @@ import time
 # LOG_LEVEL = logging.CRITICAL # Only show critical messages
 
 
-def strip_chars(watershed_name, strip_set):
-    """Strips illegal characters from watershed name
-    
-    Arguments:
-        watershed_name {string} -- name for the watershed of interest, should avoid numeric as first character
-        strip_set {string} -- characters to remove from watershed name
-    
-    Returns:
-        string -- watershed name with characters from strip_set removed
-    """
-
-    watershed_name_tmp = ''.join(watershed_name.split())
-    for char in strip_set:
-        watershed_name_tmp = watershed_name_tmp.replace(char, '')
-    return watershed_name_tmp
-
-
-def get_logger(logger_level):
-    """Initialize a logger instance
-    
-    Arguments:
-        logger_level {level} -- enumerated, numeric value corresponding to logging level
-    
-    Returns:
-        instance -- instance of python logger
-    """
-    
-    logging.basicConfig(level=logger_level)
-    logger = logging.getLogger(__name__)
-    return logger
-
-
-def load_slope_bins(config, get_dict=False):
-    """Populate slope bin list structure. Reteurn dictionary if specified.
-    
-    Arguments:
-        config {instance} -- ConfigParser instance holding RWSM parameters
-    
-    Keyword Arguments:
-        get_dict {bool} -- Choose to return a dictionary of slope values, default is a list (default: {False})
-    
-    Returns:
-        dictionary or list -- slope bins contained within a dictionary or list
-    """
-
-    runoff_coeff_file_name = config.get("RWSM", "runoff_coeff_file_name")
-    slope_file_name = config.get("RWSM", "slope_file_name")
-    slope_bin_field = config.get("RWSM", "runoff_coeff_slope_bin_field")
-
-    if get_dict:
-        slope_bins = {}
-    else:
-        slope_bins = []
-
-    slope_bins_strs = []
-    slope_raster = arcpy.sa.Raster(slope_file_name)
-    slope_raster_max = int(slope_raster.maximum)
-
-    # Gather unique slope bin values
-    with open(runoff_coeff_file_name, 'rb') as csvfile:
-        reader = csv.reader(csvfile)
-        headers = next(reader, None)  # skip the headers
-        slope_idx = headers.index(slope_bin_field)
-        for row in reader:
-            slope = row[slope_idx]
-            if slope not in slope_bins_strs:
-                slope_bins_strs.append(slope)
-
-    # Convert strings to numeric values
-    if get_dict:
-        for slope_bin in slope_bins_strs:
-            if "+" in slope_bin:
-                slope_bins[slope_bin] = [
-                    int(slope_bin.strip("+").strip("%")), slope_raster_max]
-            else:
-                slope_bins[slope_bin] = map(lambda x: int(
-                    x), slope_bin.strip("%").split("-"))
-    else:
-        for slope_bin in slope_bins_strs:
-            if "+" in slope_bin:
-                slope_bins.append(
-                    [int(slope_bin.strip("+").strip("%")), slope_raster_max])
-            else:
-                slope_bins.append(
-                    map(lambda x: int(x), slope_bin.strip("%").split("-")))
-
-    return slope_bins
-
-
-def load_land_use_table(config):
-    """Load unique sets of land use codes, land use descriptions, and classifications
-    
-    Arguments:
-        config {instance} -- ConfigParser instance containing RWSM parameters
-    
-    Returns:
-        list -- list of triplets containing each observed code, description and classification combination
-    """
-
-
-    # Gather relevant parameter values
-    file_name = config.get("RWSM", "land_use_LU_file_name")
-    code_field = config.get("RWSM", "land_use_field")
-    description_field = config.get("RWSM", "land_use_LU_desc_field")
-    classification_field = config.get("RWSM", "land_use_LU_class_field")
-
-    # Populate values structure with unique triples
-    values = []
-    with open(file_name, 'rb') as csvfile:
-        reader = csv.reader(csvfile)
-        headers = reader.next()
-        code_idx = headers.index(code_field)
-        description_idx = headers.index(description_field)
-        classification_idx = headers.index(classification_field)
-
-        for row in reader:
-            code = row[code_idx]
-            description = row[description_idx]
-            classification = row[classification_idx]
-            if (code, description, classification) not in values:
-                values.append((code, description, classification))
-
-    return values
-
-
-# TODO: Check if we want to dynamically apply coefficient fields based on location category
-def load_runoff_coeff_lu(file_name, coefficient_field):
-    """Helper function for populating land use data structure
-    
-    Arguments:
-        file_name {string} -- path to runoff coefficient file
-        coefficient_field {string} -- field name for column containing runoff coefficients
-    
-    Returns:
-        dictionary -- dictionary containing two dictionaries; dict of triplets for each set of runoff parameters
-            (i.e. slope, soil, category) assigned to coefficients, dict for converting codes to coefficients.
-    """
-
-
-    # Initialize data structure, dictionary with three valued tuples
-    runoff_lu = {
-        "sets": {},
-        "codes": {}
-    }
-
-    # Read and loop through CSV, populate structure
-    with open(file_name, 'rb') as csvfile:
-        reader = csv.reader(csvfile)
-        headers = reader.next()
-        coeff_index = headers.index(coefficient_field)
-        for row in reader:
-            slope = row[1]
-            soil = row[2]
-            category = row[3]
-            code = row[7]
-            coeff = row[coeff_index]
-            runoff_set = (slope, soil, category)
-            if runoff_set not in runoff_lu["sets"].keys():
-                runoff_lu["sets"][runoff_set] = coeff
-            runoff_lu["codes"][code] = coeff
-    return runoff_lu
-
-# Read parameter values from configuration file
-
-
-def load_config(file_name):
-    """Instantiate and return ConfigParser instance containing RWSM parameters
-    
-    Arguments:
-        file_name {string} -- path to configuration file
-    
-    Returns:
-        instance -- ConfigParser instance containing RWSM parameters
-    """
-
-    config = ConfigParser.ConfigParser()
-    config.readfp(open(file_name))
-    return config
-
-
-def get_empty_config():
-    """Instantiate blank ConfigParser instance
-    
-    Returns:
-        instance -- blank ConfigParser instance
-    """
-
-    config = ConfigParser.ConfigParser()
-    return config
-
-# Write configuration file using user supplied values
-
-
-def write_config(file_name, params):
-    """Writes config instance to file for future use.
-    
-    Arguments:
-        file_name {string} -- path for output file
-        params {list} -- list of arcpy parameter instances, object obtained from GUI
-    """
-
-    config = ConfigParser.RawConfigParser()
-
-    config.add_section("RWSM")
-
-    for param in params:
-        config.set("RWSM", param.name, param.valueAsText)
-
-
-def load_csv(file_name):
-    """Read in CSV file
-    
-    Arguments:
-        file_name {string} -- path to CSV file
-    
-    Returns:
-        list -- list from CSV reader
-    """
-
-    with open(file_name, "r") as csv_file:
-        reader = csv.reader(csv_file, delimiter=",")
-        return list(reader)
-
-
 def init_workspace(workspace):
     """Initialize workspace for writing temporary and output files.
     
@@ -420,6 +207,109 @@ def rasterAvgs(INT, dem, rname, wname):
     arcpy.CheckInExtension('Spatial')
 
 
+def exactRasterAvgs(INT, dem, rname, max_cells=1000000, tile_size=0, workers=1, timings=None):
+    """Coverage weighted raster averages, each cell weighted by the fraction of it within the polygon
+
+    Replaces ZonalStatisticsAsTable and the centroid fallback of rasterAvgs: polygons smaller than a
+    cell still overlap cells, so every polygon over data receives a mean in one pass.
+
+    Arguments:
+        INT {feature layer} -- intersected feature layer with uID field
+        dem {raster layer} -- slope or precipitation raster layer
+        rname {string} -- 'slope' or 'precipitation', prepended to the mean field
+
+    Keyword Arguments:
+        max_cells {int} -- bound on cells held per batch of polygons (default: {1000000})
+        tile_size {int} -- rows and columns per tile reduced by a thread, untiled if 0 (default: {0})
+        workers {int} -- threads reducing tiles (default: {1})
+        timings {list} -- receives per-tile timings (default: {None})
+    """
+
+    with GEOPROCESSING_LOCK:
+        (uids, polygons) = get_polygon_rings(INT)
+        raster = arcpy.sa.Raster(dem) if isinstance(dem, basestring) else dem
+        window = get_raster_window(get_raster_grid(raster), arcpy.Describe(INT).extent)
+        if window['ncols'] > 0 and window['nrows'] > 0:
+            (values, valid) = read_raster_window(raster, window)
+        else:
+            values = numpy.zeros((0, 0))
+            valid = numpy.zeros((0, 0), dtype=bool)
+    # Cells are reduced without the lock, other threads may geoprocess meanwhile
+    (means, weights) = zonal.coverage_means(
+        polygons, values, valid, window, max_cells, tile_size, workers, timings)
+
+    out_table = numpy.zeros(len(uids), dtype=[('uID', numpy.int32), (rname + "_mean", numpy.float64)])
+    out_table['uID'] = uids
+    out_table[rname + "_mean"] = means
+    with GEOPROCESSING_LOCK:
+        arcpy.da.ExtendTable(INT, 'uID', out_table, 'uID')
+
+
+def stackRasterAvgs(INT, stack, bands, max_cells=1000000, tile_size=0, workers=1, timings=None):
+    """Coverage weighted averages of several bands of a raster stack, read in one window
+
+    Bands share one grid, so cell coverage is computed once for all of them.
+
+    Arguments:
+        INT {feature layer} -- intersected feature layer with uID field
+        stack {Raster_Stack} -- raster stack holding the bands
+        bands {list} -- band names, each mean is written to <band>_mean
+
+    Keyword Arguments:
+        max_cells {int} -- bound on cells held per batch of polygons (default: {1000000})
+        tile_size {int} -- rows and columns per tile reduced by a thread, untiled if 0 (default: {0})
+        workers {int} -- threads reducing tiles (default: {1})
+        timings {list} -- receives per-tile timings (default: {None})
+    """
+
+    with GEOPROCESSING_LOCK:
+        (uids, polygons) = get_polygon_rings(INT)
+        extent = arcpy.Describe(INT).extent
+    (values, valid, window) = stack.read_window(
+        extent.XMin, extent.YMin, extent.XMax, extent.YMax, bands)
+    (means, weights) = zonal.coverage_means(
+        polygons, values, valid, window, max_cells, tile_size, workers, timings)
+
+    out_table = numpy.zeros(len(uids), dtype=[('uID', numpy.int32)] +
+                            [(band + "_mean", numpy.float64) for band in bands])
+    out_table['uID'] = uids
+    for (i, band) in enumerate(bands):
+        out_table[band + "_mean"] = means[i]
+    with GEOPROCESSING_LOCK:
+        arcpy.da.ExtendTable(INT, 'uID', out_table, 'uID')
+
+
+def get_polygon_rings(fc):
+    """Vertices of every ring of every polygon
+
+    Arguments:
+        fc {feature class} -- polygon feature class with uID field
+
+    Returns:
+        tuple -- array of uIDs and one list of rings per polygon, each ring an (n, 2) array of x, y
+    """
+
+    uids = []
+    polygons = []
+    with arcpy.da.SearchCursor(fc, ['uID', 'SHAPE@']) as cursor:
+        for (uid, shape) in cursor:
+            rings = []
+            if shape is not None:
+                for part in shape:
+                    ring = []
+                    # Rings of a part are separated by None, interior rings follow the exterior ring
+                    for point in part:
+                        if point is None:
+                            rings.append(ring)
+                            ring = []
+                        else:
+                            ring.append((point.X, point.Y))
+                    rings.append(ring)
+            uids.append(uid)
+            polygons.append([numpy.array(ring, dtype=numpy.float64) for ring in rings if ring])
+    return (numpy.array(uids, dtype=numpy.int64), polygons)
+
+
 def getCountInt(fc):
     """Returns number of rows within feature class
     
@@ -433,106 +323,281 @@ def getCountInt(fc):
     return int(arcpy.GetCount_management(fc).getOutput(0))
 
 
-def calculateCode(slpValue, geolValue, luValue, geolName):
-    """Calculates code for each unique land unit, used in runoff coeff lookup table
-    
+def table_to_array(fc, fields, where_clause=None):
+    """Load feature class fields into a NumPy structured array, substituting null values
+
     Arguments:
-        slpValue {string} -- slope bin value
-        geolValue {string} -- geologic bin value (e.g. soils bin value)
-        luValue {float} -- land use lookup value
-        geolName {string} -- field name for geologic values (e.g. soil)
-    
+        fc {feature class} -- feature class or table to read
+        fields {list} -- field names, including tokens such as SHAPE@AREA
+
+    Keyword Arguments:
+        where_clause {string} -- optional SQL expression limiting the rows read (default: {None})
+
     Returns:
-        float -- numeric code represneting combination of slope, geologic, and lookup values
+        array -- NumPy structured array, text nulls as '', float nulls as NaN and integer nulls as 0
     """
 
+    field_types = dict((field.name, field.type) for field in arcpy.ListFields(fc))
+    null_values = {}
+    for field in fields:
+        field_type = field_types.get(field)
+        if field_type == 'String':
+            null_values[field] = ''
+        elif field_type in ('Double', 'Single'):
+            null_values[field] = numpy.nan
+        elif field_type in ('Integer', 'SmallInteger'):
+            null_values[field] = 0
 
-    geolValues = {'A': 10, 'B': 20, 'C': 30, 'D': 40,
-                  'ROCK': 50, 'UNCLASS': 60, 'WATER': 70}
+    return arcpy.da.FeatureClassToNumPyArray(
+        in_table=fc,
+        field_names=fields,
+        where_clause=where_clause or "",
+        null_value=null_values
+    )
 
-    if geolValue in geolValues:
-        geolValueOut = geolValues[geolValue]
-    else:
-        geolValueOut = 0
-    if not slpValue:
-        slpValue = 0
-    if not luValue:
-        luValue = 0.0
 
-    return slpValue + geolValueOut + luValue
+def reclassifySlope(slope_raster, slope_bins_w_codes, out_name):
+    """Reclassify the slope raster into slope bin codes, run once per analysis
 
+    Arguments:
+        slope_raster {raster layer} -- slope raster
+        slope_bins_w_codes {list} -- list of [lower, upper, code] slope bins
+        out_name {string} -- name of the reclassified raster, saved in the current workspace
+
+    Returns:
+        raster layer -- raster of slope bin codes
+    """
+
+    arcpy.CheckOutExtension('Spatial')
+    remap = [[lower, upper, code]
+             for (lower, upper, code) in sorted(slope_bins_w_codes)]
+
+    # Open ended bins stop at the integer raster maximum, stretch the last bin
+    # so that every cell is classified.
+    remap[-1][1] = max(remap[-1][1], slope_raster.maximum)
+
+    slope_classes = arcpy.sa.Reclassify(
+        slope_raster, "Value", arcpy.sa.RemapRange(remap), "NODATA")
+    slope_classes.save(out_name)
+    arcpy.CheckInExtension('Spatial')
+    return slope_classes
+
+
+def slopeHistogram(INT, slope_classes, class_codes, wname):
+    """Tabulates the area of each slope bin within each polygon in a single pass
 
-def format_time(t):
-    """Date formatting for arcpy message output
-    
     Arguments:
-        t {time} -- time to format
-    
+        INT {feature layer} -- intersected feature layer, must contain uID field
+        slope_classes {raster layer} -- slope raster reclassified to slope bin codes
+        class_codes {list} -- slope bin codes, sets the column order of the returned areas
+        wname {string} -- watershed name
+
     Returns:
-        string -- fomatted time for display within arcpy console output
+        tuple -- array of tabulated uIDs and 2D array of areas, one column per slope bin code
     """
 
-    return str(datetime.timedelta(seconds=round(time.clock() - t)))
+    arcpy.CheckOutExtension('Spatial')
+    table = arcpy.sa.TabulateArea(
+        INT, 'uID', slope_classes, 'Value', "slopeHist_" + wname,
+        slope_classes.meanCellWidth)
+    arcpy.CheckInExtension('Spatial')
+
+    field_names = [field.name for field in arcpy.ListFields(table)]
+    zone_field = [name for name in field_names if name.lower() == 'uid'][0]
+    class_fields = {}
+    for name in field_names:
+        if name.upper().startswith('VALUE_'):
+            class_fields[int(name[6:])] = name
 
+    fc_table = arcpy.da.TableToNumPyArray(
+        table, [zone_field] + class_fields.values())
+    areas = numpy.zeros((len(fc_table), len(class_codes)))
+    for (i, code) in enumerate(class_codes):
+        if code in class_fields:
+            areas[:, i] = fc_table[class_fields[code]]
+
+    return (fc_table[zone_field], areas)
+
+
+def get_raster_grid(raster):
+    """Describe the cell grid of a raster
 
-def get_code_to_coeff_lookup(config):
-    """Obtain code to coefficient dictionary
-    
     Arguments:
-        config {instance} -- ConfigParser instance containing RWSM parameters
-    
+        raster {raster layer} -- raster to describe
+
+    Returns:
+        dictionary -- lower left corner, upper left coordinates, cell size, and number of columns and rows
+    """
+
+    raster = arcpy.sa.Raster(raster) if isinstance(raster, basestring) else raster
+    return {
+        'lower_left': arcpy.Point(raster.extent.XMin, raster.extent.YMin),
+        'xmin': raster.extent.XMin,
+        'ymax': raster.extent.YMax,
+        'cell_width': raster.meanCellWidth,
+        'cell_height': raster.meanCellHeight,
+        'ncols': raster.width,
+        'nrows': raster.height
+    }
+
+
+def is_aligned(raster, grid, tolerance=1e-6):
+    """Check whether a raster shares cell size and cell alignment with a grid
+
+    Arguments:
+        raster {raster layer} -- raster to check
+        grid {dictionary} -- grid from get_raster_grid
+
+    Keyword Arguments:
+        tolerance {float} -- tolerance as a fraction of the cell size (default: {1e-6})
+
     Returns:
-        dictionary -- dictionary for converting codes to coefficients.
+        bool -- True if cells of raster coincide with cells of grid
     """
 
+    raster = arcpy.sa.Raster(raster) if isinstance(raster, basestring) else raster
+    cell_width = grid['cell_width']
+    cell_height = grid['cell_height']
+    if abs(raster.meanCellWidth - cell_width) > tolerance * cell_width or \
+            abs(raster.meanCellHeight - cell_height) > tolerance * cell_height:
+        return False
+    x_offset = ((raster.extent.XMin - grid['xmin']) / cell_width) % 1.0
+    y_offset = ((raster.extent.YMax - grid['ymax']) / cell_height) % 1.0
+    return min(x_offset, 1.0 - x_offset) < tolerance and min(y_offset, 1.0 - y_offset) < tolerance
+
+
+def alignRaster(raster, snap_raster, out_name):
+    """Resample a raster onto the cell grid of a snap raster
+
+    Arguments:
+        raster {raster layer} -- raster to resample
+        snap_raster {raster layer} -- raster defining the cell size and alignment
+        out_name {string} -- name of the resampled raster, saved in the current workspace
+
+    Returns:
+        string -- name of the aligned raster
+    """
+
+    snap_raster = arcpy.sa.Raster(snap_raster) if isinstance(
+        snap_raster, basestring) else snap_raster
+    previous_snap = arcpy.env.snapRaster
+    arcpy.env.snapRaster = snap_raster
+    try:
+        arcpy.Resample_management(
+            raster, out_name, snap_raster.meanCellWidth, "BILINEAR")
+    finally:
+        arcpy.env.snapRaster = previous_snap
+    return out_name
+
+
+def rasterizeZones(INT, snap_raster, out_name):
+    """Rasterize polygon uIDs onto the cell grid of a snap raster
+
+    Arguments:
+        INT {feature layer} -- feature layer with uID field
+        snap_raster {raster layer} -- raster defining the cell size and alignment
+        out_name {string} -- name of the zone raster, saved in the current workspace
+
+    Returns:
+        tuple -- 2D array of uIDs (0 outside polygons) and the zone raster grid
+    """
+
+    snap_raster = arcpy.sa.Raster(snap_raster) if isinstance(
+        snap_raster, basestring) else snap_raster
+    previous_snap = arcpy.env.snapRaster
+    arcpy.env.snapRaster = snap_raster
+    try:
+        arcpy.PolygonToRaster_conversion(
+            INT, 'uID', out_name, "CELL_CENTER", "", snap_raster.meanCellWidth)
+    finally:
+        arcpy.env.snapRaster = previous_snap
+
+    zone_raster = arcpy.sa.Raster(out_name)
+    grid = get_raster_grid(zone_raster)
+    zones = arcpy.RasterToNumPyArray(zone_raster, nodata_to_value=0)
+    return (zones.astype(numpy.int64), grid)
+
+
+def get_raster_window(grid, extent):
+    """Window of a raster grid covering an extent, clipped to the raster
+
+    Arguments:
+        grid {dictionary} -- grid from get_raster_grid
+        extent {extent} -- extent to cover, e.g. arcpy.Describe(fc).extent
+
+    Returns:
+        dictionary -- grid of the window, cells aligned with the raster
+    """
+
+    (row0, col0, nrows, ncols) = zonal.window_bounds(
+        grid, extent.XMin, extent.YMin, extent.XMax, extent.YMax)
+    cell_width = grid['cell_width']
+    cell_height = grid['cell_height']
+    xmin = grid['xmin'] + col0 * cell_width
+    ymax = grid['ymax'] - row0 * cell_height
+    return {
+        'lower_left': arcpy.Point(xmin, ymax - nrows * cell_height),
+        'xmin': xmin,
+        'ymax': ymax,
+        'cell_width': cell_width,
+        'cell_height': cell_height,
+        'ncols': ncols,
+        'nrows': nrows
+    }
+
+
+def read_raster_window(raster, grid):
+    """Read the window of a raster covering a grid, the raster must be aligned with the grid
+
+    Arguments:
+        raster {raster layer} -- raster to read
+        grid {dictionary} -- grid from get_raster_grid
+
+    Returns:
+        tuple -- 2D array of values as floats and 2D boolean array flagging cells holding data
+    """
+
+    raster = arcpy.sa.Raster(raster) if isinstance(raster, basestring) else raster
+    nodata = raster.noDataValue
+    if nodata is None:
+        nodata = -9999
+    values = arcpy.RasterToNumPyArray(
+        raster, grid['lower_left'], grid['ncols'], grid['nrows'], nodata)
+    valid = values != nodata
+    return (values.astype(numpy.float64), valid)
+
+
+def iter_table_chunks(fc, fields, chunk_size=100000):
+    """Read a feature class in bounded chunks of object ID ranges
+
+    Arguments:
+        fc {feature class} -- feature class or table to read
+        fields {list} -- field names, including tokens such as SHAPE@AREA
+
+    Keyword Arguments:
+        chunk_size {int} -- object IDs spanned by each chunk, bounds rows held in memory (default: {100000})
+
+    Returns:
+        generator -- NumPy structured arrays, see table_to_array
+    """
 
-    # Output data structure
-    code_to_coeff_lookup = {}
-
-    # Load values from config
-    runoff_coeff_file_name = config.get("RWSM", "runoff_coeff_file_name")
-    runoff_coeff_slope_bin_field = config.get(
-        "RWSM", "runoff_coeff_slope_bin_field")
-    runoff_coeff_field = config.get("RWSM", "runoff_coeff_field")
-    runoff_coeff_soil_type_field = config.get(
-        "RWSM", "runoff_coeff_soil_type_field")
-    runoff_coeff_land_use_class_code_field = config.get(
-        "RWSM", "runoff_coeff_land_use_class_code_field")
-
-    # Specify soil values, only remaining hard-coded references
-    soil_type_values = {'A': 10, 'B': 20, 'C': 30, 'D': 40,
-                        'ROCK': 50, 'UNCLASS': 60, 'WATER': 70, 'null': 0}
-
-    # Obtain dictionary mapping slope bins observed in runoff file with codes
-    slope_bins = load_slope_bins(config=config, get_dict=True)
-    slope_bins_w_codes = {}
-    slope_bin_code = 100
-    for slope_bin in slope_bins.keys():
-        slope_bins_w_codes[slope_bin] = slope_bin_code
-        slope_bin_code += 100
-
-    with open(runoff_coeff_file_name, 'rb') as csvfile:
-        reader = csv.reader(csvfile)
-        headers = next(reader, None)
-
-        # Get indicies
-        slope_bin_idx = headers.index(runoff_coeff_slope_bin_field)
-        coeff_idx = headers.index(runoff_coeff_field)
-        soil_type_idx = headers.index(runoff_coeff_soil_type_field)
-        land_use_class_code_idx = headers.index(
-            runoff_coeff_land_use_class_code_field)
-
-        for row in reader:
-            slope_bin_val = row[slope_bin_idx]
-            coeff_val = float(row[coeff_idx])
-            soil_type = row[soil_type_idx]
-            land_use_class_code = float(row[land_use_class_code_idx])
-
-            # Get code for slope bin, convert string and lookup in structure
-            slope_bin_code = slope_bins_w_codes[slope_bin_val]
-
-            soil_type_code = soil_type_values[soil_type]
-            code = slope_bin_code + soil_type_code + land_use_class_code
-            code_to_coeff_lookup[code] = coeff_val
-
-    return code_to_coeff_lookup
+    oid_field = arcpy.Describe(fc).OIDFieldName
+    count = getCountInt(fc)
+    if count == 0:
+        return
+
+    def first_oid(order):
+        sql_clause = (None, "ORDER BY {} {}".format(oid_field, order))
+        with arcpy.da.SearchCursor(fc, ["OID@"], sql_clause=sql_clause) as cursor:
+            for row in cursor:
+                return row[0]
+
+    # Data sources without ORDER BY support (shapefiles) number features contiguously
+    low = first_oid("ASC")
+    high = max(first_oid("DESC"), low + count - 1)
+    oid_name = arcpy.AddFieldDelimiters(fc, oid_field)
+    while low <= high:
+        where_clause = "{0} >= {1} AND {0} < {2}".format(
+            oid_name, low, low + chunk_size)
+        yield table_to_array(fc, fields, where_clause)
+        low += chunk_size
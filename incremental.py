@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+
+"""incremental.py: Watershed fingerprints and run manifests for recomputing only changed watersheds."""
+
+__copyright__ = """
+    Copyright (C) 2018 San Francisco Estuary Institute (SFEI)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import hashlib
+import helpers
+import arcpy
+import numpy
+
+MANIFEST_FILE_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+# Options that do not change results
+IGNORED_OPTIONS = ("workspace", "previous_run", "manifest", "preflight", "telemetry_interval",
+                   "chunk_size", "results_store", "daemon_port", "daemon_authkey", "uncertainty",
+                   "uncertainty_samples", "uncertainty_coeff_distribution", "uncertainty_coeff_spread",
+                   "uncertainty_precipitation_distribution", "uncertainty_precipitation_spread",
+                   "uncertainty_percentiles", "uncertainty_seed", "raster_stack", "raster_cache",
+                   "screening_factor", "screening_tolerance", "screening_samples", "screening_seed",
+                   "screening_error_percentile", "zonal_tile_size", "zonal_workers", "profile",
+                   "profile_watersheds", "profile_top", "profile_interval", "pipeline",
+                   "pipeline_queue_size", "pipeline_interval", "processes")
+
+# Feature inputs, fingerprinted per watershed by content rather than by path
+FEATURE_OPTIONS = ("watersheds", "land_use", "soils_file_name")
+
+# Tables applying to every watershed, fingerprinted by content when configured
+TABLE_OPTIONS = ("land_use_LU_file_name", "runoff_coeff_file_name", "concentration_file_name")
+
+# Rasters applying to every watershed, fingerprinted by modification time
+RASTER_OPTIONS = ("slope_file_name", "precipitation_file_name")
+
+
+def get_file_digest(file_name):
+    """Digest of a file's contents
+
+    Arguments:
+        file_name {string} -- file path
+
+    Returns:
+        string -- hexadecimal MD5 digest
+    """
+
+    digest = hashlib.md5()
+    with open(file_name, "rb") as input_file:
+        for block in iter(lambda: input_file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_global_fingerprint(config):
+    """Fingerprint of the options, tables and rasters shared by every watershed
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+
+    Returns:
+        string -- hexadecimal digest, a change recomputes every watershed
+    """
+
+    digest = hashlib.md5()
+    for option in sorted(config.options("RWSM")):
+        if option in IGNORED_OPTIONS or option in FEATURE_OPTIONS:
+            continue
+        digest.update("{}={}\n".format(option, config.get("RWSM", option, raw=True)))
+    for option in TABLE_OPTIONS:
+        file_name = helpers.get_config_option(config, option)
+        if file_name is not None:
+            digest.update(get_file_digest(file_name))
+    for option in RASTER_OPTIONS:
+        digest.update(repr(helpers.get_modified_time(config.get("RWSM", option))))
+    for (name, file_name) in helpers.get_covariates(config):
+        digest.update(repr(helpers.get_modified_time(file_name)))
+    return digest.hexdigest()
+
+
+def get_feature_digests(fc, fields):
+    """Extent and digest of the geometry and attributes of every feature
+
+    Arguments:
+        fc {feature class} -- input feature class
+        fields {list} -- attribute fields included in the digest
+
+    Returns:
+        tuple -- (n, 4) array of xmin, ymin, xmax, ymax and array of hexadecimal digests
+    """
+
+    extents = []
+    digests = []
+    with arcpy.da.SearchCursor(fc, ["SHAPE@"] + list(fields)) as cursor:
+        for row in cursor:
+            if row[0] is None:
+                continue
+            extent = row[0].extent
+            extents.append((extent.XMin, extent.YMin, extent.XMax, extent.YMax))
+            digest = hashlib.md5(row[0].WKB)
+            digest.update(repr(row[1:]))
+            digests.append(digest.hexdigest())
+    return (numpy.array(extents, dtype=numpy.float64).reshape(-1, 4),
+            numpy.array(digests, dtype="S32"))
+
+
+def get_envelope_digest(extents, digests, envelope):
+    """Digest of the features whose extents intersect an envelope, independent of feature order
+
+    Arguments:
+        extents {array} -- feature extents from get_feature_digests
+        digests {array} -- feature digests from get_feature_digests
+        envelope {tuple} -- xmin, ymin, xmax, ymax
+
+    Returns:
+        string -- hexadecimal digest
+    """
+
+    (xmin, ymin, xmax, ymax) = envelope
+    overlaps = (extents[:, 0] <= xmax) & (extents[:, 2] >= xmin) & \
+        (extents[:, 1] <= ymax) & (extents[:, 3] >= ymin)
+    return hashlib.md5("".join(sorted(digests[overlaps].tolist()))).hexdigest()
+
+
+def fingerprint_watersheds(config, dissolved_watersheds):
+    """Fingerprint each watershed's geometry and the land use and soils features within its envelope
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+        dissolved_watersheds {feature class} -- dissolved watersheds
+
+    Returns:
+        dictionary -- hexadecimal digest keyed by watershed name, illegal characters removed
+    """
+
+    # Dissolved watersheds are single part, a watershed may span several rows
+    parts = {}
+    envelopes = {}
+    watersheds_field = config.get("RWSM", "watersheds_field")
+    with arcpy.da.SearchCursor(dissolved_watersheds, (watersheds_field, "SHAPE@")) as cursor:
+        for (watershed_name, shape) in cursor:
+            watershed_name = helpers.strip_chars(
+                watershed_name, '!@#$%^&*()-+=,<>?/\~`[]{}.')
+            extent = shape.extent
+            parts.setdefault(watershed_name, []).append(
+                hashlib.md5(shape.WKB).hexdigest())
+            (xmin, ymin, xmax, ymax) = envelopes.get(
+                watershed_name, (extent.XMin, extent.YMin, extent.XMax, extent.YMax))
+            envelopes[watershed_name] = (min(xmin, extent.XMin), min(ymin, extent.YMin),
+                                         max(xmax, extent.XMax), max(ymax, extent.YMax))
+
+    inputs = [
+        get_feature_digests(config.get("RWSM", "land_use"),
+                            [config.get("RWSM", "land_use_field")]),
+        get_feature_digests(config.get("RWSM", "soils_file_name"),
+                            [config.get("RWSM", "soils_field")])
+    ]
+
+    fingerprints = {}
+    for (watershed_name, part_digests) in parts.items():
+        digest = hashlib.md5("".join(sorted(part_digests)))
+        for (extents, digests) in inputs:
+            digest.update(get_envelope_digest(
+                extents, digests, envelopes[watershed_name]))
+        fingerprints[watershed_name] = digest.hexdigest()
+    return fingerprints
+
+
+def load_manifest(workspace):
+    """Read the manifest of a previous run
+
+    Arguments:
+        workspace {string} -- previous run's workspace
+
+    Returns:
+        dictionary -- manifest, None if the workspace has none
+    """
+
+    file_name = os.path.join(workspace, MANIFEST_FILE_NAME)
+    if not os.path.isfile(file_name):
+        return None
+    with open(file_name) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def write_manifest(workspace, global_fingerprint, fingerprints, intersected_watersheds):
+    """Write the manifest of a run, listing completed watersheds only
+
+    Watersheds that failed or were skipped are left out, so they are recomputed by the next
+    incremental run.
+
+    Arguments:
+        workspace {string} -- run workspace
+        global_fingerprint {string} -- digest from get_global_fingerprint
+        fingerprints {dictionary} -- digests from fingerprint_watersheds
+        intersected_watersheds {list} -- (watershed name, output feature class) tuples
+    """
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "global": global_fingerprint,
+        "watersheds": dict(
+            (watershed_name, {"fingerprint": fingerprints[watershed_name], "output": output_fc})
+            for (watershed_name, output_fc) in intersected_watersheds
+            if watershed_name in fingerprints)
+    }
+    with open(os.path.join(workspace, MANIFEST_FILE_NAME), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+
+def get_unchanged(manifest, global_fingerprint, fingerprints, watershed_names):
+    """Watersheds whose previous outputs can be carried over
+
+    Arguments:
+        manifest {dictionary} -- previous run's manifest, None if there is none
+        global_fingerprint {string} -- digest from get_global_fingerprint
+        fingerprints {dictionary} -- digests from fingerprint_watersheds
+        watershed_names {list} -- watersheds to analyse
+
+    Returns:
+        dictionary -- previous output feature class keyed by unchanged watershed name
+    """
+
+    if manifest is None or manifest["global"] != global_fingerprint:
+        return {}
+    unchanged = {}
+    for watershed_name in watershed_names:
+        previous = manifest["watersheds"].get(watershed_name)
+        if previous is not None and previous["fingerprint"] == fingerprints.get(watershed_name) \
+                and arcpy.Exists(previous["output"]):
+            unchanged[watershed_name] = previous["output"]
+    return unchanged
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+"""loads.py: Pollutant loads from runoff volumes and land use concentrations, NumPy only."""
+
+__copyright__ = """
+    Copyright (C) 2018 San Francisco Estuary Institute (SFEI)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+import numpy
+import core
+
+# Concentrations are in mg/L and runoff volumes in m3: mg/L x m3 = g, loads are reported in kg
+LOAD_FACTOR = 1e-3
+
+# Cells matching any soil or slope bin
+WILDCARDS = ("", "*")
+
+# Joins class, soil and slope bin into one key per polygon
+KEY_SEPARATOR = "\x1f"
+
+
+def load_field(pollutant):
+    """Per-polygon load field name of a pollutant
+
+    Arguments:
+        pollutant {string} -- pollutant column name of the concentration table
+
+    Returns:
+        string -- field name
+    """
+
+    return "load_" + re.sub("[^0-9a-zA-Z_]", "_", pollutant.strip())
+
+
+def slope_bin_key(slope_bin):
+    """Lower bound of a slope bin label, e.g. 0-5%, 30+% or the polygon label 30-87
+
+    Arguments:
+        slope_bin {string} -- slope bin label
+
+    Returns:
+        int -- lower bound, None for wildcards and NaN
+    """
+
+    slope_bin = str(slope_bin).strip()
+    if slope_bin in WILDCARDS or slope_bin == "NaN":
+        return None
+    return int(float(slope_bin.split("-")[0].strip("+%")))
+
+
+class Concentration_Table(object):
+    """Pollutant concentrations keyed by land use class, and optionally soil and slope bin
+
+    Key columns are named as in the runoff coefficient table; every other column holds the
+    concentrations (mg/L) of one pollutant. Blank or * soil and slope cells match any value,
+    the most specific row matching a polygon applies.
+
+    Arguments:
+        object {object} -- Remenant of python 2.7, declares new-style class
+
+    Returns:
+        Concentration_Table -- Concentration_Table instance
+    """
+
+    def __init__(self, file_name, class_field, soil_field, slope_field):
+        """Class initialization, reads the table
+
+        Arguments:
+            file_name {string} -- path to concentration CSV file
+            class_field {string} -- land use class column
+            soil_field {string} -- soil type column, optional in the table
+            slope_field {string} -- slope bin column, optional in the table
+
+        Raises:
+            ValueError -- a concentration is not numeric
+        """
+
+        rows = core.load_csv(file_name)
+        headers = [header.strip() for header in rows[0]]
+        key_fields = [class_field, soil_field, slope_field]
+        key_idx = [headers.index(field) if field in headers else None
+                   for field in key_fields]
+        if key_idx[0] is None:
+            raise ValueError("Concentration table {} has no {} column".format(
+                file_name, class_field))
+        pollutant_idx = [i for (i, header) in enumerate(headers)
+                         if i not in key_idx]
+        self.pollutants = [headers[i] for i in pollutant_idx]
+
+        self.concentrations = {}
+        for row in rows[1:]:
+            if not row or not row[key_idx[0]].strip():
+                continue
+            land_use_class = row[key_idx[0]].strip()
+            soil = row[key_idx[1]].strip() if key_idx[1] is not None else ""
+            slope = row[key_idx[2]] if key_idx[2] is not None else ""
+            key = (land_use_class, "" if soil in WILDCARDS else soil,
+                   slope_bin_key(slope))
+            try:
+                self.concentrations[key] = numpy.array(
+                    [float(row[i]) for i in pollutant_idx])
+            except ValueError:
+                raise ValueError("Concentration table {}: non-numeric concentration for {}".format(
+                    file_name, land_use_class))
+
+    def lookup(self, land_use_class, soil, slope_bin):
+        """Concentrations of the most specific row matching a polygon
+
+        Arguments:
+            land_use_class {string} -- land use class
+            soil {string} -- soil type
+            slope_bin {string} -- slope bin label
+
+        Returns:
+            array -- concentration per pollutant, None if no row matches
+        """
+
+        slope = slope_bin_key(slope_bin)
+        for key in ((land_use_class, soil, slope), (land_use_class, soil, None),
+                    (land_use_class, "", slope), (land_use_class, "", None)):
+            if key in self.concentrations:
+                return self.concentrations[key]
+        return None
+
+    def compute_loads(self, runoff_volume, land_use_classes, soils, slope_bins):
+        """Loads of every pollutant for every polygon
+
+        Concentrations are resolved once per distinct class, soil and slope bin combination,
+        loads are then one product over the runoff volume vector.
+
+        Arguments:
+            runoff_volume {array} -- runoff volume per polygon (m3)
+            land_use_classes {array} -- land use class per polygon
+            soils {array} -- soil type per polygon
+            slope_bins {array} -- slope bin label per polygon
+
+        Returns:
+            tuple -- (polygons, pollutants) array of loads (kg) and list of unmatched
+                (class, soil, slope bin) combinations, whose loads are zero
+        """
+
+        combinations = numpy.array([
+            KEY_SEPARATOR.join((str(land_use_class).strip(), str(soil).strip(), str(slope_bin).strip()))
+            for (land_use_class, soil, slope_bin) in zip(land_use_classes, soils, slope_bins)])
+        concentrations = numpy.zeros((0, len(self.pollutants)))
+        unmatched = []
+        if len(combinations) > 0:
+            (unique, inverse) = numpy.unique(combinations, return_inverse=True)
+            concentrations = numpy.zeros((len(unique), len(self.pollutants)))
+            for (i, combination) in enumerate(unique.tolist()):
+                values = self.lookup(*combination.split(KEY_SEPARATOR))
+                if values is None:
+                    unmatched.append(tuple(combination.split(KEY_SEPARATOR)))
+                else:
+                    concentrations[i] = values
+            concentrations = concentrations[inverse]
+
+        runoff_volume = numpy.asarray(runoff_volume, dtype=numpy.float64)
+        return (runoff_volume[:, numpy.newaxis] * concentrations * LOAD_FACTOR, unmatched)
+
+
+def get_concentration_table(config):
+    """Concentration table configured by concentration_file_name
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+
+    Returns:
+        Concentration_Table -- concentration table, None if not configured
+    """
+
+    file_name = core.get_config_option(config, "concentration_file_name")
+    if file_name is None:
+        return None
+    return Concentration_Table(
+        file_name,
+        config.get("RWSM", "runoff_coeff_land_use_class_field"),
+        config.get("RWSM", "runoff_coeff_soil_type_field"),
+        config.get("RWSM", "runoff_coeff_slope_bin_field"))
+
+
+def get_pollutants(config):
+    """Pollutants of the configured concentration table
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+
+    Returns:
+        list -- pollutant names, empty if no table is configured
+    """
+
+    table = get_concentration_table(config)
+    return table.pollutants if table is not None else []
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+"""pipeline.py: Stages connected by bounded queues, each stage working on a different item at a time."""
+
+__copyright__ = """
+    Copyright (C) 2018 San Francisco Estuary Institute (SFEI)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import csv
+import time
+import Queue
+import threading
+
+# Passed down the stages once no further items follow
+STOP = object()
+
+DEPTH_HEADERS = ["Time", "Seconds", "Stage", "Queue Depth", "Queue Size"]
+
+STAGE_HEADERS = ["Stage", "Items", "Dropped", "Busy Seconds", "Starved Seconds", "Blocked Seconds",
+                 "Mean Queue Depth", "Max Queue Depth"]
+
+
+class Pipeline_Stage(threading.Thread):
+    """Thread applying a function to the items of its input queue, passing results on
+
+    A function returning None drops the item. Putting to a full output queue blocks the
+    stage until the next stage catches up, so no stage runs more than a queue ahead.
+
+    Arguments:
+        threading.Thread {class} -- stage runs as a daemon thread
+
+    Returns:
+        Pipeline_Stage -- Pipeline_Stage instance
+    """
+
+    def __init__(self, name, function, input_queue, output_queue=None, on_error=None):
+        """Class initialization
+
+        Arguments:
+            name {string} -- stage name
+            function {function} -- applied to each item, returns the item passed on or None
+            input_queue {Queue} -- items received from the previous stage
+
+        Keyword Arguments:
+            output_queue {Queue} -- items passed to the next stage, None for the last stage (default: {None})
+            on_error {function} -- called with stage name, item and exception when function raises (default: {None})
+        """
+
+        threading.Thread.__init__(self, name="rwsm-pipeline-" + name)
+        self.daemon = True
+        self.stage_name = name
+        self.function = function
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.on_error = on_error
+        self.n_items = 0
+        self.n_dropped = 0
+        self.busy_seconds = 0.0
+        self.starved_seconds = 0.0
+        self.blocked_seconds = 0.0
+
+    def run(self):
+        """Stage loop, ends once STOP is received and passed on"""
+
+        while True:
+            start_time = time.time()
+            item = self.input_queue.get()
+            self.starved_seconds += time.time() - start_time
+            if item is STOP:
+                if self.output_queue is not None:
+                    self.output_queue.put(STOP)
+                break
+
+            start_time = time.time()
+            try:
+                result = self.function(item)
+            except Exception as error:
+                result = None
+                if self.on_error is not None:
+                    self.on_error(self.stage_name, item, error)
+            self.busy_seconds += time.time() - start_time
+            self.n_items += 1
+
+            if result is None:
+                self.n_dropped += 1
+            elif self.output_queue is not None:
+                start_time = time.time()
+                self.output_queue.put(result)
+                self.blocked_seconds += time.time() - start_time
+
+
+class Pipeline(threading.Thread):
+    """Stages connected by bounded queues, with queue depths sampled in the background
+
+    Arguments:
+        threading.Thread {class} -- queue depth sampler runs as a daemon thread
+
+    Returns:
+        Pipeline -- Pipeline instance
+    """
+
+    def __init__(self, stages, queue_size=2, interval=1.0, on_error=None):
+        """Class initialization
+
+        Arguments:
+            stages {list} -- (name, function) tuples, in order
+
+        Keyword Arguments:
+            queue_size {int} -- items waiting in front of each stage (default: {2})
+            interval {float} -- seconds between queue depth samples (default: {1.0})
+            on_error {function} -- called with stage name, item and exception when a stage raises (default: {None})
+        """
+
+        threading.Thread.__init__(self, name="rwsm-pipeline-sampler")
+        self.daemon = True
+        self.queue_size = max(int(queue_size), 1)
+        self.interval = interval
+        self.queues = [Queue.Queue(self.queue_size) for stage in stages]
+        self.stages = [Pipeline_Stage(name, function, self.queues[i],
+                                      self.queues[i + 1] if i + 1 < len(stages) else None, on_error)
+                       for (i, (name, function)) in enumerate(stages)]
+        self.depths = []
+        self.stopped = threading.Event()
+        self.start_time = None
+
+    def start(self):
+        """Start the stages and the queue depth sampler"""
+
+        self.start_time = time.time()
+        for stage in self.stages:
+            stage.start()
+        threading.Thread.start(self)
+
+    def run(self):
+        """Queue depth sampling loop"""
+
+        while not self.stopped.is_set():
+            self.sample()
+            self.stopped.wait(self.interval)
+
+    def sample(self):
+        """Record the depth of every stage's input queue"""
+
+        now = time.time()
+        for stage in self.stages:
+            self.depths.append((now, stage.stage_name, stage.input_queue.qsize()))
+
+    def put(self, item):
+        """Feed an item to the first stage, blocks while its queue is full
+
+        Arguments:
+            item {object} -- item
+        """
+
+        self.queues[0].put(item)
+
+    def close(self):
+        """Wait for the items in flight to pass every stage, then stop sampling"""
+
+        self.queues[0].put(STOP)
+        for stage in self.stages:
+            stage.join()
+        self.stopped.set()
+        self.join()
+        self.sample()
+
+    def get_summary(self):
+        """Per-stage counts, seconds and queue depths
+
+        Returns:
+            list -- rows, see STAGE_HEADERS
+        """
+
+        rows = []
+        for stage in self.stages:
+            depths = [depth for (now, name, depth) in self.depths if name == stage.stage_name]
+            rows.append([stage.stage_name, stage.n_items, stage.n_dropped, stage.busy_seconds,
+                         stage.starved_seconds, stage.blocked_seconds,
+                         float(sum(depths)) / max(len(depths), 1), max(depths or [0])])
+        return rows
+
+    def write_metrics(self, depth_file_name, stage_file_name):
+        """Write the queue depth samples and the per-stage summary to CSV
+
+        Arguments:
+            depth_file_name {string} -- CSV file receiving queue depth samples
+            stage_file_name {string} -- CSV file receiving the per-stage summary
+        """
+
+        with open(depth_file_name, "wb") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(DEPTH_HEADERS)
+            for (now, name, depth) in self.depths:
+                writer.writerow([time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now)),
+                                 round(now - self.start_time, 3), name, depth, self.queue_size])
+        with open(stage_file_name, "wb") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(STAGE_HEADERS)
+            for row in self.get_summary():
+                writer.writerow(row)
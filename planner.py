@@ -0,0 +1,768 @@
+#!/usr/bin/env python
+
+"""planner.py: Pre-flight validation of RWSM inputs and runtime, memory and scratch estimates."""
+
+__copyright__ = """
+    Copyright (C) 2018 San Francisco Estuary Institute (SFEI)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import csv
+import datetime
+import helpers
+import zonal
+import arcpy
+import numpy
+
+ERROR = "ERROR"
+WARNING = "WARNING"
+INFO = "INFO"
+
+# Feature class and CSV inputs with the fields they must contain
+FEATURE_CLASS_FIELDS = [
+    ("watersheds", ["watersheds_field"]),
+    ("land_use", ["land_use_field"]),
+    ("soils_file_name", ["soils_field"])
+]
+CSV_FIELDS = [
+    ("land_use_LU_file_name", ["land_use_LU_code_field", "land_use_LU_bin_field",
+                               "land_use_LU_desc_field", "land_use_LU_class_field"]),
+    ("runoff_coeff_file_name", ["runoff_coeff_field", "runoff_coeff_slope_bin_field",
+                                "runoff_coeff_soil_type_field", "runoff_coeff_land_use_class_field",
+                                "runoff_coeff_land_use_class_code_field"])
+]
+RASTERS = ["slope_file_name", "precipitation_file_name"]
+VECTORS = ["watersheds", "land_use", "soils_file_name"]
+
+# Cost model defaults, override with planner_* parameters. Intermediate feature classes per
+# watershed: lu_, luD_, soils_, soilsD_, int_ and intX_.
+COST_DEFAULTS = {
+    "planner_seconds_per_watershed": 20.0,
+    "planner_seconds_per_feature": 0.01,
+    "planner_seconds_per_million_cells": 5.0,
+    "planner_bytes_per_feature": 4096.0,
+    "planner_scratch_bytes_per_feature": 2048.0,
+    "planner_scratch_copies": 6.0
+}
+
+# Zonal engine cost model defaults for zonal_engine = auto, override with engine_* parameters.
+# Each engine's predicted seconds for a watershed's slope and precipitation means; fit them
+# against the measured seconds in engine_log.csv.
+ENGINE_COST_DEFAULTS = {
+    "engine_arcpy_seconds_per_raster": 2.0,
+    "engine_arcpy_seconds_per_feature": 0.002,
+    "engine_arcpy_seconds_per_million_cells": 2.0,
+    "engine_exact_seconds_per_raster": 0.2,
+    "engine_exact_seconds_per_vertex": 0.00002,
+    "engine_exact_seconds_per_million_cells": 4.0
+}
+
+# Combinations listed individually before being summarized
+MAX_LISTED = 10
+
+# Features whose geometries are read to estimate vertex counts, override with probe_sample_size
+PROBE_SAMPLE_SIZE = 10000
+PROBE_SAMPLE_WINDOWS = 20
+
+
+class Plan(object):
+    """Findings and estimates of a pre-flight check
+
+    Arguments:
+        object {object} -- Remenant of python 2.7, declares new-style class
+
+    Returns:
+        Plan -- Plan instance
+    """
+
+    def __init__(self):
+        """Class initialization"""
+
+        self.messages = []
+        self.estimates = []
+        self.totals = {}
+
+    def add(self, level, message, option=None):
+        """Record a finding
+
+        Arguments:
+            level {string} -- ERROR, WARNING or INFO
+            message {string} -- description of the finding
+
+        Keyword Arguments:
+            option {string} -- parameter the finding relates to (default: {None})
+        """
+
+        self.messages.append((level, message, option))
+
+    def has_errors(self):
+        """Whether any finding prevents the analysis from running
+
+        Returns:
+            bool -- True if an ERROR was recorded
+        """
+
+        return any(level == ERROR for (level, message, option) in self.messages)
+
+    def get_errors(self):
+        """Messages of findings that prevent the analysis from running
+
+        Returns:
+            list -- error messages
+        """
+
+        return [message for (level, message, option) in self.messages if level == ERROR]
+
+    def report(self):
+        """Printable summary of findings and estimates
+
+        Returns:
+            list -- lines of text
+        """
+
+        lines = ["{}: {}".format(level, message)
+                 for (level, message, option) in self.messages]
+        if self.totals:
+            lines.append("Watersheds: {}".format(self.totals["watersheds"]))
+            lines.append("Estimated features: {}".format(
+                self.totals["features"]))
+            lines.append("Estimated runtime: {}".format(
+                datetime.timedelta(seconds=round(self.totals["seconds"]))))
+            lines.append("Estimated peak memory (MB): {:.0f}".format(
+                self.totals["peak_memory_bytes"] / 2.0**20))
+            lines.append("Estimated scratch disk (MB): {:.0f}".format(
+                self.totals["scratch_bytes"] / 2.0**20))
+        return lines
+
+    def write_estimates(self, output_file_name):
+        """Write per-watershed estimates as CSV
+
+        Arguments:
+            output_file_name {string} -- path of the CSV file
+        """
+
+        with open(output_file_name, "wb") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(["Watershed", "Land Use Features", "Soils Features", "Watershed Vertices",
+                             "Raster Cells", "Est. Runtime (s)", "Est. Memory (MB)", "Est. Scratch (MB)"])
+            for estimate in self.estimates:
+                writer.writerow([
+                    estimate["watershed"],
+                    estimate["land_use_features"],
+                    estimate["soils_features"],
+                    estimate["vertices"],
+                    estimate["cells"],
+                    round(estimate["seconds"], 1),
+                    round(estimate["memory_bytes"] / 2.0**20, 1),
+                    round(estimate["scratch_bytes"] / 2.0**20, 1)
+                ])
+
+
+def read_csv_headers(file_name):
+    """Header row of a CSV file
+
+    Arguments:
+        file_name {string} -- path to CSV file
+
+    Returns:
+        list -- column names
+    """
+
+    with open(file_name, 'rb') as csvfile:
+        return next(csv.reader(csvfile), [])
+
+
+def read_unique(fc, field, chunk_size=100000):
+    """Unique values of a feature class field, read in bounded chunks
+
+    Arguments:
+        fc {feature class} -- feature class to read
+        field {string} -- field name
+
+    Keyword Arguments:
+        chunk_size {int} -- object IDs spanned by each chunk, see helpers.iter_table_chunks (default: {100000})
+
+    Returns:
+        list -- unique values
+    """
+
+    values = set()
+    for fc_table in helpers.iter_table_chunks(fc, [field], chunk_size):
+        values.update(numpy.unique(fc_table[field]).tolist())
+    return sorted(values)
+
+
+def sample_vertex_counts(fc, sample_size):
+    """Centroids and vertex counts of a sample of features, read as a few object ID windows
+
+    Geometries are the costly part of a probe; reading a bounded number of them keeps the
+    probe's cost independent of the size of the region.
+
+    Arguments:
+        fc {feature class} -- polygon feature class
+        sample_size {int} -- features sampled, every feature if 0
+
+    Returns:
+        tuple -- (n, 2) array of sampled centroids and array of their vertex counts
+    """
+
+    count = helpers.getCountInt(fc)
+    if sample_size <= 0 or sample_size >= count:
+        where_clauses = [None]
+    else:
+        # Windows spread evenly over the object IDs, features are numbered in load order
+        oid_name = arcpy.AddFieldDelimiters(fc, arcpy.Describe(fc).OIDFieldName)
+        n_windows = min(PROBE_SAMPLE_WINDOWS, sample_size)
+        window = sample_size // n_windows
+        with arcpy.da.SearchCursor(fc, ["OID@"]) as cursor:
+            low = next(cursor)[0]
+        step = count // n_windows
+        where_clauses = ["{0} >= {1} AND {0} < {2}".format(oid_name, low + i * step, low + i * step + window)
+                         for i in range(n_windows)]
+
+    xy = []
+    counts = []
+    for where_clause in where_clauses:
+        with arcpy.da.SearchCursor(fc, ("SHAPE@XY", "SHAPE@"), where_clause) as cursor:
+            for (centroid, shape) in cursor:
+                if shape is None:
+                    continue
+                xy.append(centroid)
+                counts.append(shape.pointCount)
+    return (numpy.array(xy, dtype=numpy.float64).reshape(-1, 2),
+            numpy.array(counts, dtype=numpy.float64))
+
+
+def check_csv_fields(config, plan):
+    """Check that CSV tables exist and contain the configured fields
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+        plan {Plan} -- plan collecting findings
+    """
+
+    for (file_option, field_options) in CSV_FIELDS:
+        file_name = config.get("RWSM", file_option)
+        if not os.path.isfile(file_name):
+            plan.add(ERROR, "{} not found: {}".format(
+                file_option, file_name), file_option)
+            continue
+        headers = read_csv_headers(file_name)
+        for field_option in field_options:
+            field = config.get("RWSM", field_option)
+            if field not in headers:
+                plan.add(ERROR, "Field '{}' ({}) not found in {}".format(
+                    field, field_option, file_name), field_option)
+
+
+def check_feature_class_fields(config, plan):
+    """Check that feature classes exist and contain the configured fields
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+        plan {Plan} -- plan collecting findings
+    """
+
+    for (dataset_option, field_options) in FEATURE_CLASS_FIELDS:
+        dataset = config.get("RWSM", dataset_option)
+        if not arcpy.Exists(dataset):
+            plan.add(ERROR, "{} not found: {}".format(
+                dataset_option, dataset), dataset_option)
+            continue
+        fields = [field.name for field in arcpy.ListFields(dataset)]
+        for field_option in field_options:
+            field = config.get("RWSM", field_option)
+            if field not in fields:
+                plan.add(ERROR, "Field '{}' ({}) not found in {}".format(
+                    field, field_option, dataset), field_option)
+
+    for raster_option in RASTERS:
+        raster = config.get("RWSM", raster_option)
+        if not arcpy.Exists(raster):
+            plan.add(ERROR, "{} not found: {}".format(
+                raster_option, raster), raster_option)
+
+
+def check_options(config, plan):
+    """Check that optional parameters selecting alternative code paths hold known values
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+        plan {Plan} -- plan collecting findings
+    """
+
+    zonal_engine = helpers.get_config_option(config, "zonal_engine", "arcpy")
+    if zonal_engine not in zonal.ZONAL_ENGINES + ("auto",):
+        plan.add(ERROR, "Unknown zonal_engine '{}', expected auto or one of {}".format(
+            zonal_engine, ", ".join(zonal.ZONAL_ENGINES)), "zonal_engine")
+
+    try:
+        covariates = helpers.get_covariates(config)
+    except ValueError as error:
+        plan.add(ERROR, str(error), "covariates")
+        covariates = []
+    for (name, file_name) in covariates:
+        if name in ("slope", "precipitation"):
+            plan.add(ERROR, "Covariate name '{}' is reserved for the model rasters".format(
+                name), "covariates")
+        elif not arcpy.Exists(file_name):
+            plan.add(ERROR, "Covariate {} not found: {}".format(name, file_name), "covariates")
+
+    for option in ("tile_max_area", "tile_max_features"):
+        value = helpers.get_config_option(config, option)
+        try:
+            invalid = value is not None and float(value) < 0
+        except ValueError:
+            invalid = True
+        if invalid:
+            plan.add(ERROR, "{} must be a number of zero or more, got '{}'".format(option, value), option)
+
+
+def check_slope_bins(config, plan):
+    """Check slope bin labels parse, and that slope bin codes agree between the analysis and the coefficient lookup
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+        plan {Plan} -- plan collecting findings
+
+    Returns:
+        list -- [lower, upper, code] slope bins as assigned by run_analysis, None if labels do not parse
+    """
+
+    try:
+        slope_bins = helpers.load_slope_bins(config)
+        slope_bins_dict = helpers.load_slope_bins(config, get_dict=True)
+    except (ValueError, IndexError) as error:
+        plan.add(ERROR, "Slope bin labels in {} could not be parsed ({}), expected labels such as '0-5%' or '30%+'".format(
+            config.get("RWSM", "runoff_coeff_file_name"), error), "runoff_coeff_slope_bin_field")
+        return None
+
+    # Codes as assigned in run_analysis (table order) and get_code_to_coeff_lookup (dictionary order)
+    slope_bins_w_codes = [slope_bin + [(i + 1) * 100]
+                          for (i, slope_bin) in enumerate(slope_bins)]
+    lookup_codes = {}
+    slope_bin_code = 100
+    for label in slope_bins_dict.keys():
+        lookup_codes[tuple(slope_bins_dict[label])] = slope_bin_code
+        slope_bin_code += 100
+    mismatched = [slope_bin for slope_bin in slope_bins_w_codes
+                  if lookup_codes.get(tuple(slope_bin[:2])) != slope_bin[2]]
+    if len(mismatched) > 0:
+        plan.add(WARNING, "Slope bin codes differ between the analysis and the coefficient lookup for bins {}; "
+                 "coefficients may be assigned to the wrong slope bins".format(
+                     ", ".join("{}-{}".format(lower, upper) for (lower, upper, code) in mismatched)),
+                 "runoff_coeff_slope_bin_field")
+
+    ordered = sorted(slope_bins)
+    for (previous, current) in zip(ordered[:-1], ordered[1:]):
+        if previous[1] != current[0]:
+            plan.add(WARNING, "Slope bins {}-{} and {}-{} are not contiguous, slopes between them are not binned".format(
+                previous[0], previous[1], current[0], current[1]), "runoff_coeff_slope_bin_field")
+
+    return slope_bins_w_codes
+
+
+def get_coefficient_table_errors(config):
+    """Cells of the runoff coefficient table that get_code_to_coeff_lookup cannot read
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+
+    Returns:
+        list -- messages naming the row and the unknown soil type or unreadable cell
+    """
+
+    file_name = config.get("RWSM", "runoff_coeff_file_name")
+    table = helpers.load_csv(file_name)
+    headers = table[0]
+    soil_field = config.get("RWSM", "runoff_coeff_soil_type_field")
+    numeric_fields = [config.get("RWSM", "runoff_coeff_field"),
+                      config.get("RWSM", "runoff_coeff_land_use_class_code_field")]
+    soil_idx = headers.index(soil_field)
+    numeric_idxs = [headers.index(field) for field in numeric_fields]
+
+    errors = []
+    for (i, row) in enumerate(table[1:]):
+        # Rows are numbered as in a spreadsheet, the header is row 1
+        if len(row) < len(headers):
+            errors.append("row {}: {} of {} cells".format(i + 2, len(row), len(headers)))
+            continue
+        if row[soil_idx] not in helpers.SOIL_TYPE_VALUES:
+            errors.append("row {}: unknown soil type '{}' in {}, expected one of {}".format(
+                i + 2, row[soil_idx], soil_field, ", ".join(sorted(helpers.SOIL_TYPE_VALUES))))
+        for (field, idx) in zip(numeric_fields, numeric_idxs):
+            try:
+                float(row[idx])
+            except ValueError:
+                errors.append("row {}: {} '{}' is not a number".format(i + 2, field, row[idx]))
+    return errors
+
+
+def check_coefficient_coverage(config, plan, slope_bins_w_codes, soil_types=None, land_use_bins=None):
+    """Check that every slope, soil, and land use combination has a runoff coefficient
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+        plan {Plan} -- plan collecting findings
+        slope_bins_w_codes {list} -- slope bins from check_slope_bins
+
+    Keyword Arguments:
+        soil_types {list} -- soil types to cover, all soil types in the coefficient table if None (default: {None})
+        land_use_bins {list} -- land use lookup values to cover, all in the coefficient table if None (default: {None})
+    """
+
+    try:
+        codes_to_coeff_lookup = helpers.get_code_to_coeff_lookup(config)
+    except (KeyError, ValueError, IndexError) as error:
+        errors = get_coefficient_table_errors(config) or [repr(error)]
+        listed = "; ".join(errors[:MAX_LISTED])
+        if len(errors) > MAX_LISTED:
+            listed += "; and {} more".format(len(errors) - MAX_LISTED)
+        plan.add(ERROR, "Runoff coefficients in {} could not be read: {}".format(
+            config.get("RWSM", "runoff_coeff_file_name"), listed), "runoff_coeff_file_name")
+        return
+
+    if soil_types is None or land_use_bins is None:
+        headers = read_csv_headers(config.get("RWSM", "runoff_coeff_file_name"))
+        soil_idx = headers.index(config.get("RWSM", "runoff_coeff_soil_type_field"))
+        land_use_idx = headers.index(config.get(
+            "RWSM", "runoff_coeff_land_use_class_code_field"))
+        table = helpers.load_csv(config.get("RWSM", "runoff_coeff_file_name"))[1:]
+        if soil_types is None:
+            soil_types = sorted(set(row[soil_idx] for row in table))
+        if land_use_bins is None:
+            land_use_bins = sorted(set(row[land_use_idx] for row in table))
+
+    missing = []
+    for (lower, upper, slope_code) in slope_bins_w_codes:
+        for soil_type in soil_types:
+            for land_use_bin in land_use_bins:
+                land_use_value = float(land_use_bin) if land_use_bin not in (
+                    '', None) else 0.0
+                code = helpers.calculateCode(
+                    slope_code, soil_type, land_use_value, None)
+                if code not in codes_to_coeff_lookup:
+                    missing.append("slope {}-{} / soil {} / land use {}".format(
+                        lower, upper, soil_type, land_use_bin))
+
+    if len(missing) > 0:
+        listed = "; ".join(missing[:MAX_LISTED])
+        if len(missing) > MAX_LISTED:
+            listed += "; and {} more".format(len(missing) - MAX_LISTED)
+        plan.add(WARNING, "{} slope / soil / land use combinations have no runoff coefficient, "
+                 "watersheds containing them will fail: {}".format(len(missing), listed),
+                 "runoff_coeff_file_name")
+
+
+def get_observed_values(config, plan):
+    """Soil types and land use lookup values present in the input feature classes
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+        plan {Plan} -- plan collecting findings
+
+    Returns:
+        tuple -- list of soil types and list of land use lookup values
+    """
+
+    chunk_size = int(helpers.get_config_option(config, "chunk_size", 100000))
+    soil_types = read_unique(config.get("RWSM", "soils_file_name"),
+                             config.get("RWSM", "soils_field"), chunk_size)
+    land_use_codes = read_unique(config.get("RWSM", "land_use"),
+                                 config.get("RWSM", "land_use_field"), chunk_size)
+
+    # Land use lookup values, as joined by fasterJoin in run_analysis
+    lookup = {}
+    table = helpers.load_csv(config.get("RWSM", "land_use_LU_file_name"))
+    headers = table[0]
+    code_idx = headers.index(config.get("RWSM", "land_use_LU_code_field"))
+    bin_idx = headers.index(config.get("RWSM", "land_use_LU_bin_field"))
+    for row in table[1:]:
+        lookup[row[code_idx]] = row[bin_idx]
+
+    land_use_bins = set()
+    unmatched = []
+    for code in land_use_codes:
+        key = str(int(code)) if isinstance(code, float) and code == int(code) else str(code)
+        if key in lookup:
+            land_use_bins.add(lookup[key])
+        else:
+            unmatched.append(key)
+            land_use_bins.add('')
+    if len(unmatched) > 0:
+        plan.add(WARNING, "{} land use codes are missing from {}: {}".format(
+            len(unmatched), config.get("RWSM", "land_use_LU_file_name"),
+            ", ".join(unmatched[:MAX_LISTED])), "land_use_LU_file_name")
+
+    return (soil_types, sorted(land_use_bins))
+
+
+def check_spatial_references(config, plan):
+    """Check that all spatial inputs share the watersheds' coordinate system
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+        plan {Plan} -- plan collecting findings
+    """
+
+    reference = arcpy.Describe(config.get("RWSM", "watersheds")).spatialReference
+    for option in VECTORS[1:] + RASTERS:
+        spatial_reference = arcpy.Describe(
+            config.get("RWSM", option)).spatialReference
+        if spatial_reference.name != reference.name or \
+                spatial_reference.factoryCode != reference.factoryCode:
+            plan.add(WARNING, "{} coordinate system ({}) differs from watersheds ({}), inputs are projected on the fly".format(
+                option, spatial_reference.name, reference.name), option)
+        if spatial_reference.type != "Projected":
+            plan.add(ERROR, "{} has a geographic coordinate system ({}), areas and runoff volumes require a projected coordinate system".format(
+                option, spatial_reference.name), option)
+
+
+def check_extents(config, plan):
+    """Check that every input overlaps the watersheds and rasters cover them
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+        plan {Plan} -- plan collecting findings
+    """
+
+    watersheds_extent = arcpy.Describe(config.get("RWSM", "watersheds")).extent
+    for option in VECTORS[1:] + RASTERS:
+        extent = arcpy.Describe(config.get("RWSM", option)).extent
+        if extent.disjoint(watersheds_extent):
+            plan.add(ERROR, "{} does not overlap the watersheds".format(
+                option), option)
+        elif option in RASTERS and not extent.contains(watersheds_extent):
+            plan.add(WARNING, "{} does not fully cover the watersheds, polygons outside it get no {}".format(
+                option, option.replace("_file_name", "")), option)
+
+
+def probe_watersheds(config):
+    """Cheap complexity probes of every watershed from envelope queries, without geoprocessing
+
+    Land use and soils features are counted by centroid within each watershed's envelope,
+    reading centroids in bounded chunks. Their vertices are estimated from a sample of
+    geometries, probe_sample_size features per input (every feature if 0): features in an
+    envelope times the mean vertex count of the sampled features in it, or of the whole
+    sample when none were sampled there.
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+
+    Returns:
+        list -- one dictionary per watershed, sorted by name, holding watershed, area, vertices
+            (watershed boundary), land_use_features, land_use_vertices, soils_features and soils_vertices
+    """
+
+    # Envelope and vertex count of each watershed
+    envelopes = {}
+    vertices = {}
+    areas = {}
+    watersheds_field = config.get("RWSM", "watersheds_field")
+    with arcpy.da.SearchCursor(config.get("RWSM", "watersheds"), (watersheds_field, "SHAPE@")) as cursor:
+        for (name, shape) in cursor:
+            extent = shape.extent
+            if name in envelopes:
+                (xmin, ymin, xmax, ymax) = envelopes[name]
+                envelopes[name] = (min(xmin, extent.XMin), min(ymin, extent.YMin),
+                                   max(xmax, extent.XMax), max(ymax, extent.YMax))
+            else:
+                envelopes[name] = (extent.XMin, extent.YMin,
+                                   extent.XMax, extent.YMax)
+            vertices[name] = vertices.get(name, 0) + shape.pointCount
+            areas[name] = areas.get(name, 0.0) + shape.area
+
+    # Feature centroids of every feature, vertex counts of a sample
+    chunk_size = int(helpers.get_config_option(config, "chunk_size", 100000))
+    sample_size = int(helpers.get_config_option(config, "probe_sample_size", PROBE_SAMPLE_SIZE))
+    centroids = {}
+    samples = {}
+    for option in ("land_use", "soils_file_name"):
+        fc = config.get("RWSM", option)
+        xy = [fc_table["SHAPE@XY"] for fc_table in helpers.iter_table_chunks(fc, ["SHAPE@XY"], chunk_size)]
+        centroids[option] = numpy.concatenate(xy).reshape(-1, 2) if xy else numpy.zeros((0, 2))
+        samples[option] = sample_vertex_counts(fc, sample_size)
+
+    def within(xy, envelope):
+        (xmin, ymin, xmax, ymax) = envelope
+        return (xy[:, 0] >= xmin) & (xy[:, 0] <= xmax) & (xy[:, 1] >= ymin) & (xy[:, 1] <= ymax)
+
+    probes = []
+    for name in sorted(envelopes.keys()):
+        probe = {"watershed": name, "area": areas[name], "vertices": vertices[name]}
+        for (option, prefix) in (("land_use", "land_use"), ("soils_file_name", "soils")):
+            n_features = int(numpy.sum(within(centroids[option], envelopes[name])))
+            (sample_xy, sample_counts) = samples[option]
+            sampled = sample_counts[within(sample_xy, envelopes[name])]
+            if len(sampled) == 0:
+                sampled = sample_counts
+            mean_vertices = float(numpy.mean(sampled)) if len(sampled) else 0.0
+            probe[prefix + "_features"] = n_features
+            probe[prefix + "_vertices"] = int(round(n_features * mean_vertices))
+        probes.append(probe)
+    return probes
+
+
+def predict_zonal_seconds(config, probe, cell_areas):
+    """Predicted seconds of each zonal engine for a watershed
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+        probe {dictionary} -- watershed probe from probe_watersheds
+        cell_areas {list} -- cell area of each raster reduced per watershed
+
+    Returns:
+        dictionary -- predicted seconds keyed by engine
+    """
+
+    costs = dict((option, float(helpers.get_config_option(config, option, default)))
+                 for (option, default) in ENGINE_COST_DEFAULTS.items())
+    features = probe["land_use_features"] + probe["soils_features"]
+    vertices = probe["vertices"] + probe["land_use_vertices"] + probe["soils_vertices"]
+    million_cells = sum(probe["area"] / cell_area for cell_area in cell_areas) / 10.0**6
+    return {
+        "arcpy": costs["engine_arcpy_seconds_per_raster"] * len(cell_areas) +
+        costs["engine_arcpy_seconds_per_feature"] * features +
+        costs["engine_arcpy_seconds_per_million_cells"] * million_cells,
+        "exact": costs["engine_exact_seconds_per_raster"] * len(cell_areas) +
+        costs["engine_exact_seconds_per_vertex"] * vertices +
+        costs["engine_exact_seconds_per_million_cells"] * million_cells
+    }
+
+
+def select_zonal_engine(config, probe, cell_areas):
+    """Cheapest zonal engine for a watershed
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+        probe {dictionary} -- watershed probe from probe_watersheds
+        cell_areas {list} -- cell area of each raster reduced per watershed
+
+    Returns:
+        tuple -- engine name and predicted seconds keyed by engine
+    """
+
+    predicted = predict_zonal_seconds(config, probe, cell_areas)
+    engine = min(zonal.ZONAL_ENGINES, key=lambda name: predicted[name])
+    return (engine, predicted)
+
+
+def estimate_costs(config, plan):
+    """Estimate per-watershed feature counts, runtime, memory and scratch disk from envelope queries
+
+    Features are counted by centroid within each watershed's envelope; the cost model
+    parameters (planner_*) can be tuned against measured runs.
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+        plan {Plan} -- plan collecting findings
+    """
+
+    costs = dict((option, float(helpers.get_config_option(config, option, default)))
+                 for (option, default) in COST_DEFAULTS.items())
+    probes = probe_watersheds(config)
+
+    cell_area = max(arcpy.sa.Raster(config.get("RWSM", option)).meanCellWidth *
+                    arcpy.sa.Raster(config.get("RWSM", option)).meanCellHeight
+                    for option in RASTERS)
+
+    totals = {"watersheds": 0, "features": 0, "seconds": 0.0,
+              "peak_memory_bytes": 0.0, "scratch_bytes": 0.0}
+    for probe in probes:
+        features = probe["land_use_features"] + probe["soils_features"]
+        cells = int(probe["area"] / cell_area)
+        seconds = costs["planner_seconds_per_watershed"] + \
+            costs["planner_seconds_per_feature"] * features + \
+            costs["planner_seconds_per_million_cells"] * cells / 10.0**6
+        memory_bytes = costs["planner_bytes_per_feature"] * features
+        scratch_bytes = costs["planner_scratch_bytes_per_feature"] * \
+            costs["planner_scratch_copies"] * features
+
+        plan.estimates.append({
+            "watershed": probe["watershed"],
+            "land_use_features": probe["land_use_features"],
+            "soils_features": probe["soils_features"],
+            "vertices": probe["vertices"],
+            "cells": cells,
+            "seconds": seconds,
+            "memory_bytes": memory_bytes,
+            "scratch_bytes": scratch_bytes
+        })
+        totals["watersheds"] += 1
+        totals["features"] += features
+        totals["seconds"] += seconds
+        totals["peak_memory_bytes"] = max(
+            totals["peak_memory_bytes"], memory_bytes)
+        # Intermediate feature classes are kept in the scratch geodatabase for the whole run
+        totals["scratch_bytes"] += scratch_bytes
+
+    plan.totals = totals
+    plan.add(INFO, "Estimated runtime {} for {} watersheds".format(
+        datetime.timedelta(seconds=round(totals["seconds"])), totals["watersheds"]))
+
+
+def validate(config):
+    """Validate inputs: schemas, slope bins, coefficient coverage, coordinate systems and extents
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+
+    Returns:
+        Plan -- plan holding findings
+    """
+
+    plan = Plan()
+    check_options(config, plan)
+    check_csv_fields(config, plan)
+    check_feature_class_fields(config, plan)
+    if plan.has_errors():
+        return plan
+
+    slope_bins_w_codes = check_slope_bins(config, plan)
+    check_spatial_references(config, plan)
+    check_extents(config, plan)
+    if slope_bins_w_codes is not None:
+        (soil_types, land_use_bins) = get_observed_values(config, plan)
+        check_coefficient_coverage(
+            config, plan, slope_bins_w_codes, soil_types, land_use_bins)
+    return plan
+
+
+def plan_analysis(config):
+    """Dry run: validate inputs and estimate costs without running the analysis
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+
+    Returns:
+        Plan -- plan holding findings and estimates
+    """
+
+    plan = validate(config)
+    if not plan.has_errors():
+        estimate_costs(config, plan)
+    return plan
+
+
+if __name__ == "__main__":
+    config_file_name = sys.argv[1] if len(sys.argv) > 1 else "rwsm.ini"
+    plan = plan_analysis(helpers.load_config(config_file_name))
+    for line in plan.report():
+        print(line)
+    if len(sys.argv) > 2:
+        plan.write_estimates(sys.argv[2])
+    sys.exit(1 if plan.has_errors() else 0)
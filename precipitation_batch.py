@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+"""precipitation_batch.py: Evaluates RWSM runoff against a batch of precipitation rasters."""
+
+__copyright__ = """
+    Copyright (C) 2018 San Francisco Estuary Institute (SFEI)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import csv
+import time
+import helpers
+import rwsm
+import zonal
+import arcpy
+import numpy
+
+
+def get_precipitation_file_names(config):
+    """List precipitation rasters to evaluate, the configured raster first
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+
+    Returns:
+        list -- precipitation raster paths
+    """
+
+    file_names = [config.get("RWSM", "precipitation_file_name")]
+    batch = helpers.get_config_option(config, "precipitation_batch", "")
+    for file_name in batch.split(";"):
+        file_name = file_name.strip().strip("'")
+        if file_name and file_name not in file_names:
+            file_names.append(file_name)
+    return file_names
+
+
+def get_scenario_name(file_name):
+    """Scenario name for a precipitation raster, used for column and file names
+
+    Arguments:
+        file_name {string} -- path to precipitation raster
+
+    Returns:
+        string -- raster base name with illegal characters removed
+    """
+
+    return helpers.strip_chars(os.path.splitext(os.path.basename(file_name))[0],
+                               '!@#$%^&*()-+=,<>?/\~`[]{}.')
+
+
+def get_zonal_engines(config, workspace):
+    """Zonal engine of every watershed of a finished run
+
+    Arguments:
+        config {instance} -- ConfigParser instance the run used
+        workspace {string} -- run workspace, holding engine_log.csv when zonal_engine is auto
+
+    Returns:
+        tuple -- configured engine and dictionary of engines chosen per watershed, empty unless auto
+    """
+
+    zonal_engine = helpers.get_config_option(config, "zonal_engine", "arcpy")
+    engines = {}
+    engine_log_file_name = os.path.join(workspace, "engine_log.csv")
+    if zonal_engine == "auto" and os.path.isfile(engine_log_file_name):
+        engines = dict((row[0], row[1]) for row in helpers.load_csv(engine_log_file_name)[1:] if row)
+    return (zonal_engine, engines)
+
+
+def run_precipitation_batch(config, precipitation_file_names=None, is_gui=False, messages=None):
+    """Run the analysis once, then evaluate runoff volumes for every precipitation raster
+
+    The first raster runs through run_analysis, which computes the intersect geometry, codes, and
+    coefficients. Every raster in the batch is then reduced with the zonal engine the base run
+    used for the watershed, so the means of the first raster match the base run: the arcpy
+    engine rasterizes the polygons once by cell centre onto the grid of the first raster, the
+    exact engine weights every cell by its coverage of each polygon. The engine of every
+    watershed is written to results_precipBatch.csv.
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+
+    Keyword Arguments:
+        precipitation_file_names {list} -- precipitation rasters, read from config if not given (default: {None})
+        is_gui {bool} -- indicates if running from ArcMap toolbox GUI (default: {False})
+        messages {Tool_Messages} -- receiver of messages, progress and cancellation, toolbox messages if None (default: {None})
+
+    Returns:
+        string -- workspace path
+    """
+
+    start_time = time.clock()
+    messages = messages or rwsm.Tool_Messages(is_gui)
+    if precipitation_file_names is None:
+        precipitation_file_names = get_precipitation_file_names(config)
+    scenario_names = [get_scenario_name(file_name)
+                      for file_name in precipitation_file_names]
+
+    # Base run, computes geometry, codes and coefficients once --------------------
+    config.set("RWSM", "precipitation_file_name", precipitation_file_names[0])
+    (workspace, intersected_watersheds) = rwsm.run_analysis(
+        config=config, is_gui=is_gui, messages=messages)
+
+    messages.set_progressor("Aligning precipitation rasters...")
+
+    # Align every raster with the grid of the first -------------------------------
+    snap_raster = arcpy.sa.Raster(precipitation_file_names[0])
+    snap_grid = helpers.get_raster_grid(snap_raster)
+    scenario_rasters = []
+    for (i, file_name) in enumerate(precipitation_file_names):
+        raster = arcpy.sa.Raster(file_name)
+        if not helpers.is_aligned(raster, snap_grid):
+            raster = arcpy.sa.Raster(helpers.alignRaster(
+                raster, snap_raster, "precipAligned_{}".format(i)))
+        scenario_rasters.append(raster)
+
+    # One statistics writer per scenario ------------------------------------------
+    watershed_names = [watershed_name for (
+        watershed_name, intersect) in intersected_watersheds]
+    slope_bins = helpers.load_slope_bins(config)
+    writers = [rwsm.Stats_Writer(config, watershed_names, slope_bins)
+               for scenario_name in scenario_names]
+
+    runoff_coeff_field = config.get("RWSM", "runoff_coeff_field")
+    runoff_vol_field = 'runoff_vol_' + runoff_coeff_field
+    fields = writers[0].get_fc_table_fields() + \
+        ['uID', runoff_coeff_field, 'SHAPE@XY']
+    concentrations = writers[0].concentrations
+    slope_bin_field = config.get("RWSM", "slope_bin_field")
+    if concentrations is not None and slope_bin_field not in fields:
+        fields.append(slope_bin_field)
+    runoff_volumes = numpy.zeros(
+        (len(intersected_watersheds), len(scenario_names)))
+    watershed_errors = []
+    tile_size = int(helpers.get_config_option(config, "zonal_tile_size", 0))
+    workers = int(helpers.get_config_option(config, "zonal_workers", 1))
+    tile_timings = []
+    (zonal_engine, engines) = get_zonal_engines(config, workspace)
+    watershed_engines = []
+
+    # Rasterize each watershed once, stream every precipitation raster through it
+    for (i, (watershed_name, intersect)) in enumerate(intersected_watersheds):
+        if messages.is_cancelled():
+            runoff_volumes[i:, :] = numpy.nan
+            messages.add_warning("Precipitation batch cancelled")
+            break
+        try:
+            msg = "Precipitation batch: {}, watershed {} of {}...".format(
+                watershed_name, i + 1, len(intersected_watersheds))
+            messages.set_step(msg, i + 1, len(intersected_watersheds))
+
+            fc_table = helpers.table_to_array(intersect, fields)
+            uids = fc_table['uID']
+            engine = engines.get(watershed_name, zonal_engine)
+            if engine == "exact":
+                (polygon_uids, polygons) = helpers.get_polygon_rings(intersect)
+                grid = helpers.get_raster_window(snap_grid, arcpy.Describe(intersect).extent)
+                n_zones = int(max(polygon_uids.max(), uids.max()))
+            else:
+                engine = "arcpy"
+                (zones, grid) = helpers.rasterizeZones(
+                    intersect, snap_raster, "zones_" + watershed_name)
+                n_zones = int(max(zones.max(), uids.max()))
+
+            # Loads per m3 of runoff, concentrations are resolved once for every scenario
+            if concentrations is not None:
+                (unit_loads, unmatched) = concentrations.compute_loads(
+                    numpy.ones(len(fc_table)), fc_table[config.get("RWSM", "land_use_LU_class_field")],
+                    fc_table[config.get("RWSM", "soils_bin_field")], fc_table[slope_bin_field])
+
+            scenario_tables = []
+            for (scenario_name, raster) in zip(scenario_names, scenario_rasters):
+                (values, valid) = helpers.read_raster_window(raster, grid)
+                timings = []
+                if engine == "exact":
+                    (polygon_means, weights) = zonal.coverage_means(
+                        polygons, values, valid, grid, tile_size=tile_size, workers=workers,
+                        timings=timings)
+                    means = numpy.empty(n_zones + 1)
+                    means.fill(numpy.nan)
+                    means[polygon_uids] = polygon_means
+                    precipitation = means[uids]
+                else:
+                    (means, counts) = zonal.zonal_means(
+                        zones, values, valid, n_zones, tile_size, workers, timings)
+                    precipitation = means[uids]
+
+                    # Polygons without a cell center take the value at their centroid
+                    empty = counts[uids] == 0
+                    if numpy.any(empty):
+                        precipitation[empty] = zonal.sample_points(
+                            fc_table['SHAPE@XY'][empty, 0], fc_table['SHAPE@XY'][empty, 1],
+                            values, valid, grid)
+                if tile_size > 0:
+                    for timing in timings:
+                        timing.update(watershed=watershed_name, reduction=scenario_name)
+                    tile_timings += timings
+
+                scenario_table = fc_table.copy()
+                scenario_table['precipitation_mean'] = precipitation
+                # convert ppt from mm to m and multiply by area and runoff coeff
+                scenario_table[runoff_vol_field] = (
+                    precipitation / 1000.0) * fc_table['SHAPE@AREA'] * fc_table[runoff_coeff_field]
+                if concentrations is not None:
+                    scenario_loads = numpy.nan_to_num(
+                        scenario_table[runoff_vol_field])[:, numpy.newaxis] * unit_loads
+                    for (k, field) in enumerate(writers[0].get_accumulator_fields()["loads"]):
+                        scenario_table[field] = scenario_loads[:, k]
+                scenario_tables.append(scenario_table)
+
+            for (j, scenario_table) in enumerate(scenario_tables):
+                writers[j].add_table(watershed_name, scenario_table)
+                runoff_volumes[i, j] = numpy.sum(
+                    scenario_table[runoff_vol_field])
+            watershed_engines.append(engine)
+
+            msg = "{}: precipitation batch of {} rasters complete: {}".format(
+                watershed_name, len(scenario_rasters), helpers.format_time(start_time))
+            messages.add_message(msg)
+
+        except Exception as error:
+            msg = "{}: Error computing precipitation batch: {}".format(
+                watershed_name, error)
+            messages.add_message(msg)
+            watershed_errors.append((watershed_name, error))
+            runoff_volumes[i, :] = numpy.nan
+            watershed_engines.append("")
+            continue
+
+    # Write watershed x scenario runoff table and per scenario statistics -------
+    with open(os.path.join(workspace, "results_precipBatch.csv"), "wb") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["Watershed", "Zonal Engine"] + [scenario_name + " Runoff Vol. (m3)"
+                                                         for scenario_name in scenario_names])
+        for (i, watershed_name) in enumerate(watershed_names):
+            engine = watershed_engines[i] if i < len(watershed_engines) else ""
+            writer.writerow([watershed_name, engine] + runoff_volumes[i].tolist())
+
+    for (scenario_name, writer) in zip(scenario_names, writers):
+        writer.write_ws_stats_table(os.path.join(
+            workspace, "results_wsStats_{}.csv".format(scenario_name)))
+    if tile_timings:
+        zonal.write_tile_timings(os.path.join(
+            workspace, "tile_timings_precipBatch.csv"), tile_timings)
+
+    msg = "Precipitation batch complete: {}".format(
+        helpers.format_time(start_time))
+    messages.add_message(msg)
+    for (watershed_name, error) in watershed_errors:
+        messages.add_message(watershed_name)
+
+    return workspace
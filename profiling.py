@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+
+"""profiling.py: Opt-in function-level profiling of watershed analyses, with call counts of hot helpers."""
+
+__copyright__ = """
+    Copyright (C) 2018 San Francisco Estuary Institute (SFEI)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import csv
+import time
+import pstats
+import cProfile
+import StringIO
+import threading
+import core
+
+PROFILE_MODES = ("deterministic", "sampling")
+
+# Hot helpers whose calls are counted in every profiled watershed, as (module, attribute) paths
+HOT_HELPERS = (("helpers", "fasterJoin"), ("helpers", "calculateCode"), ("helpers", "calculateCodes"),
+               ("helpers", "lookupCoefficients"), ("rwsm", "Stats_Writer.add_accumulator"),
+               ("rwsm", "Stats_Writer.add_table"), ("rwsm", "Analysis_Run.add_statistics"))
+
+REPORT_FILE_NAME = "profile_report.txt"
+CALLS_FILE_NAME = "profile_calls.csv"
+
+
+class Stack_Sampler(threading.Thread):
+    """Sampling profiler: periodically records the stack of the profiled thread
+
+    Each sample counts once for the innermost function (self) and once for every distinct
+    function on the stack (inclusive); overhead depends on the interval, not on call counts.
+
+    Arguments:
+        threading.Thread {class} -- sampler runs as a daemon thread
+
+    Returns:
+        Stack_Sampler -- Stack_Sampler instance
+    """
+
+    def __init__(self, thread_id, interval=0.01):
+        """Class initialization
+
+        Arguments:
+            thread_id {int} -- identifier of the thread to sample
+
+        Keyword Arguments:
+            interval {float} -- seconds between samples (default: {0.01})
+        """
+
+        threading.Thread.__init__(self, name="rwsm-stack-sampler")
+        self.daemon = True
+        self.thread_id = thread_id
+        self.interval = interval
+        self.self_counts = {}
+        self.inclusive_counts = {}
+        self.n_samples = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        """Sampling loop"""
+
+        while not self.stopped.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            functions = []
+            while frame is not None:
+                code = frame.f_code
+                functions.append("{}:{}({})".format(
+                    os.path.basename(code.co_filename), code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            if functions:
+                self.n_samples += 1
+                self.self_counts[functions[0]] = self.self_counts.get(functions[0], 0) + 1
+                for function in set(functions):
+                    self.inclusive_counts[function] = self.inclusive_counts.get(function, 0) + 1
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        """Stop sampling"""
+
+        self.stopped.set()
+        self.join()
+
+
+class Call_Counter(object):
+    """Counts calls of hot helpers by wrapping them while installed
+
+    Arguments:
+        object {object} -- Remenant of python 2.7, declares new-style class
+
+    Returns:
+        Call_Counter -- Call_Counter instance
+    """
+
+    def __init__(self, paths=HOT_HELPERS):
+        """Class initialization
+
+        Keyword Arguments:
+            paths {tuple} -- (module, attribute) paths of the counted functions (default: {HOT_HELPERS})
+        """
+
+        self.paths = paths
+        self.counts = {}
+        self.originals = []
+        # Paths whose module was not loaded, reported rather than silently uncounted
+        self.skipped = set()
+
+    def wrap(self, name, function):
+        """Counting wrapper of a function
+
+        Arguments:
+            name {string} -- counted name
+            function {function} -- wrapped function
+
+        Returns:
+            function -- wrapper
+        """
+
+        counts = self.counts
+
+        def counted(*args, **kwargs):
+            counts[name] = counts.get(name, 0) + 1
+            return function(*args, **kwargs)
+        counted.__name__ = function.__name__
+        counted.__doc__ = function.__doc__
+        return counted
+
+    def get_modules(self, module_name):
+        """Loaded copies of a module, including the script run as __main__
+
+        Under python rwsm.py the analysis runs in __main__; a module importing rwsm meanwhile
+        loads a second copy, so both are counted.
+
+        Arguments:
+            module_name {string} -- module name
+
+        Returns:
+            list -- loaded modules, empty if the module is not loaded
+        """
+
+        modules = []
+        main = sys.modules.get("__main__")
+        main_file = getattr(main, "__file__", None)
+        if main_file and os.path.splitext(os.path.basename(main_file))[0] == module_name:
+            modules.append(main)
+        module = sys.modules.get(module_name)
+        if module is not None and module is not main:
+            modules.append(module)
+        return modules
+
+    def install(self):
+        """Replace the hot helpers with counting wrappers, modules not loaded are skipped"""
+
+        for (module_name, attribute) in self.paths:
+            modules = self.get_modules(module_name)
+            if not modules:
+                self.skipped.add("{}.{}".format(module_name, attribute))
+            for module in modules:
+                self.install_wrapper(module, module_name, attribute)
+
+    def install_wrapper(self, module, module_name, attribute):
+        """Replace one function of a module with its counting wrapper
+
+        Arguments:
+            module {module} -- loaded module
+            module_name {string} -- module name, used in counted names
+            attribute {string} -- function or Class.method path within the module
+        """
+
+        owner = module
+        parts = attribute.split(".")
+        for part in parts[:-1]:
+            owner = getattr(owner, part)
+        # Class attributes are read from __dict__, so methods are restored unbound
+        original = owner.__dict__[parts[-1]] if isinstance(owner, type) else getattr(owner, parts[-1])
+        self.originals.append((owner, parts[-1], original))
+        setattr(owner, parts[-1], self.wrap("{}.{}".format(module_name, attribute), original))
+
+    def uninstall(self):
+        """Restore the original functions"""
+
+        for (owner, name, original) in reversed(self.originals):
+            setattr(owner, name, original)
+        self.originals = []
+
+    def take(self):
+        """Counts since the previous call
+
+        Returns:
+            dictionary -- calls keyed by helper name
+        """
+
+        counts = dict(self.counts)
+        self.counts.clear()
+        return counts
+
+
+class Run_Profiler(object):
+    """Profiles selected watersheds of a run, one dump per watershed and an aggregated report
+
+    Arguments:
+        object {object} -- Remenant of python 2.7, declares new-style class
+
+    Returns:
+        Run_Profiler -- Run_Profiler instance
+    """
+
+    def __init__(self, workspace, mode="deterministic", watershed_names=None, top_n=30, interval=0.01):
+        """Class initialization
+
+        Arguments:
+            workspace {string} -- run workspace, dumps are written to its profiles folder
+
+        Keyword Arguments:
+            mode {string} -- deterministic (cProfile) or sampling (default: {"deterministic"})
+            watershed_names {list} -- watersheds to profile, every watershed if None (default: {None})
+            top_n {int} -- functions listed in the report (default: {30})
+            interval {float} -- seconds between samples of the sampling profiler (default: {0.01})
+
+        Raises:
+            ValueError -- unknown profiling mode
+        """
+
+        if mode not in PROFILE_MODES:
+            raise ValueError("Unknown profile mode '{}', expected one of {}".format(
+                mode, ", ".join(PROFILE_MODES)))
+        self.workspace = workspace
+        self.mode = mode
+        self.watershed_names = None if watershed_names is None else set(watershed_names)
+        self.top_n = top_n
+        self.interval = interval
+        self.profile_directory = os.path.join(workspace, "profiles")
+        self.dump_file_names = []
+        self.self_counts = {}
+        self.inclusive_counts = {}
+        self.n_samples = 0
+        self.calls = []
+        self.seconds = {}
+        self.counter = Call_Counter()
+        self.current = None
+
+    def is_selected(self, watershed_name):
+        """Whether a watershed is profiled
+
+        Arguments:
+            watershed_name {string} -- watershed name
+
+        Returns:
+            bool -- True if the watershed is profiled
+        """
+
+        return self.watershed_names is None or watershed_name in self.watershed_names
+
+    def start(self, watershed_name):
+        """Start profiling a watershed, does nothing if it is not selected
+
+        Arguments:
+            watershed_name {string} -- watershed name
+        """
+
+        if not self.is_selected(watershed_name):
+            return
+        if not os.path.isdir(self.profile_directory):
+            os.makedirs(self.profile_directory)
+        self.counter.install()
+        if self.mode == "deterministic":
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = Stack_Sampler(threading.current_thread().ident, self.interval)
+            profiler.start()
+        self.current = (watershed_name, profiler, time.time())
+
+    def stop(self):
+        """Stop profiling the current watershed and write its dump"""
+
+        if self.current is None:
+            return
+        (watershed_name, profiler, start_time) = self.current
+        self.current = None
+        self.seconds[watershed_name] = time.time() - start_time
+        self.counter.uninstall()
+        self.calls.append((watershed_name, self.counter.take()))
+
+        if self.mode == "deterministic":
+            profiler.disable()
+            file_name = os.path.join(self.profile_directory, watershed_name + ".prof")
+            profiler.dump_stats(file_name)
+        else:
+            profiler.stop()
+            file_name = os.path.join(self.profile_directory, watershed_name + "_samples.csv")
+            with open(file_name, "wb") as csvfile:
+                writer = csv.writer(csvfile)
+                writer.writerow(["Function", "Self Samples", "Inclusive Samples"])
+                for (function, count) in sorted(profiler.inclusive_counts.items(), key=lambda item: -item[1]):
+                    writer.writerow([function, profiler.self_counts.get(function, 0), count])
+            self.n_samples += profiler.n_samples
+            for (counts, merged) in ((profiler.self_counts, self.self_counts),
+                                     (profiler.inclusive_counts, self.inclusive_counts)):
+                for (function, count) in counts.items():
+                    merged[function] = merged.get(function, 0) + count
+        self.dump_file_names.append(file_name)
+
+    def report(self):
+        """Top functions over every profiled watershed
+
+        Returns:
+            list -- report lines
+        """
+
+        lines = ["Profiled watersheds ({}): {}".format(self.mode, ", ".join(
+            "{} ({:.1f} s)".format(name, seconds) for (name, seconds) in sorted(self.seconds.items())))]
+        if self.mode == "deterministic":
+            prof_files = [name for name in self.dump_file_names if name.endswith(".prof")]
+            if prof_files:
+                stream = StringIO.StringIO()
+                stats = pstats.Stats(*prof_files, stream=stream)
+                stats.sort_stats("cumulative").print_stats(self.top_n)
+                stats.sort_stats("tottime").print_stats(self.top_n)
+                lines += stream.getvalue().splitlines()
+        else:
+            lines.append("{} samples every {:g} s".format(self.n_samples, self.interval))
+            for (title, counts) in (("Self", self.self_counts), ("Inclusive", self.inclusive_counts)):
+                lines.append("")
+                lines.append("{} samples, top {}:".format(title, self.top_n))
+                for (function, count) in sorted(counts.items(), key=lambda item: -item[1])[:self.top_n]:
+                    lines.append("{:>8d} {:6.1%} {}".format(
+                        count, float(count) / max(self.n_samples, 1), function))
+
+        lines.append("")
+        lines.append("Hot helper calls:")
+        totals = {}
+        for (watershed_name, counts) in self.calls:
+            for (name, count) in counts.items():
+                totals[name] = totals.get(name, 0) + count
+        for (name, count) in sorted(totals.items(), key=lambda item: -item[1]):
+            lines.append("{:>10d} {}".format(count, name))
+        if self.counter.skipped:
+            lines.append("Not counted, module not loaded: {}".format(
+                ", ".join(sorted(self.counter.skipped))))
+        return lines
+
+    def close(self):
+        """Write the aggregated report and the per-watershed call counts
+
+        Returns:
+            string -- report file name, None if no watershed was profiled
+        """
+
+        self.stop()
+        if not self.seconds:
+            return None
+        report_file_name = os.path.join(self.workspace, REPORT_FILE_NAME)
+        with open(report_file_name, "w") as report_file:
+            report_file.write("\n".join(self.report()) + "\n")
+
+        names = sorted(set(name for (watershed_name, counts) in self.calls for name in counts))
+        with open(os.path.join(self.workspace, CALLS_FILE_NAME), "wb") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(["Watershed", "Seconds"] + names)
+            for (watershed_name, counts) in self.calls:
+                writer.writerow([watershed_name, self.seconds.get(watershed_name, "")] +
+                                [counts.get(name, 0) for name in names])
+        return report_file_name
+
+
+def get_run_profiler(config, workspace):
+    """Profiler configured by the profile options
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+        workspace {string} -- run workspace
+
+    Returns:
+        Run_Profiler -- profiler, None if profiling is off
+    """
+
+    mode = core.get_config_option(config, "profile")
+    if not mode or mode.strip().lower() in ("false", "0", "no", "off"):
+        return None
+    if mode.strip().lower() in ("true", "1", "yes", "on"):
+        mode = "deterministic"
+    watershed_names = core.get_config_option(config, "profile_watersheds")
+    if watershed_names:
+        watershed_names = [core.strip_chars(name.strip(), '!@#$%^&*()-+=,<>?/\~`[]{}.')
+                           for name in watershed_names.split(";") if name.strip()]
+    return Run_Profiler(
+        workspace, mode.strip().lower(), watershed_names or None,
+        int(core.get_config_option(config, "profile_top", 30)),
+        float(core.get_config_option(config, "profile_interval", 0.01)))
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+"""raster_stack.py: Model rasters snapped to one grid and cached as a memory mapped multi-band stack."""
+
+__copyright__ = """
+    Copyright (C) 2018 San Francisco Estuary Institute (SFEI)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import hashlib
+import numpy
+import core
+import zonal
+
+# Cell values are stored as 32 bit floats, cells without data as NaN
+STACK_DTYPE = "<f4"
+
+# Cells read from a source raster at a time while building a stack
+BUILD_BLOCK_CELLS = 10000000
+
+# Bands read by the zonal engines, other bands are covariates
+MODEL_BANDS = ("slope", "precipitation")
+
+
+def get_stack_bands(config):
+    """Bands of the stack: slope, precipitation and configured covariates
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+
+    Returns:
+        list -- (band name, raster path) tuples
+    """
+
+    return [("slope", config.get("RWSM", "slope_file_name")),
+            ("precipitation", config.get("RWSM", "precipitation_file_name"))] + \
+        core.get_covariates(config)
+
+
+def get_stack_key(bands, grid):
+    """Cache key of a stack, from its sources and grid
+
+    Arguments:
+        bands {list} -- (band name, raster path) tuples
+        grid {dictionary} -- grid of the stack
+
+    Returns:
+        string -- hexadecimal digest
+    """
+
+    digest = hashlib.md5()
+    for (name, file_name) in bands:
+        digest.update("{}={}:{!r}\n".format(name, file_name, core.get_modified_time(file_name)))
+    digest.update(json.dumps(dict((name, grid[name]) for name in (
+        "xmin", "ymax", "cell_width", "cell_height", "ncols", "nrows")), sort_keys=True))
+    return digest.hexdigest()
+
+
+class Raster_Stack(object):
+    """Read access to a cached raster stack, every band aligned to one grid
+
+    Arguments:
+        object {object} -- Remenant of python 2.7, declares new-style class
+
+    Returns:
+        Raster_Stack -- Raster_Stack instance
+    """
+
+    def __init__(self, header_file_name):
+        """Class initialization, band data is memory mapped
+
+        Arguments:
+            header_file_name {string} -- JSON header written by build_raster_stack
+        """
+
+        with open(header_file_name) as header_file:
+            header = json.load(header_file)
+        self.header_file_name = header_file_name
+        self.bands = [str(band) for band in header["bands"]]
+        self.grid = header["grid"]
+        self.data = numpy.memmap(
+            os.path.join(os.path.dirname(header_file_name), header["data"]), dtype=STACK_DTYPE,
+            mode="r", shape=(len(self.bands), self.grid["nrows"], self.grid["ncols"]))
+
+    def read_window(self, xmin, ymin, xmax, ymax, bands=None):
+        """Read the cells of every band covering an extent in one aligned window read
+
+        Arguments:
+            xmin {float} -- extent minimum x
+            ymin {float} -- extent minimum y
+            xmax {float} -- extent maximum x
+            ymax {float} -- extent maximum y
+
+        Keyword Arguments:
+            bands {list} -- names of the bands to read, all bands if None (default: {None})
+
+        Returns:
+            tuple -- (bands, rows, columns) array of values, boolean array flagging cells holding
+                data and the grid of the window
+        """
+
+        band_index = [self.bands.index(band) for band in (bands or self.bands)]
+        (row0, col0, nrows, ncols) = zonal.window_bounds(self.grid, xmin, ymin, xmax, ymax)
+        values = numpy.array(self.data[band_index, row0:row0 + nrows, col0:col0 + ncols],
+                             dtype=numpy.float64)
+        valid = ~numpy.isnan(values)
+        values[~valid] = 0.0
+        window = {
+            "xmin": self.grid["xmin"] + col0 * self.grid["cell_width"],
+            "ymax": self.grid["ymax"] - row0 * self.grid["cell_height"],
+            "cell_width": self.grid["cell_width"],
+            "cell_height": self.grid["cell_height"],
+            "ncols": ncols,
+            "nrows": nrows
+        }
+        return (values, valid, window)
+
+
+def build_raster_stack(config, cache_directory, temp_workspace, messages=None):
+    """Snap every model raster to the slope raster grid over the watersheds, reusing a cached stack
+
+    Rasters not aligned with the slope raster are resampled once. The stack is keyed by its
+    sources' paths and modification times and by its grid, so runs on unchanged inputs open the
+    cached stack without reading any raster.
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+        cache_directory {string} -- folder holding cached stacks
+        temp_workspace {string} -- geodatabase receiving resampled rasters
+
+    Keyword Arguments:
+        messages {Tool_Messages} -- receiver of messages (default: {None})
+
+    Returns:
+        Raster_Stack -- opened stack
+    """
+
+    import arcpy
+    import helpers  # building needs arcpy, reading does not
+
+    snap_raster = arcpy.sa.Raster(config.get("RWSM", "slope_file_name"))
+    window = helpers.get_raster_window(helpers.get_raster_grid(snap_raster),
+                                       arcpy.Describe(config.get("RWSM", "watersheds")).extent)
+    bands = get_stack_bands(config)
+    key = get_stack_key(bands, window)
+    header_file_name = os.path.join(cache_directory, "stack_{}.json".format(key))
+    if os.path.isfile(header_file_name):
+        if messages is not None:
+            messages.add_message("Raster stack: using cached {}".format(header_file_name))
+        return Raster_Stack(header_file_name)
+
+    if not os.path.isdir(cache_directory):
+        os.makedirs(cache_directory)
+    data_file_name = "stack_{}.dat".format(key)
+    (nrows, ncols) = (window["nrows"], window["ncols"])
+    data = numpy.memmap(os.path.join(cache_directory, data_file_name), dtype=STACK_DTYPE,
+                        mode="w+", shape=(len(bands), nrows, ncols))
+    block_rows = max(BUILD_BLOCK_CELLS // max(ncols, 1), 1)
+    for (i, (name, file_name)) in enumerate(bands):
+        raster = arcpy.sa.Raster(file_name)
+        if not helpers.is_aligned(raster, window):
+            raster = arcpy.sa.Raster(helpers.alignRaster(
+                raster, snap_raster, os.path.join(temp_workspace, "stack_" + name)))
+        for row0 in range(0, nrows, block_rows):
+            n_rows = min(block_rows, nrows - row0)
+            block = dict(window, nrows=n_rows, lower_left=arcpy.Point(
+                window["xmin"], window["ymax"] - (row0 + n_rows) * window["cell_height"]))
+            (values, valid) = helpers.read_raster_window(raster, block)
+            values[~valid] = numpy.nan
+            data[i, row0:row0 + n_rows] = values
+        if messages is not None:
+            messages.add_message("Raster stack: {} band added".format(name))
+    data.flush()
+    del data
+
+    # The header is written last, an interrupted build leaves no usable stack behind
+    header = {
+        "bands": [name for (name, file_name) in bands],
+        "sources": [file_name for (name, file_name) in bands],
+        "grid": dict((name, window[name]) for name in (
+            "xmin", "ymax", "cell_width", "cell_height", "ncols", "nrows")),
+        "data": data_file_name
+    }
+    with open(header_file_name, "w") as header_file:
+        json.dump(header, header_file, indent=2)
+    return Raster_Stack(header_file_name)
@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+
+"""results_store.py: Columnar store of per-polygon RWSM results with a group-by query API."""
+
+__copyright__ = """
+    Copyright (C) 2018 San Francisco Estuary Institute (SFEI)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import csv
+import json
+import numpy
+import core
+import loads
+
+# Store layout: one raw binary file per column (<column>.bin), categorical columns hold integer
+# codes into the category list kept in schema.json. Every categorical column is indexed by a
+# row permutation sorted by code (<column>.order.bin) and the offsets of each code within it
+# (<column>.offsets.bin), so rows of any category are found without scanning the store.
+SCHEMA_FILE_NAME = "schema.json"
+CATEGORY_DTYPE = "<i4"
+
+
+def get_columns(config):
+    """Columns of the results store and the statistics table fields they are read from
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+
+    Returns:
+        list -- (column name, source field, kind) triples, kind is 'category' or a NumPy dtype string.
+            The watershed column has no source field, it is set per watershed.
+    """
+
+    runoff_coeff_field = config.get("RWSM", "runoff_coeff_field")
+    return [
+        ("uID", "uID", "<i4"),
+        ("watershed", None, "category"),
+        ("land_use_code", config.get("RWSM", "land_use_LU_code_field"), "category"),
+        ("land_use_class", config.get("RWSM", "land_use_LU_class_field"), "category"),
+        ("soil", config.get("RWSM", "soils_bin_field"), "category"),
+        ("slope_bin", config.get("RWSM", "slope_bin_field"), "category"),
+        ("area", "SHAPE@AREA", "<f8"),
+        ("precipitation", "precipitation_mean", "<f8"),
+        ("slope", "slope_mean", "<f8"),
+        ("coefficient", runoff_coeff_field, "<f8"),
+        ("runoff_volume", "runoff_vol_" + runoff_coeff_field, "<f8")
+    ] + [(loads.load_field(pollutant), loads.load_field(pollutant), "<f8")
+         for pollutant in loads.get_pollutants(config)] + \
+        [(name, name + "_mean", "<f8") for (name, file_name) in core.get_covariates(config)]
+
+
+def get_source_fields(columns):
+    """Fields to read from each watershed feature class to fill the store
+
+    Arguments:
+        columns {list} -- columns from get_columns
+
+    Returns:
+        list -- field names
+    """
+
+    return [field for (name, field, kind) in columns if field is not None]
+
+
+def to_json_value(value):
+    """Convert NumPy scalars to JSON serializable values
+
+    Arguments:
+        value {object} -- value to convert
+
+    Returns:
+        object -- plain Python value
+    """
+
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+class Results_Store_Writer(object):
+    """Appends per-polygon results watershed by watershed, memory use is bounded by one watershed
+
+    Arguments:
+        object {object} -- Remenant of python 2.7, declares new-style class
+
+    Returns:
+        Results_Store_Writer -- Results_Store_Writer instance
+    """
+
+    def __init__(self, path, columns):
+        """Class initialization
+
+        Arguments:
+            path {string} -- directory for the store, created if missing
+            columns {list} -- columns from get_columns
+        """
+
+        self.path = path
+        self.columns = columns
+        self.n_rows = 0
+        self.categories = {}
+        self.category_codes = {}
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.files = {}
+        for (name, field, kind) in columns:
+            if kind == "category":
+                self.categories[name] = []
+                self.category_codes[name] = {}
+            self.files[name] = open(os.path.join(path, name + ".bin"), "wb")
+
+    def encode(self, name, values):
+        """Dictionary encode categorical values, extending the category list as needed
+
+        Arguments:
+            name {string} -- column name
+            values {array} -- values to encode
+
+        Returns:
+            array -- integer category codes
+        """
+
+        (unique, inverse) = numpy.unique(values, return_inverse=True)
+        codes = self.category_codes[name]
+        categories = self.categories[name]
+        unique_codes = numpy.empty(len(unique), dtype=CATEGORY_DTYPE)
+        for (i, value) in enumerate(unique.tolist()):
+            if value not in codes:
+                codes[value] = len(categories)
+                categories.append(value)
+            unique_codes[i] = codes[value]
+        return unique_codes[inverse]
+
+    def add_table(self, watershed_name, fc_table):
+        """Append a watershed's per-polygon values
+
+        Arguments:
+            watershed_name {string} -- watershed name
+            fc_table {array} -- NumPy structured array containing the fields from get_source_fields
+        """
+
+        n_rows = len(fc_table)
+        for (name, field, kind) in self.columns:
+            if field is None:
+                values = numpy.empty(n_rows, dtype=object)
+                values.fill(watershed_name)
+            else:
+                values = fc_table[field]
+            if kind == "category":
+                values = self.encode(name, values)
+            else:
+                values = numpy.asarray(values, dtype=kind)
+            values.tofile(self.files[name])
+        self.n_rows += n_rows
+
+    def add_store(self, store, watershed_name):
+        """Append a watershed's rows from another store with the same columns
+
+        Arguments:
+            store {Results_Store} -- store holding the watershed, e.g. one written by a worker process
+            watershed_name {string} -- watershed name
+        """
+
+        rows = store.rows({"watershed": watershed_name})
+        n_rows = len(rows)
+        for (name, field, kind) in self.columns:
+            if field is None:
+                values = numpy.empty(n_rows, dtype=object)
+                values.fill(watershed_name)
+            elif kind == "category":
+                # Only the watershed's codes are decoded, not the whole column
+                categories = numpy.array(store.categories[name], dtype=object)
+                values = categories[numpy.asarray(store.column(name)[rows])]
+            else:
+                values = store.column(name)[rows]
+            if kind == "category":
+                values = self.encode(name, values)
+            else:
+                values = numpy.asarray(values, dtype=kind)
+            values.tofile(self.files[name])
+        self.n_rows += n_rows
+
+    def close(self):
+        """Finish the store, writes the schema and builds the category indexes"""
+
+        for column_file in self.files.values():
+            column_file.close()
+
+        schema = {
+            "n_rows": self.n_rows,
+            "columns": [],
+            "categories": {}
+        }
+        for (name, field, kind) in self.columns:
+            dtype = CATEGORY_DTYPE if kind == "category" else kind
+            schema["columns"].append({"name": name, "kind": kind, "dtype": dtype})
+            if kind == "category":
+                schema["categories"][name] = [
+                    to_json_value(value) for value in self.categories[name]]
+
+        with open(os.path.join(self.path, SCHEMA_FILE_NAME), "w") as schema_file:
+            json.dump(schema, schema_file, indent=2)
+
+        # Index categorical columns, stable sort keeps rows in insertion order within a category
+        for (name, field, kind) in self.columns:
+            if kind != "category" or self.n_rows == 0:
+                continue
+            codes = numpy.fromfile(os.path.join(
+                self.path, name + ".bin"), dtype=CATEGORY_DTYPE)
+            order = numpy.argsort(codes, kind="mergesort").astype("<i8")
+            counts = numpy.bincount(codes, minlength=len(self.categories[name]))
+            offsets = numpy.concatenate(([0], numpy.cumsum(counts))).astype("<i8")
+            order.tofile(os.path.join(self.path, name + ".order.bin"))
+            offsets.tofile(os.path.join(self.path, name + ".offsets.bin"))
+
+
+class Results_Store(object):
+    """Read access and group-by aggregation over a results store
+
+    Arguments:
+        object {object} -- Remenant of python 2.7, declares new-style class
+
+    Returns:
+        Results_Store -- Results_Store instance
+    """
+
+    def __init__(self, path):
+        """Class initialization, column data is memory mapped when first used
+
+        Arguments:
+            path {string} -- store directory
+        """
+
+        self.path = path
+        with open(os.path.join(path, SCHEMA_FILE_NAME), "r") as schema_file:
+            schema = json.load(schema_file)
+        self.n_rows = schema["n_rows"]
+        self.dtypes = dict((column["name"], column["dtype"])
+                           for column in schema["columns"])
+        self.column_names = [column["name"] for column in schema["columns"]]
+        self.categories = schema["categories"]
+        self.cache = {}
+
+    def read(self, file_name, dtype):
+        """Memory map a binary file of the store
+
+        Arguments:
+            file_name {string} -- file name within the store
+            dtype {string} -- NumPy dtype of the file
+
+        Returns:
+            array -- read only memory mapped array
+        """
+
+        if file_name not in self.cache:
+            path = os.path.join(self.path, file_name)
+            if os.path.getsize(path) == 0:
+                self.cache[file_name] = numpy.zeros(0, dtype=dtype)
+            else:
+                self.cache[file_name] = numpy.memmap(path, dtype=dtype, mode="r")
+        return self.cache[file_name]
+
+    def column(self, name, decode=False):
+        """Values of a column
+
+        Arguments:
+            name {string} -- column name
+
+        Keyword Arguments:
+            decode {bool} -- return category values rather than codes for categorical columns (default: {False})
+
+        Returns:
+            array -- column values
+        """
+
+        values = self.read(name + ".bin", self.dtypes[name])
+        if decode and name in self.categories:
+            return numpy.array(self.categories[name], dtype=object)[values]
+        return values
+
+    def codes(self, name, values):
+        """Category codes of a list of category values, unknown values are ignored
+
+        Arguments:
+            name {string} -- categorical column name
+            values {list} -- category values
+
+        Returns:
+            list -- category codes
+        """
+
+        categories = self.categories[name]
+        return [categories.index(value) for value in values if value in categories]
+
+    def rows(self, where=None):
+        """Row indices matching category filters, resolved through the category indexes
+
+        Keyword Arguments:
+            where {dictionary} -- column name to value or list of values, e.g. {'watershed': ['A', 'B']} (default: {None})
+
+        Returns:
+            array -- sorted row indices, or None when no filter is given (all rows)
+        """
+
+        if not where:
+            return None
+
+        selected = None
+        for (name, values) in where.items():
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            if name in self.categories:
+                order = self.read(name + ".order.bin", "<i8")
+                offsets = self.read(name + ".offsets.bin", "<i8")
+                parts = [numpy.asarray(order[offsets[code]:offsets[code + 1]])
+                         for code in self.codes(name, values)]
+                rows = numpy.sort(numpy.concatenate(parts)) if len(
+                    parts) > 0 else numpy.zeros(0, dtype="<i8")
+            else:
+                column = self.column(name)
+                rows = numpy.nonzero(numpy.in1d(column, list(values)))[0]
+            selected = rows if selected is None else numpy.intersect1d(
+                selected, rows, assume_unique=True)
+        return selected
+
+    def group_keys(self, name, rows, groups=None):
+        """Integer group keys and their labels for a column
+
+        Arguments:
+            name {string} -- column name
+            rows {array} -- row indices, or None for all rows
+
+        Keyword Arguments:
+            groups {dictionary} -- optional mapping of column values to group labels, e.g. watershed to county (default: {None})
+
+        Returns:
+            tuple -- integer key per row and array of key labels
+        """
+
+        values = self.column(name)
+        if rows is not None:
+            values = values[rows]
+        if name in self.categories:
+            labels = numpy.array(self.categories[name], dtype=object)
+            keys = numpy.asarray(values)
+        else:
+            (labels, keys) = numpy.unique(values, return_inverse=True)
+            labels = labels.astype(object)
+
+        if groups is not None:
+            # Relabel values through the mapping, unmapped values keep their own label
+            mapped = [groups.get(label, label) for label in labels.tolist()]
+            (labels, relabel) = numpy.unique(
+                numpy.array(mapped, dtype=object), return_inverse=True)
+            keys = relabel[keys]
+        return (keys, labels)
+
+    def aggregate(self, by, sums=("area", "runoff_volume"), weighted_means=(("precipitation", "area"),),
+                  where=None, groups=None):
+        """Group-by aggregation over the whole store
+
+        Arguments:
+            by {list} -- columns to group by, e.g. ['soil', 'land_use_class']
+
+        Keyword Arguments:
+            sums {tuple} -- columns summed within each group (default: {("area", "runoff_volume")})
+            weighted_means {tuple} -- (value, weight) column pairs averaged within each group (default: {(("precipitation", "area"),)})
+            where {dictionary} -- category filters, see rows (default: {None})
+            groups {dictionary} -- column name to value mapping dictionaries, see group_keys (default: {None})
+
+        Returns:
+            array -- NumPy structured array with one row per non-empty group, group columns followed by
+                'count', the summed columns and '<value>_mean' weighted mean columns
+        """
+
+        if isinstance(by, basestring):
+            by = [by]
+        groups = groups or {}
+        rows = self.rows(where)
+
+        keys = []
+        labels = []
+        for name in by:
+            (column_keys, column_labels) = self.group_keys(
+                name, rows, groups.get(name))
+            keys.append(column_keys)
+            labels.append(column_labels)
+
+        shape = tuple(max(len(column_labels), 1) for column_labels in labels)
+        n_groups = int(numpy.prod(shape))
+        if len(by) > 0 and len(keys[0]) > 0:
+            flat = numpy.ravel_multi_index(tuple(keys), shape)
+        else:
+            n_rows = self.n_rows if rows is None else len(rows)
+            flat = numpy.zeros(n_rows, dtype=int)
+
+        def group_sum(values):
+            values = numpy.asarray(values, dtype=numpy.float64)
+            if rows is not None:
+                values = values[rows]
+            return numpy.bincount(flat, weights=values, minlength=n_groups)
+
+        counts = numpy.bincount(flat, minlength=n_groups)
+        totals = [group_sum(self.column(name)) for name in sums]
+        means = []
+        for (value_name, weight_name) in weighted_means:
+            weights = numpy.asarray(self.column(weight_name), dtype=numpy.float64)
+            values = numpy.asarray(self.column(value_name), dtype=numpy.float64)
+            weight_sums = group_sum(weights)
+            with numpy.errstate(invalid="ignore", divide="ignore"):
+                means.append(group_sum(values * weights) / weight_sums)
+
+        present = numpy.nonzero(counts > 0)[0]
+        fields = [(name, object) for name in by] + [("count", "<i8")] + \
+            [(name, "<f8") for name in sums] + \
+            [(value_name + "_mean", "<f8") for (value_name, weight_name) in weighted_means]
+        result = numpy.zeros(len(present), dtype=fields)
+        if len(by) > 0:
+            unravelled = numpy.unravel_index(present, shape)
+            for (i, name) in enumerate(by):
+                result[name] = labels[i][unravelled[i]]
+        result["count"] = counts[present]
+        for (name, total) in zip(sums, totals):
+            result[name] = total[present]
+        for ((value_name, weight_name), mean) in zip(weighted_means, means):
+            result[value_name + "_mean"] = mean[present]
+        return result
+
+
+def write_csv(result, output_file_name):
+    """Write an aggregation result to CSV
+
+    Arguments:
+        result {array} -- NumPy structured array returned by Results_Store.aggregate
+        output_file_name {string} -- path of the CSV file
+    """
+
+    with open(output_file_name, "wb") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(result.dtype.names)
+        for row in result.tolist():
+            writer.writerow(row)
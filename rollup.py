@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+"""rollup.py: Aggregates watershed statistics through a hierarchy of groupings without geoprocessing."""
+
+__copyright__ = """
+    Copyright (C) 2018 San Francisco Estuary Institute (SFEI)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import argparse
+import helpers
+import rwsm
+
+
+def load_hierarchy(file_name):
+    """Read a hierarchy table, watershed names in the first column and one column per level
+
+    e.g. watershed,subregion,county,region. Blank cells leave a watershed out of a level.
+
+    Arguments:
+        file_name {string} -- path to hierarchy CSV file
+
+    Returns:
+        tuple -- level names and list of group names per level keyed by watershed name
+    """
+
+    rows = helpers.load_csv(file_name)
+    levels = [level.strip() for level in rows[0][1:]]
+    hierarchy = {}
+    for row in rows[1:]:
+        if not row or not row[0].strip():
+            continue
+        watershed_name = helpers.strip_chars(
+            row[0], '!@#$%^&*()-+=,<>?/\~`[]{}.')
+        groups = [group.strip() for group in row[1:]]
+        hierarchy[watershed_name] = groups + [""] * (len(levels) - len(groups))
+    return (levels, hierarchy)
+
+
+def rollup_level(accumulators, hierarchy, level_index):
+    """Merge watershed accumulators into the groups of one level
+
+    Arguments:
+        accumulators {dictionary} -- Watershed_Accumulator keyed by watershed name
+        hierarchy {dictionary} -- group names per level keyed by watershed name
+        level_index {int} -- position of the level within the hierarchy
+
+    Returns:
+        dictionary -- merged Watershed_Accumulator keyed by group name
+    """
+
+    groups = {}
+    for (watershed_name, accumulator) in sorted(accumulators.items()):
+        group = hierarchy.get(watershed_name, [""] * (level_index + 1))[level_index]
+        if not group:
+            continue
+        if group in groups:
+            groups[group].merge(accumulator)
+        else:
+            groups[group] = accumulator.copy()
+    return groups
+
+
+def rollup(config, accumulators, slope_bins, hierarchy_file_name, workspace, messages=None):
+    """Write watershed and land use statistics tables for every level of a hierarchy
+
+    Sums are merged and then divided by the group totals, so precipitation, slope and
+    percentages are area weighted over the whole group.
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+        accumulators {dictionary} -- Watershed_Accumulator keyed by watershed name
+        slope_bins {list} -- slope bins the accumulators were computed with
+        hierarchy_file_name {string} -- path to hierarchy CSV file
+        workspace {string} -- folder receiving the tables
+
+    Keyword Arguments:
+        messages {Tool_Messages} -- receiver of messages (default: {None})
+
+    Returns:
+        list -- written file names
+    """
+
+    messages = messages or rwsm.Tool_Messages()
+    (levels, hierarchy) = load_hierarchy(hierarchy_file_name)
+
+    unmapped = sorted(set(accumulators).difference(hierarchy))
+    if unmapped:
+        messages.add_warning("Watersheds missing from hierarchy {}: {}".format(
+            hierarchy_file_name, ", ".join(unmapped)))
+
+    output_file_names = []
+    for (i, level) in enumerate(levels):
+        groups = rollup_level(accumulators, hierarchy, i)
+        group_names = sorted(groups)
+        writer = rwsm.Stats_Writer(config, group_names, slope_bins)
+        for group_name in group_names:
+            writer.add_accumulator(group_name, groups[group_name])
+
+        level_name = helpers.strip_chars(level, '!@#$%^&*()-+=,<>?/\~`[]{}.')
+        ws_file_name = os.path.join(
+            workspace, "results_wsStats_{}.csv".format(level_name))
+        lu_file_name = os.path.join(
+            workspace, "results_luStats_{}.csv".format(level_name))
+        writer.write_ws_stats_table(ws_file_name)
+        writer.write_lu_stats_table(lu_file_name)
+        output_file_names += [ws_file_name, lu_file_name]
+        messages.add_message("Roll-up {}: {} groups".format(level, len(group_names)))
+
+    return output_file_names
+
+
+def rollup_workspace(config, workspace, hierarchy_file_name):
+    """Roll up the accumulators saved in a finished run's workspace
+
+    Arguments:
+        config {instance} -- ConfigParser instance the run used
+        workspace {string} -- run workspace holding accumulators.json
+        hierarchy_file_name {string} -- path to hierarchy CSV file
+
+    Returns:
+        list -- written file names
+    """
+
+    file_name = os.path.join(workspace, "accumulators.json")
+    with open(file_name) as accumulators_file:
+        slope_bins = json.load(accumulators_file)["slope_bins"]
+    writer = rwsm.Stats_Writer(config, [], slope_bins)
+    accumulators = writer.load_accumulators(file_name)
+    return rollup(config, accumulators, slope_bins, hierarchy_file_name, workspace)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Roll up a finished run's watershed statistics through a hierarchy table.")
+    parser.add_argument("config", help="configuration file the run used")
+    parser.add_argument("workspace", help="run workspace holding accumulators.json")
+    parser.add_argument("hierarchy", help="hierarchy CSV file")
+    args = parser.parse_args()
+
+    for file_name in rollup_workspace(helpers.load_config(args.config), args.workspace, args.hierarchy):
+        print(file_name)
@@ -22,13 +22,27 @@ __copyright__ = """
 import os
 import sys
 import csv
+import json
+import collections
 import helpers
+import zonal
+import aggregation
+import results_store
+import planner
+import telemetry
+import incremental
+import loads
+import uncertainty
+import profiling
+import raster_stack
+import data_plane
 import arcpy
 import datetime
 import time
 import logging
 import numpy
 import gc
+import argparse
 
 # Log levels are for debugging the application via Python command line,
 # which is outside the scope of this initial beta release.
@@ -36,6 +50,13 @@ import gc
 # LOG_LEVEL = logging.NOTSET # Show all messages
 # LOG_LEVEL = logging.CRITICAL # Only show critical messages
 
+# Regional output feature class of merged_output runs
+MERGED_OUTPUT_NAME = "watershed_results"
+
+# Field object types and the AddField types creating them
+ADD_FIELD_TYPES = {"String": "TEXT", "Integer": "LONG", "SmallInteger": "SHORT", "Single": "FLOAT",
+                   "Double": "DOUBLE", "Date": "DATE"}
+
 
 class Watersheds(object):
     """Used to manage set of initial watersheds
@@ -62,9 +83,12 @@ class Watersheds(object):
         self.field = config.get("RWSM", "watersheds_field")
         self.watershed_names = []
 
-    def dissolve(self):
+    def dissolve(self, out_feature_class="disWS"):
         """Dissolve if necessary, otherwise return pre-dissolved watersheds
         
+        Keyword Arguments:
+            out_feature_class {string} -- dissolved feature class, relative to the current workspace (default: {"disWS"})
+
         Returns:
             Feature Layer -- Dissolved feature layer
         """
@@ -72,7 +96,7 @@ class Watersheds(object):
         if not self.is_dissolved:
             self.dissolved = arcpy.Dissolve_management(
                 in_features=self.file_name,
-                out_feature_class="disWS",
+                out_feature_class=out_feature_class,
                 dissolve_field=self.field,
                 multi_part="SINGLE_PART"
             )
@@ -89,12 +113,13 @@ class Watersheds(object):
 
         if len(self.watershed_names) == 0:
             watersheds_field = self.config.get("RWSM", "watersheds_field")
-            fc_table = arcpy.da.FeatureClassToNumPyArray(
-                in_table=self.file_name,
-                field_names=[watersheds_field]
-            )
-            watershed_names = sorted(numpy.unique(
-                fc_table[:][watersheds_field]).tolist())
+            chunk_size = int(helpers.get_config_option(
+                self.config, "chunk_size", 100000))
+            watershed_names = set()
+            for fc_table in helpers.iter_table_chunks(self.file_name, [watersheds_field], chunk_size):
+                watershed_names.update(
+                    numpy.unique(fc_table[watersheds_field]).tolist())
+            watershed_names = sorted(watershed_names)
             self.watershed_names = map(lambda x: helpers.strip_chars(
                 x, '!@#$%^&*()-+=,<>?/\~`[]{}.'), watershed_names)
 
@@ -122,7 +147,17 @@ class Stats_Writer(object):
         """
 
         self.config = config
+        self.slope_bin_ranges = [list(slope_bin) for slope_bin in slope_bins]
         self.slope_bins = self.slope_bins_to_strs(sorted(slope_bins))
+        self.slope_bin_codes = dict(zip(self.slope_bins_to_strs(slope_bins), [
+                                    (i + 1) * 100 for i in range(len(slope_bins))]))
+        self.slope_histogram = helpers.get_config_boolean(
+            config, "slope_histogram")
+        self.chunk_size = int(helpers.get_config_option(
+            config, "chunk_size", 100000))
+        self.concentrations = loads.get_concentration_table(config)
+        self.pollutants = self.concentrations.pollutants if self.concentrations is not None else []
+        self.accumulators = {}
         self.ws_stats = []
         self.lu_stats = []
         self.watershed_names = watershed_names
@@ -240,6 +275,9 @@ class Stats_Writer(object):
         for land_use in self.land_use_classes:
             ws_headers.append("LU " + land_use + " % WS Runoff Vol. (m3)")
 
+        for pollutant in self.pollutants:
+            ws_headers.append(pollutant + " Load (kg)")
+
         return ws_headers
 
     def get_lu_stats_headers(self):
@@ -257,6 +295,65 @@ class Stats_Writer(object):
             lu_headers.append(watershed_name)
         return lu_headers
 
+    def get_accumulator_fields(self):
+        """Table fields read by the statistics accumulators
+
+        Returns:
+            dictionary -- field names keyed by accumulator input
+        """
+
+        fields = {
+            "area": "SHAPE@AREA",
+            "runoff_volume": 'runoff_vol_' + self.config.get("RWSM", "runoff_coeff_field"),
+            "precipitation": "precipitation_mean",
+            "slope": "slope_mean",
+            "soil": self.config.get("RWSM", "soils_bin_field"),
+            "land_use_class": self.config.get("RWSM", "land_use_LU_class_field"),
+            "land_use_code": self.config.get("RWSM", "land_use_LU_code_field")
+        }
+        if self.slope_histogram:
+            # Polygons carry their area fraction within each slope bin
+            fields["slope_fractions"] = [helpers.slope_fraction_field(
+                self.slope_bin_codes[slope_bin]) for slope_bin in self.slope_bins]
+        else:
+            fields["slope_bin"] = self.config.get("RWSM", "slope_bin_field")
+        if self.pollutants:
+            fields["loads"] = [loads.load_field(pollutant) for pollutant in self.pollutants]
+        return fields
+
+    def get_fc_table_fields(self):
+        """Fields read from each watershed feature class to compute statistics
+
+        Returns:
+            list -- field names
+        """
+
+        fields = self.get_accumulator_fields()
+        table_fields = [fields["area"], fields["runoff_volume"], fields["precipitation"],
+                        fields["slope"], fields["soil"], fields["land_use_class"], fields["land_use_code"]]
+        if self.slope_histogram:
+            table_fields += fields["slope_fractions"]
+        else:
+            table_fields.append(fields["slope_bin"])
+        table_fields += fields.get("loads", [])
+        return table_fields
+
+    def new_accumulator(self):
+        """Empty accumulator for one watershed
+
+        Returns:
+            Watershed_Accumulator -- accumulator over this writer's categories
+        """
+
+        categories = {
+            "slope_bins": self.slope_bins,
+            "soil_types": self.soil_types,
+            "land_use_classes": self.land_use_classes,
+            "land_use_codes": [row[0] for row in self.lu_stats[1:]],
+            "pollutants": self.pollutants
+        }
+        return aggregation.Watershed_Accumulator(categories, self.get_accumulator_fields())
+
     def add_fc_table(self, watershed):
         """Add feature class data to values data structure
         
@@ -264,10 +361,59 @@ class Stats_Writer(object):
             watershed {String} -- feature class for watershed
         """
 
+        watershed_name = os.path.split(str(watershed))[1]
+        accumulator = self.new_accumulator()
+        for fc_table in helpers.iter_table_chunks(watershed, self.get_fc_table_fields(), self.chunk_size):
+            accumulator.add(fc_table)
+        self.add_accumulator(watershed_name, accumulator)
+
+    def add_table(self, watershed_name, fc_table):
+        """Add a watershed's per-polygon values to the statistics data structures
+
+        Arguments:
+            watershed_name {String} -- watershed name
+            fc_table {array} -- NumPy structured array containing the fields from get_fc_table_fields
+        """
+
+        accumulator = self.new_accumulator()
+        accumulator.add(fc_table)
+        self.add_accumulator(watershed_name, accumulator)
+
+    def add_region_table(self, fc, watershed_field="watershed"):
+        """Add statistics for every watershed of a region-wide feature class, read in bounded chunks
+
+        Arguments:
+            fc {feature class} -- feature class holding the polygons of many watersheds
+
+        Keyword Arguments:
+            watershed_field {String} -- field holding the watershed name (default: {"watershed"})
+        """
+
+        accumulators = {}
+        fields = self.get_fc_table_fields() + [watershed_field]
+        for fc_table in helpers.iter_table_chunks(fc, fields, self.chunk_size):
+            (names, index) = numpy.unique(
+                fc_table[watershed_field], return_inverse=True)
+            for (i, watershed_name) in enumerate(names.tolist()):
+                if watershed_name not in accumulators:
+                    accumulators[watershed_name] = self.new_accumulator()
+                accumulators[watershed_name].add(fc_table[index == i])
+        for watershed_name in self.watershed_names:
+            if watershed_name in accumulators:
+                self.add_accumulator(
+                    watershed_name, accumulators[watershed_name])
+
+    def add_accumulator(self, watershed_name, accumulator):
+        """Add a watershed's statistics rows from its accumulated sums
+
+        Arguments:
+            watershed_name {String} -- watershed name
+            accumulator {Watershed_Accumulator} -- sums over the watershed's polygons
+        """
+
+        self.accumulators[watershed_name] = accumulator
 
         # Watershed Stats Table ---------------------------------------------------
-        intersect = watershed
-        watershed_name = os.path.split(str(watershed))[1]
 
         # List to be written as a rows in watershed statistics table output
         ws_row = []
@@ -275,119 +421,96 @@ class Stats_Writer(object):
         # Watershed Name
         ws_row.append(watershed_name)
 
-        # Tot. Area (km2)
-        fc_table = arcpy.da.FeatureClassToNumPyArray(
-            in_table=intersect,
-            field_names='SHAPE@AREA'
-        )
-        total_area = numpy.sum(fc_table["SHAPE@AREA"])
+        # Tot. Area (km2), NumPy scalars so a watershed without polygons gets NaN ratios
+        total_area = numpy.float64(accumulator.area)
         ws_row.append(total_area / 10**6)
 
         # Tot. Runoff Vol. (m3)
-        runoff_vol_field = 'runoff_vol_' + \
-            self.config.get("RWSM", "runoff_coeff_field")
-        fc_table = arcpy.da.FeatureClassToNumPyArray(
-            in_table=intersect,
-            field_names=runoff_vol_field
-        )
-        tot_runoff_vol = numpy.sum(fc_table[runoff_vol_field])
+        tot_runoff_vol = numpy.float64(accumulator.runoff_volume)
         ws_row.append(tot_runoff_vol)
 
         # Tot. Runoff Vol. (10^6 m3)
         ws_row.append(tot_runoff_vol / 10**6)
 
         # Average Weighted Precipitation (mm)
-        fc_table = arcpy.da.FeatureClassToNumPyArray(
-            in_table=intersect,
-            field_names=["precipitation_mean", "SHAPE@AREA"]
-        )
-        ws_row.append(numpy.sum(
-            fc_table["precipitation_mean"] * fc_table["SHAPE@AREA"]) / total_area)
+        ws_row.append(accumulator.precipitation_area / total_area)
 
         # Average Weighted Slope (%)
-        fc_table = arcpy.da.FeatureClassToNumPyArray(
-            in_table=intersect,
-            field_names=["slope_mean", "SHAPE@AREA"]
-        )
-        ws_row.append(
-            numpy.sum(fc_table["slope_mean"] * fc_table["SHAPE@AREA"]) / total_area)
+        ws_row.append(accumulator.slope_area / total_area)
 
         # Slope Bin Percent (%) Totals
-        slope_bin_field = self.config.get("RWSM", "slope_bin_field")
-        fc_table = arcpy.da.FeatureClassToNumPyArray(
-            in_table=intersect,
-            field_names=[slope_bin_field, "SHAPE@AREA"]
-        )
-        for slope_bin in self.slope_bins:
-            ws_row.append(numpy.sum(
-                fc_table[fc_table[slope_bin_field] == slope_bin]["SHAPE@AREA"]) / total_area)
+        ws_row += (accumulator.slope_bin_area / total_area).tolist()
 
         # Soil Type Percent (%) Totals
-        soils_type_field = self.config.get("RWSM", "soils_bin_field")
-        fc_table = arcpy.da.FeatureClassToNumPyArray(
-            in_table=intersect,
-            field_names=[soils_type_field, "SHAPE@AREA"]
-        )
-        for soil_type in self.soil_types:
-            ws_row.append(numpy.sum(
-                fc_table[fc_table[soils_type_field] == soil_type]["SHAPE@AREA"]) / total_area)
+        ws_row += (accumulator.soil_area / total_area).tolist()
 
         # Land Use - Total areas (km2)
-        land_use_LU_class_field = self.config.get(
-            "RWSM", "land_use_LU_class_field")
-        fc_table = arcpy.da.FeatureClassToNumPyArray(
-            in_table=intersect,
-            field_names=[land_use_LU_class_field, "SHAPE@AREA"]
-        )
-        for land_use_class in self.land_use_classes:
-            ws_row.append(numpy.sum(
-                fc_table[fc_table[land_use_LU_class_field] == land_use_class]["SHAPE@AREA"]) / 10**6)
+        ws_row += (accumulator.land_use_class_area / 10**6).tolist()
 
         # Land Use - Runoff Vol. (m3)
-        fc_table = arcpy.da.FeatureClassToNumPyArray(
-            in_table=intersect,
-            field_names=[land_use_LU_class_field, runoff_vol_field]
-        )
-        for land_use_class in self.land_use_classes:
-            ws_row.append(numpy.sum(
-                fc_table[fc_table[land_use_LU_class_field] == land_use_class][runoff_vol_field]))
+        ws_row += accumulator.land_use_class_runoff.tolist()
 
         # Land Use - Percent (%) WS Area
-        fc_table = arcpy.da.FeatureClassToNumPyArray(
-            in_table=intersect,
-            field_names=[land_use_LU_class_field, "SHAPE@AREA"]
-        )
-        for land_use_class in self.land_use_classes:
-            ws_row.append(numpy.sum(
-                fc_table[fc_table[land_use_LU_class_field] == land_use_class]["SHAPE@AREA"]) / total_area)
+        ws_row += (accumulator.land_use_class_area / total_area).tolist()
 
         # Land Use - Percent (%) WS Runoff Vol. (m3)
-        fc_table = arcpy.da.FeatureClassToNumPyArray(
-            in_table=intersect,
-            field_names=[land_use_LU_class_field, runoff_vol_field]
-        )
-        for land_use_class in self.land_use_classes:
-            ws_row.append(numpy.sum(
-                fc_table[fc_table[land_use_LU_class_field] == land_use_class][runoff_vol_field]) / tot_runoff_vol)
+        ws_row += (accumulator.land_use_class_runoff / tot_runoff_vol).tolist()
+
+        # Pollutant Loads (kg)
+        ws_row += accumulator.load.tolist()
 
         self.ws_stats.append(ws_row)
 
         # Land Use Stats Table ----------------------------------------------------
-        land_use_LU_code_field = self.config.get(
-            "RWSM", "land_use_LU_code_field")
-        fc_table = arcpy.da.FeatureClassToNumPyArray(
-            in_table=intersect,
-            field_names=[land_use_LU_code_field, "SHAPE@AREA"]
-        )
         watershed_idx = self.lu_stats[0].index(watershed_name)
-        for row in self.lu_stats[1:]:
-            code = row[0]
-            percent_area = numpy.sum(
-                fc_table[fc_table[land_use_LU_code_field] == code]["SHAPE@AREA"]) / total_area
+        for (row, code_area) in zip(self.lu_stats[1:], accumulator.land_use_code_area):
+            percent_area = code_area / total_area
             if percent_area > 0:
                 row[watershed_idx] = percent_area
 
-        del fc_table
+    def write_accumulators(self, output_file_name):
+        """Persist watershed accumulators, statistics can then be rolled up without geoprocessing
+
+        Arguments:
+            output_file_name {String} -- JSON file name
+        """
+
+        accumulators = {
+            "slope_bins": self.slope_bin_ranges,
+            "categories": self.new_accumulator().categories,
+            "watersheds": dict((watershed_name, accumulator.to_dict())
+                               for (watershed_name, accumulator) in self.accumulators.items())
+        }
+        with open(output_file_name, "w") as accumulators_file:
+            json.dump(accumulators, accumulators_file)
+
+    def load_accumulators(self, file_name):
+        """Read accumulators written by write_accumulators
+
+        Arguments:
+            file_name {String} -- JSON file name
+
+        Raises:
+            ValueError -- accumulators were computed over different categories
+
+        Returns:
+            dictionary -- Watershed_Accumulator keyed by watershed name
+        """
+
+        with open(file_name) as accumulators_file:
+            saved = json.load(accumulators_file)
+        categories = self.new_accumulator().categories
+        for (name, values) in categories.items():
+            if list(values) != saved["categories"].get(name, []):
+                raise ValueError(
+                    "Accumulators in {} were computed with different {}".format(file_name, name))
+
+        accumulators = {}
+        for (watershed_name, sums) in saved["watersheds"].items():
+            accumulator = self.new_accumulator()
+            accumulator.load_dict(sums)
+            accumulators[str(watershed_name)] = accumulator
+        return accumulators
 
     def write_ws_stats_table(self, output_file_name):
         """Write area, runoff, soil, slope, and land use statistics for each watershed
@@ -426,51 +549,940 @@ class Stats_Writer(object):
             writer.add_fc_table(watershed_name, intersect)
 
 
-def run_analysis(config=None, is_gui=False):
-    """Primary RWSM analysis loop
-    
-    Keyword Arguments:
-        config {instance} -- ConfigParser instance holding parameter values (default: {None})
-        is_gui {bool} -- indicates if running from ArcMap toolbox GUI (default: {False})
+def add_raster_means(run, zonal_engine, intersect, raster, rname, watershed_name):
+    """Add the <rname>_mean field with a zonal engine
+
+    Arguments:
+        run {Analysis_Run} -- run holding tiling options and collecting tile timings
+        zonal_engine {string} -- zonal engine, see zonal.ZONAL_ENGINES
+        intersect {feature class} -- intersected feature class with uID field
+        raster {raster layer} -- slope or precipitation raster layer
+        rname {string} -- 'slope' or 'precipitation'
+        watershed_name {string} -- watershed name
+
+    Raises:
+        ValueError -- unknown zonal engine
     """
 
+    if zonal_engine == "exact":
+        timings = []
+        helpers.exactRasterAvgs(intersect, raster, rname, tile_size=run.zonal_tile_size,
+                                workers=run.zonal_workers, timings=timings)
+        run.add_tile_timings(watershed_name, rname, timings)
+    elif zonal_engine == "arcpy":
+        helpers.rasterAvgs(intersect, raster, rname, watershed_name)
+    else:
+        raise ValueError("Unknown zonal_engine '{}', expected one of {}".format(
+            zonal_engine, ", ".join(zonal.ZONAL_ENGINES)))
 
-    # Logger used for command line debugging, not supported in beta.
-    # logger = helpers.get_logger(LOG_LEVEL)
-    # logger.info('Starting analysis...')
 
-    # Initialize structures for user output.
-    start_time = time.clock()
-    if is_gui:
-        arcpy.SetProgressor("default", "Initiating workspace...")
+def add_stack_means(run, intersect, stack, bands, watershed_name):
+    """Add one <band>_mean field per band of a raster stack
 
-    # Load values from config file
-    if not config:
-        CONFIG_FILE_NAME = "rwsm.ini"
-        if os.path.isfile(CONFIG_FILE_NAME):
-            config = helpers.load_config(CONFIG_FILE_NAME)
-    workspace = config.get("RWSM", "workspace")
-    workspace = os.path.join(workspace, "rwsm")
-    watersheds_file_name = config.get("RWSM", "watersheds")
-    watersheds_field = config.get("RWSM", "watersheds_field")
+    Arguments:
+        run {Analysis_Run} -- run holding tiling options and collecting tile timings
+        intersect {feature class} -- intersected feature class with uID field
+        stack {Raster_Stack} -- raster stack
+        bands {list} -- band names
+        watershed_name {string} -- watershed name
+    """
+
+    timings = []
+    helpers.stackRasterAvgs(intersect, stack, bands, tile_size=run.zonal_tile_size,
+                            workers=run.zonal_workers, timings=timings)
+    run.add_tile_timings(watershed_name, "+".join(bands), timings)
+
+
+def add_zonal_means(inputs, run, zonal_engine, intersect, watershed_name):
+    """Add slope_mean, precipitation_mean and one <name>_mean field per covariate
+
+    With a raster stack the exact engine reads every band in one window and computes cell
+    coverage once; the arcpy engine samples slope and precipitation itself and reads only the
+    covariates from the stack.
+
+    Arguments:
+        inputs {Analysis_Inputs} -- loaded inputs
+        run {Analysis_Run} -- run tagging stages and collecting tile timings
+        zonal_engine {string} -- zonal engine, see zonal.ZONAL_ENGINES
+        intersect {feature class} -- intersected feature class with uID field
+        watershed_name {string} -- watershed name
+    """
+
+    stack = inputs.raster_stack
+    if stack is not None and zonal_engine == "exact":
+        run.sampler.set_stage(watershed_name, "stack zonal statistics")
+        add_stack_means(run, intersect, stack, stack.bands, watershed_name)
+        return
+
+    run.sampler.set_stage(watershed_name, "slope zonal statistics")
+    add_raster_means(run, zonal_engine, intersect, inputs.slope_raster, 'slope', watershed_name)
+    run.sampler.set_stage(watershed_name, "precipitation zonal statistics")
+    add_raster_means(run, zonal_engine, intersect, inputs.precipitation_raster,
+                     'precipitation', watershed_name)
+    if stack is not None:
+        covariates = [band for band in stack.bands if band not in raster_stack.MODEL_BANDS]
+        if covariates:
+            run.sampler.set_stage(watershed_name, "covariate zonal statistics")
+            add_stack_means(run, intersect, stack, covariates, watershed_name)
+
+
+def add_histogram_attributes(config, intersect, watershed_name, slope_classes, slope_bins_w_codes, codes_to_coeff_lookup):
+    """Derive slope bin, code, coefficient, and runoff volume fields from zonal slope histograms
+
+    Each polygon receives its area fraction within every slope bin. The runoff coefficient is the
+    fraction weighted coefficient over all bins, slope bin and code fields hold the dominant bin.
+    Values are computed as array operations and written with a single ExtendTable call.
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+        intersect {feature class} -- intersected land use and soils feature class, must contain uID,
+            slope_mean, and precipitation_mean fields
+        watershed_name {string} -- watershed name
+        slope_classes {raster layer} -- slope raster reclassified to slope bin codes
+        slope_bins_w_codes {list} -- list of [lower, upper, code] slope bins
+        codes_to_coeff_lookup {dictionary} -- dictionary for converting codes to coefficients
+    """
+
+    soils_field = config.get("RWSM", "soils_field")
+    soils_bin_field = config.get("RWSM", "soils_bin_field")
+    land_use_field = config.get("RWSM", "land_use_field")
+    land_use_LU_bin_field = config.get("RWSM", "land_use_LU_bin_field")
+    slope_bin_field = config.get("RWSM", "slope_bin_field")
+    runoff_coeff_field = config.get("RWSM", "runoff_coeff_field")
+    code_field = 'code_' + land_use_LU_bin_field
+    base_field = 'runoff_vol_' + runoff_coeff_field
+
+    fc_table = helpers.table_to_array(intersect, [
+        'uID', soils_field, land_use_field, land_use_LU_bin_field,
+        'slope_mean', 'precipitation_mean', 'SHAPE@AREA'])
+    n_polygons = len(fc_table)
+
+    slope_bins = sorted(slope_bins_w_codes)
+    bin_codes = numpy.array([slope_bin[2] for slope_bin in slope_bins])
+    bin_labels = numpy.array(
+        ["{}-{}".format(slope_bin[0], slope_bin[1]) for slope_bin in slope_bins] + ["NaN"])
+
+    # Area fraction of each polygon within each slope bin
+    (zone_ids, class_areas) = helpers.slopeHistogram(
+        intersect, slope_classes, bin_codes.tolist(), watershed_name)
+    (fractions, has_cells) = zonal.class_fractions(
+        fc_table['uID'], zone_ids, class_areas)
+
+    # Polygons too small to contain a cell center fall back to the bin of their mean slope,
+    # polygons without a mean slope fall back to the bin starting at zero (as in run_analysis).
+    fallback = zonal.bin_index(
+        fc_table['slope_mean'], [slope_bin[:2] for slope_bin in slope_bins])
+    zero_bins = [i for (i, slope_bin) in enumerate(slope_bins) if slope_bin[0] == 0]
+    no_slope = fallback < 0
+    if len(zero_bins) > 0:
+        fallback[no_slope] = zero_bins[0]
+    rows = numpy.nonzero(~has_cells & (fallback >= 0))[0]
+    fractions[rows, fallback[rows]] = 1.0
+
+    # Coefficient lookup for every polygon / slope bin combination
+    codes = helpers.calculateCodes(
+        bin_codes[numpy.newaxis, :],
+        fc_table[soils_field][:, numpy.newaxis],
+        fc_table[land_use_LU_bin_field][:, numpy.newaxis])
+    coeffs = helpers.lookupCoefficients(codes, codes_to_coeff_lookup)
+    unmatched = (fractions > 0) & numpy.isnan(coeffs)
+    if numpy.any(unmatched):
+        raise KeyError(sorted(set(codes[unmatched].tolist())))
+    runoff_coeff = numpy.sum(numpy.where(
+        fractions > 0, fractions * numpy.nan_to_num(coeffs), 0.0), axis=1)
+
+    dominant = numpy.argmax(fractions, axis=1)
+    dominant_label = dominant.copy()
+    dominant_label[~has_cells & no_slope] = len(slope_bins)
+
+    fields = [
+        ('uID', numpy.int32),
+        ('watershed', '<U255'),
+        (soils_bin_field, '<U255'),
+        ('land_use', numpy.int32),
+        (slope_bin_field, '<U255'),
+        (code_field, numpy.float64),
+        (runoff_coeff_field, numpy.float64),
+        (base_field, numpy.float64)
+    ] + [(helpers.slope_fraction_field(code), numpy.float64) for code in bin_codes]
+
+    out_table = numpy.zeros(n_polygons, dtype=fields)
+    out_table['uID'] = fc_table['uID']
+    out_table['watershed'] = watershed_name
+    out_table[soils_bin_field] = fc_table[soils_field]
+    out_table['land_use'] = fc_table[land_use_field]
+    out_table[slope_bin_field] = bin_labels[dominant_label]
+    out_table[code_field] = codes[numpy.arange(n_polygons), dominant]
+    out_table[runoff_coeff_field] = runoff_coeff
+    # convert ppt from mm to m and multiply by area and runoff coeff
+    out_table[base_field] = (
+        fc_table['precipitation_mean'] / 1000.0) * fc_table['SHAPE@AREA'] * runoff_coeff
+    for (i, code) in enumerate(bin_codes):
+        out_table[helpers.slope_fraction_field(code)] = fractions[:, i]
+
+    arcpy.da.ExtendTable(intersect, 'uID', out_table, 'uID')
+
+
+def add_load_attributes(config, intersect, concentrations):
+    """Add one load field per pollutant from runoff volumes and the concentration table
+
+    Loads of every pollutant are computed together as array operations and written with a
+    single ExtendTable call.
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+        intersect {feature class} -- attributed watershed feature class, must contain uID,
+            runoff volume, land use class, soils bin and slope bin fields
+        concentrations {Concentration_Table} -- pollutant concentrations
+
+    Returns:
+        list -- (land use class, soil, slope bin) combinations without a concentration, loaded as zero
+    """
+
+    land_use_LU_class_field = config.get("RWSM", "land_use_LU_class_field")
+    soils_bin_field = config.get("RWSM", "soils_bin_field")
+    slope_bin_field = config.get("RWSM", "slope_bin_field")
+    base_field = 'runoff_vol_' + config.get("RWSM", "runoff_coeff_field")
+
+    fc_table = helpers.table_to_array(intersect, [
+        'uID', base_field, land_use_LU_class_field, soils_bin_field, slope_bin_field])
+    (polygon_loads, unmatched) = concentrations.compute_loads(
+        numpy.nan_to_num(fc_table[base_field]), fc_table[land_use_LU_class_field],
+        fc_table[soils_bin_field], fc_table[slope_bin_field])
+
+    load_fields = [loads.load_field(pollutant) for pollutant in concentrations.pollutants]
+    out_table = numpy.zeros(len(fc_table), dtype=[('uID', numpy.int32)] + [
+        (field, numpy.float64) for field in load_fields])
+    out_table['uID'] = fc_table['uID']
+    for (i, field) in enumerate(load_fields):
+        out_table[field] = polygon_loads[:, i]
 
-    # Create workspace
-    (temp_file_name, out_file_name, workspace) = helpers.init_workspace(workspace)
+    arcpy.da.ExtendTable(intersect, 'uID', out_table, 'uID')
+    return unmatched
 
-    # Instantiate watershed, run dissolve
-    if is_gui:
-        arcpy.SetProgressor("default", "Dissolving watersheds...")
 
-    watersheds = Watersheds(config)
-    dissolved_watersheds = watersheds.dissolve()
+class Tool_Messages(object):
+    """Reports messages, progress and stages to the ArcMap toolbox, silent outside of it
 
-    # Change to temporary workspace
-    arcpy.env.workspace = temp_file_name
+    worker.py provides the same methods for analyses run in a worker process.
 
-    # Set aside tracking data structures
-    land_use_descriptions = []
+    Arguments:
+        object {object} -- Remenant of python 2.7, declares new-style class
+
+    Returns:
+        Tool_Messages -- Tool_Messages instance
+    """
+
+    def __init__(self, is_gui=False):
+        """Class initialization
+
+        Keyword Arguments:
+            is_gui {bool} -- indicates if running from ArcMap toolbox GUI (default: {False})
+        """
+
+        self.is_gui = is_gui
+
+    def add_message(self, msg):
+        """Report a message
+
+        Arguments:
+            msg {string} -- message
+        """
+
+        if self.is_gui:
+            arcpy.AddMessage(msg)
+
+    def add_warning(self, msg):
+        """Report a warning
+
+        Arguments:
+            msg {string} -- warning
+        """
+
+        if self.is_gui:
+            arcpy.AddWarning(msg)
+
+    def add_error(self, msg):
+        """Report an error
+
+        Arguments:
+            msg {string} -- error
+        """
+
+        if self.is_gui:
+            arcpy.AddError(msg)
+
+    def set_progressor(self, msg):
+        """Show a message on the default progressor
+
+        Arguments:
+            msg {string} -- message
+        """
+
+        if self.is_gui:
+            arcpy.SetProgressor("default", msg)
+
+    def set_step(self, msg, position, n_steps):
+        """Show a message on the step progressor
+
+        Arguments:
+            msg {string} -- message
+            position {int} -- current step, starting at 1
+            n_steps {int} -- number of steps
+        """
+
+        if self.is_gui:
+            arcpy.SetProgressor("step", msg, 0, n_steps, position)
+
+    def set_stage(self, watershed_name, stage):
+        """Note the analysis stage, the toolbox shows stages through messages only
+
+        Arguments:
+            watershed_name {string} -- watershed name, None outside the watershed loop
+            stage {string} -- name of the analysis stage
+        """
+
+        pass
+
+    def is_cancelled(self):
+        """Whether the user asked to cancel, where the toolbox exposes it
+
+        Returns:
+            bool -- True if cancelled
+        """
+
+        return self.is_gui and bool(getattr(arcpy.env, "isCancelled", False))
+
+
+class Analysis_Inputs(object):
+    """Inputs and lookup tables shared by every watershed of an analysis
+
+    Loaded once per run, or once per service process by daemon.py, in which case
+    they stay resident between requests and are reloaded only where the configuration
+    or the underlying files change.
+
+    Arguments:
+        object {object} -- Remenant of python 2.7, declares new-style class
+
+    Returns:
+        Analysis_Inputs -- Analysis_Inputs instance
+    """
+
+    # Resident resources and the configuration options each is loaded from
+    RESOURCES = [
+        ("watersheds", ("watersheds", "watersheds_field")),
+        ("slope", ("slope_file_name", "runoff_coeff_file_name", "runoff_coeff_slope_bin_field",
+                   "runoff_coeff_field", "runoff_coeff_soil_type_field",
+                   "runoff_coeff_land_use_class_code_field", "slope_histogram")),
+        ("precipitation", ("precipitation_file_name",)),
+        ("stack", ("raster_stack", "covariates", "raster_cache", "slope_file_name",
+                   "precipitation_file_name", "watersheds"))
+    ]
+
+    def __init__(self, config):
+        """Class initialization
+
+        Arguments:
+            config {instance} -- ConfigParser instance holding parameter values
+        """
+
+        self.config = config
+        self.fingerprints = {}
+        self.workspace = None
+        self.temp_workspace = None
+
+    def get_fingerprint(self, config, options):
+        """Option values and file modification times a resource is loaded from
+
+        Arguments:
+            config {instance} -- ConfigParser instance
+            options {tuple} -- option names
+
+        Returns:
+            tuple -- (option, value, modification time) per option
+        """
+
+        fingerprint = []
+        for option in options:
+            value = helpers.get_config_option(config, option)
+            fingerprint.append((option, value, helpers.get_modified_time(value)))
+        return tuple(fingerprint)
+
+    def load(self, workspace, temp_workspace, run=None):
+        """Load every resource
+
+        Arguments:
+            workspace {string} -- folder receiving the dissolved watersheds
+            temp_workspace {string} -- geodatabase receiving the reclassified slope raster
+
+        Keyword Arguments:
+            run {Analysis_Run} -- run reporting progress, if any (default: {None})
+        """
+
+        self.workspace = workspace
+        self.temp_workspace = temp_workspace
+        for (name, options) in self.RESOURCES:
+            getattr(self, "load_" + name)(run)
+            self.fingerprints[name] = self.get_fingerprint(self.config, options)
+
+    def reload(self, config, run=None):
+        """Reload only the resources whose options or files changed
+
+        Arguments:
+            config {instance} -- ConfigParser instance holding the new parameter values
+
+        Keyword Arguments:
+            run {Analysis_Run} -- run reporting progress, if any (default: {None})
+
+        Returns:
+            list -- names of the reloaded resources
+        """
+
+        self.config = config
+        reloaded = []
+        for (name, options) in self.RESOURCES:
+            fingerprint = self.get_fingerprint(config, options)
+            if fingerprint != self.fingerprints.get(name):
+                getattr(self, "load_" + name)(run)
+                self.fingerprints[name] = fingerprint
+                reloaded.append(name)
+        return reloaded
+
+    def load_watersheds(self, run=None):
+        """Dissolve watersheds and gather their names
+
+        Keyword Arguments:
+            run {Analysis_Run} -- run reporting progress, if any (default: {None})
+        """
+
+        if run:
+            run.set_stage(None, "dissolve watersheds", "Dissolving watersheds...")
+        out_feature_class = os.path.join(self.workspace, "disWS")
+        if arcpy.Exists(out_feature_class):
+            arcpy.Delete_management(out_feature_class)
+        self.watersheds = Watersheds(self.config)
+        self.dissolved_watersheds = self.watersheds.dissolve(out_feature_class)
+        self.watershed_names = self.watersheds.get_names()
+
+    def load_slope(self, run=None):
+        """Open slope raster, populate slope bins and the code to coefficient lookup
+
+        Keyword Arguments:
+            run {Analysis_Run} -- run reporting progress, if any (default: {None})
+        """
+
+        if run:
+            run.set_stage(None, "setup", "Computing slope bins...")
+        self.slope_raster = arcpy.sa.Raster(
+            self.config.get("RWSM", "slope_file_name"))
+        slope_raster_max = int(self.slope_raster.maximum)
+        self.slope_bins = helpers.load_slope_bins(
+            self.config, slope_raster_max=slope_raster_max)
+        self.slope_bins_w_codes = [list(slope_bin) for slope_bin in self.slope_bins]
+        map(lambda x: x.append((self.slope_bins_w_codes.index(x) + 1) * 100), self.slope_bins_w_codes)
+
+        # Reclassify slope raster into slope bins once, polygons are then histogrammed
+        # against the classes rather than binned by their mean slope.
+        self.slope_histogram = helpers.get_config_boolean(
+            self.config, "slope_histogram")
+        self.slope_classes = None
+        if self.slope_histogram:
+            self.slope_classes = helpers.reclassifySlope(
+                self.slope_raster, self.slope_bins_w_codes,
+                os.path.join(self.temp_workspace, "slope_classes"))
+
+        # Load code to coefficient lookup table
+        self.codes_to_coeff_lookup = helpers.get_code_to_coeff_lookup(
+            self.config, slope_raster_max)
+
+    def load_precipitation(self, run=None):
+        """Open precipitation raster
+
+        Keyword Arguments:
+            run {Analysis_Run} -- run reporting progress, if any (default: {None})
+        """
+
+        if run:
+            run.set_stage(None, "setup", "Importing precipitation raster...")
+        self.precipitation_raster = arcpy.sa.Raster(
+            self.config.get("RWSM", "precipitation_file_name"))
+
+    def load_stack(self, run=None):
+        """Open the raster stack when raster_stack is set or covariates are configured
+
+        Keyword Arguments:
+            run {Analysis_Run} -- run reporting progress, if any (default: {None})
+        """
+
+        self.raster_stack = None
+        if not (helpers.get_config_boolean(self.config, "raster_stack") or
+                helpers.get_covariates(self.config)):
+            return
+        if run:
+            run.set_stage(None, "setup", "Building raster stack...")
+        cache_directory = helpers.get_config_option(
+            self.config, "raster_cache", os.path.join(self.config.get("RWSM", "workspace"), "raster_cache"))
+        self.raster_stack = raster_stack.build_raster_stack(
+            self.config, cache_directory, self.temp_workspace, run.messages if run else None)
+
+    def attach(self, header_file_name, workspace, temp_workspace, run=None):
+        """Attach to a data plane published by a parent process instead of loading every resource
+
+        Lookup tables and the raster stack are read-only views of the parent's memory mapped
+        files; watersheds are not dissolved again and tables are not parsed again.
+
+        Arguments:
+            header_file_name {string} -- header written by data_plane.publish_data_plane
+            workspace {string} -- run workspace
+            temp_workspace {string} -- run temporary geodatabase
+
+        Keyword Arguments:
+            run {Analysis_Run} -- run reporting progress, if any (default: {None})
+        """
+
+        if run:
+            run.set_stage(None, "setup", "Attaching to data plane...")
+        self.workspace = workspace
+        self.temp_workspace = temp_workspace
+        self.data_plane = data_plane.Data_Plane(header_file_name)
+        header = self.data_plane.header
+        self.dissolved_watersheds = header["dissolved_watersheds"]
+        self.watershed_names = [str(name) for name in header["watershed_names"]]
+        self.slope_raster = arcpy.sa.Raster(header["slope_file_name"])
+        self.precipitation_raster = arcpy.sa.Raster(header["precipitation_file_name"])
+        self.slope_bins = self.data_plane.get_slope_bins()
+        self.slope_bins_w_codes = self.data_plane.get_slope_bins_w_codes()
+        self.slope_histogram = header["slope_histogram"]
+        self.slope_classes = None
+        if header["slope_classes"]:
+            self.slope_classes = arcpy.sa.Raster(header["slope_classes"])
+        self.codes_to_coeff_lookup = self.data_plane.codes_to_coeff_lookup
+        self.raster_stack = self.data_plane.raster_stack
+
+    def select_watersheds(self, watershed_names=None):
+        """Watershed names to analyse
+
+        Keyword Arguments:
+            watershed_names {list} -- subset of watershed names, with or without illegal characters (default: {None})
+
+        Returns:
+            list -- sorted watershed names, all watersheds if no subset is given
+        """
+
+        if watershed_names is None:
+            return self.watershed_names
+        requested = set(helpers.strip_chars(
+            name, '!@#$%^&*()-+=,<>?/\~`[]{}.') for name in watershed_names)
+        unknown = requested.difference(self.watershed_names)
+        if unknown:
+            raise ValueError("Unknown watersheds: " +
+                             ", ".join(sorted(unknown)))
+        return [name for name in self.watershed_names if name in requested]
+
+
+class Analysis_Run(object):
+    """Workspace, statistics writer, results store and messages of one analysis run
+
+    Arguments:
+        object {object} -- Remenant of python 2.7, declares new-style class
+
+    Returns:
+        Analysis_Run -- Analysis_Run instance
+    """
+
+    def __init__(self, config, is_gui=False, workspace=None, messages=None):
+        """Class initialization, creates the workspace and starts resource sampling
+
+        Arguments:
+            config {instance} -- ConfigParser instance holding parameter values
+
+        Keyword Arguments:
+            is_gui {bool} -- indicates if running from ArcMap toolbox GUI (default: {False})
+            workspace {string} -- workspace folder prefix, rwsm within the configured workspace if None (default: {None})
+            messages {Tool_Messages} -- receiver of messages and progress, toolbox messages if None (default: {None})
+        """
+
+        self.config = config
+        self.is_gui = is_gui
+        self.messages = messages or Tool_Messages(is_gui)
+        self.cancelled = False
+        self.start_time = time.clock()
+        self.set_progressor("Initiating workspace...")
+
+        # Create workspace
+        if workspace is None:
+            workspace = os.path.join(config.get("RWSM", "workspace"), "rwsm")
+        (self.temp_file_name, self.out_file_name,
+         self.workspace) = helpers.init_workspace(workspace)
+
+        # Sample memory, CPU, scratch disk and handles in the background for the whole run
+        self.sampler = telemetry.Resource_Sampler(
+            output_file_name=os.path.join(self.workspace, "metrics.jsonl"),
+            interval=float(helpers.get_config_option(
+                config, "telemetry_interval", 5.0)),
+            scratch_path=os.path.join(self.workspace, self.temp_file_name))
+        self.sampler.start()
+        self.sampler.set_stage(None, "setup")
+
+        # Set aside structure for holding intersected watershed references
+        self.intersected_watersheds = []
+
+        # List of tuples for holding error information
+        self.watershed_errors = []
+
+        # Watershed results appended to one regional feature class rather than one class each
+        self.merged_output = helpers.get_config_boolean(config, "merged_output")
+        self.merged_fc = None
+        self.merged_fields = None
+
+        # Function-level profiling of selected watersheds, off unless the profile option is set
+        self.profiler = profiling.get_run_profiler(config, self.workspace)
+
+        # In-process zonal reductions split into raster tiles reduced on a pool of threads
+        self.zonal_tile_size = int(helpers.get_config_option(config, "zonal_tile_size", 0))
+        self.zonal_workers = int(helpers.get_config_option(config, "zonal_workers", 1))
+        self.tile_timings = []
+
+        # Oversized watersheds split into tiles by area or by land use and soils features
+        self.tile_max_area = float(helpers.get_config_option(config, "tile_max_area", 0))
+        self.tile_max_features = int(helpers.get_config_option(config, "tile_max_features", 0))
+        self.watershed_probes = {}
+
+        # Zonal engine per watershed, chosen from complexity probes when zonal_engine is auto
+        self.zonal_engine = helpers.get_config_option(config, "zonal_engine", "arcpy")
+        self.engine_choices = {}
+        self.engine_log = []
+
+    def set_progressor(self, msg):
+        """Show a message on the toolbox progressor
+
+        Arguments:
+            msg {string} -- message
+        """
 
-    # Gather configuration file values --------------------------------------------
+        self.messages.set_progressor(msg)
+
+    def set_stage(self, watershed_name, stage, msg=None):
+        """Tag resource samples with a stage, optionally showing a progressor message
+
+        Arguments:
+            watershed_name {string} -- watershed name, None outside the watershed loop
+            stage {string} -- name of the analysis stage
+
+        Keyword Arguments:
+            msg {string} -- progressor message (default: {None})
+        """
+
+        self.sampler.set_stage(watershed_name, stage)
+        self.messages.set_stage(watershed_name, stage)
+        if msg:
+            self.set_progressor(msg)
+
+    def add_message(self, msg):
+        """Report a message to the toolbox
+
+        Arguments:
+            msg {string} -- message
+        """
+
+        self.messages.add_message(msg)
+
+    def add_time(self, watershed_name, msg):
+        """Report a watershed's progress with the elapsed time
+
+        Arguments:
+            watershed_name {string} -- watershed name
+            msg {string} -- completed step
+        """
+
+        self.add_message("{}: {}: {}".format(
+            watershed_name, msg, helpers.format_time(self.start_time)))
+
+    def get_temp_workspace(self):
+        """Path of the temporary geodatabase
+
+        Returns:
+            string -- temporary geodatabase path
+        """
+
+        return os.path.join(self.workspace, self.temp_file_name)
+
+    def get_output_fc(self, watershed_name):
+        """Feature class receiving a watershed's per-polygon results
+
+        Returns:
+            string -- class in the output geodatabase, or in the temporary geodatabase when
+                results are merged into one regional class
+        """
+
+        if self.merged_output:
+            return os.path.join(self.get_temp_workspace(), watershed_name)
+        return os.path.join(self.workspace, self.out_file_name, watershed_name)
+
+    def append_merged(self, watershed_name, output_fc):
+        """Append a watershed's polygons to the regional output feature class
+
+        The regional class takes its schema from the first watershed, plus a watershed field;
+        fields a later watershed brings (covariates, tile fields) are added as they appear, rows
+        of earlier watersheds hold nulls in them. Rows are copied through one insert cursor per
+        watershed.
+
+        Arguments:
+            watershed_name {string} -- watershed name
+            output_fc {string} -- watershed feature class
+        """
+
+        if self.merged_fc is None:
+            self.merged_fc = os.path.join(self.workspace, self.out_file_name, MERGED_OUTPUT_NAME)
+            arcpy.CreateFeatureclass_management(
+                os.path.join(self.workspace, self.out_file_name), MERGED_OUTPUT_NAME, "POLYGON",
+                template=output_fc, spatial_reference=arcpy.Describe(output_fc).spatialReference)
+            if "watershed" not in [field.name for field in arcpy.ListFields(self.merged_fc)]:
+                arcpy.AddField_management(self.merged_fc, "watershed", "TEXT")
+            self.merged_fields = [
+                field.name for field in arcpy.ListFields(self.merged_fc)
+                if field.type not in ("OID", "Geometry") and field.editable and
+                field.name not in ("watershed", "Shape_Area", "Shape_Length")]
+
+        source_fields = arcpy.ListFields(output_fc)
+        for field in source_fields:
+            if field.name in self.merged_fields or field.name in ("watershed", "Shape_Area", "Shape_Length") or \
+                    not field.editable or field.type not in ADD_FIELD_TYPES:
+                continue
+            arcpy.AddField_management(self.merged_fc, field.name, ADD_FIELD_TYPES[field.type],
+                                      field_length=field.length if field.type == "String" else None)
+            self.merged_fields.append(field.name)
+            self.add_message("{}: field {} added to {}".format(watershed_name, field.name, MERGED_OUTPUT_NAME))
+
+        source_names = set(field.name for field in source_fields)
+        fields = [field for field in self.merged_fields if field in source_names]
+        with arcpy.da.InsertCursor(self.merged_fc, ["SHAPE@", "watershed"] + fields) as insert_cursor:
+            with arcpy.da.SearchCursor(output_fc, ["SHAPE@"] + fields) as cursor:
+                for row in cursor:
+                    insert_cursor.insertRow((row[0], watershed_name) + tuple(row[1:]))
+
+    def open(self, inputs, watershed_names):
+        """Prepare statistics writer and results store for the watersheds to analyse
+
+        Arguments:
+            inputs {Analysis_Inputs} -- loaded inputs
+            watershed_names {list} -- sorted names of the watersheds to analyse
+        """
+
+        config = self.config
+
+        # Change to temporary workspace
+        arcpy.env.workspace = self.get_temp_workspace()
+
+        # Setup statistics output object
+        self.set_progressor("Initiating statistics writer...")
+        self.watershed_names = watershed_names
+        self.writer = Stats_Writer(config, watershed_names, inputs.slope_bins)
+
+        # Columnar per-polygon results store, written alongside the output geodatabase
+        self.table_fields = self.writer.get_fc_table_fields()
+        self.store = None
+        if helpers.get_config_boolean(config, "results_store", True):
+            store_columns = results_store.get_columns(config)
+            self.store = results_store.Results_Store_Writer(
+                os.path.join(self.workspace, "results_store"), store_columns)
+            self.table_fields += [field for field in results_store.get_source_fields(
+                store_columns) if field not in self.table_fields]
+
+        if self.zonal_engine == "auto":
+            self.probe_engines(inputs)
+        elif self.tile_max_features > 0:
+            self.probe_watersheds()
+
+    def probe_watersheds(self):
+        """Complexity probes of every watershed, see planner.probe_watersheds
+
+        Returns:
+            dictionary -- probes keyed by watershed name
+        """
+
+        self.set_stage(None, "probe", "Probing watershed complexity...")
+        for probe in planner.probe_watersheds(self.config):
+            watershed_name = helpers.strip_chars(
+                probe["watershed"], '!@#$%^&*()-+=,<>?/\~`[]{}.')
+            self.watershed_probes[watershed_name] = probe
+        return self.watershed_probes
+
+    def probe_engines(self, inputs):
+        """Choose the cheapest zonal engine of every watershed from envelope probes
+
+        Arguments:
+            inputs {Analysis_Inputs} -- loaded inputs
+        """
+
+        cell_areas = [raster.meanCellWidth * raster.meanCellHeight
+                      for raster in (inputs.slope_raster, inputs.precipitation_raster)]
+        for (watershed_name, probe) in self.probe_watersheds().items():
+            (engine, predicted) = planner.select_zonal_engine(self.config, probe, cell_areas)
+            self.engine_choices[watershed_name] = (engine, probe, predicted)
+
+    def get_zonal_engine(self, watershed_name):
+        """Zonal engine of a watershed
+
+        Arguments:
+            watershed_name {string} -- watershed name
+
+        Returns:
+            string -- engine name
+        """
+
+        if self.zonal_engine != "auto":
+            return self.zonal_engine
+        return self.engine_choices.get(watershed_name, ("arcpy",))[0]
+
+    def add_tile_timings(self, watershed_name, reduction, timings):
+        """Record the per-tile timings of a tiled zonal reduction
+
+        Arguments:
+            watershed_name {string} -- watershed name
+            reduction {string} -- reduced raster or bands
+            timings {list} -- timing dictionaries from zonal.coverage_means
+        """
+
+        if self.zonal_tile_size <= 0:
+            return
+        for timing in timings:
+            timing.update(watershed=watershed_name, reduction=reduction)
+        self.tile_timings += timings
+
+    def log_engine(self, watershed_name, zonal_engine, zonal_seconds, total_seconds):
+        """Record a watershed's zonal engine with its probes, predicted and measured seconds
+
+        Arguments:
+            watershed_name {string} -- watershed name
+            zonal_engine {string} -- engine used
+            zonal_seconds {float} -- measured seconds of the slope and precipitation means
+            total_seconds {float} -- measured seconds of the whole watershed
+        """
+
+        if self.zonal_engine != "auto":
+            return
+        (engine, probe, predicted) = self.engine_choices.get(
+            watershed_name, (zonal_engine, {}, {}))
+        self.engine_log.append(
+            [watershed_name, zonal_engine] +
+            [probe.get(name, "") for name in ("land_use_features", "land_use_vertices",
+                                              "soils_features", "soils_vertices", "vertices", "area")] +
+            [predicted.get(name, "") for name in zonal.ZONAL_ENGINES] +
+            [zonal_seconds, total_seconds])
+        self.add_message("{}: {} zonal engine, {:.1f} s".format(
+            watershed_name, zonal_engine, zonal_seconds))
+
+    def write_engine_log(self, output_file_name):
+        """Write the zonal engine log as CSV
+
+        Arguments:
+            output_file_name {string} -- CSV file name
+        """
+
+        with open(output_file_name, "wb") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(["Watershed", "Engine", "Land Use Features", "Land Use Vertices",
+                             "Soils Features", "Soils Vertices", "Watershed Vertices", "Area (m2)"] +
+                            ["Predicted {} (s)".format(name) for name in zonal.ZONAL_ENGINES] +
+                            ["Measured Zonal (s)", "Measured Watershed (s)"])
+            for row in self.engine_log:
+                writer.writerow(row)
+
+    def add_statistics(self, watershed_name, output_fc):
+        """Fold a watershed's output feature class into the statistics and results store
+
+        Arguments:
+            watershed_name {string} -- watershed name
+            output_fc {string} -- output feature class
+        """
+
+        self.sampler.set_stage(watershed_name, "statistics")
+        accumulator = self.writer.new_accumulator()
+        chunks = helpers.iter_table_chunks(output_fc, self.table_fields, self.writer.chunk_size)
+        while True:
+            # Chunks are read under the geoprocessing lock and accumulated outside it
+            with helpers.GEOPROCESSING_LOCK:
+                fc_table = next(chunks, None)
+            if fc_table is None:
+                break
+            accumulator.add(fc_table)
+            if self.store:
+                self.store.add_table(watershed_name, fc_table)
+        self.writer.add_accumulator(watershed_name, accumulator)
+        if self.merged_output:
+            with helpers.GEOPROCESSING_LOCK:
+                self.append_merged(watershed_name, output_fc)
+        self.intersected_watersheds.append((watershed_name, output_fc))
+        self.add_message("{}: statistics computed: {}\n".format(
+            watershed_name, helpers.format_time(self.start_time)))
+
+    def close(self):
+        """Write statistics tables, close the results store and stop sampling"""
+
+        # Write stats to csv files and watersheds with errors
+        self.sampler.set_stage(None, "write statistics")
+        self.writer.write_ws_stats_table(
+            os.path.join(self.workspace, "results_wsStats.csv"))
+        self.writer.write_lu_stats_table(
+            os.path.join(self.workspace, "results_luStats.csv"))
+        self.writer.write_accumulators(
+            os.path.join(self.workspace, "accumulators.json"))
+        if self.watershed_errors:
+            with open(os.path.join(self.workspace, "results_errors.csv"), "wb") as csvfile:
+                writer = csv.writer(csvfile)
+                writer.writerow(["Watershed", "Error"])
+                for (watershed_name, error) in self.watershed_errors:
+                    writer.writerow([watershed_name, error])
+        if self.zonal_engine == "auto":
+            self.write_engine_log(os.path.join(self.workspace, "engine_log.csv"))
+        if self.tile_timings:
+            zonal.write_tile_timings(os.path.join(self.workspace, "tile_timings.csv"), self.tile_timings)
+        if self.profiler is not None:
+            report_file_name = self.profiler.close()
+            if report_file_name:
+                self.add_message("Profile report written to {}".format(report_file_name))
+        if self.store:
+            self.store.close()
+        if self.merged_fc is not None:
+            # Indexed once all rows are in, readers select watersheds by attribute
+            arcpy.AddIndex_management(self.merged_fc, "watershed", "watershed_idx")
+        self.sampler.stop()
+        if self.cancelled:
+            msg = "Analysis cancelled, statistics written for {} of {} watersheds: {}".format(
+                len(self.writer.ws_stats), len(self.watershed_names),
+                helpers.format_time(self.start_time))
+            self.messages.add_warning(msg)
+        else:
+            msg = "Analysis complete: {}".format(
+                helpers.format_time(self.start_time))
+            self.add_message(msg)
+        if len(self.watershed_errors) > 0:
+            msg = "Errors encountered while computing analysis for the following watersheds:"
+            self.add_message(msg)
+            for (watershed_name, error) in self.watershed_errors:
+                self.add_message(watershed_name)
+        else:
+            msg = "There were no errors during the analysis"
+            self.add_message(msg)
+
+
+def overlay_watershed(inputs, run, watershed_name, watershed_val):
+    """Clip land use and soils to a watershed, intersect them and number the polygons
+
+    Arguments:
+        inputs {Analysis_Inputs} -- loaded inputs
+        run {Analysis_Run} -- run receiving the output feature class
+        watershed_name {string} -- watershed name, illegal characters removed
+        watershed_val {geometry} -- dissolved watershed geometry
+
+    Returns:
+        feature class -- intersected feature class with uID field, None if the watershed has no
+            land use or soils data
+    """
+
+    config = inputs.config
+    sampler = run.sampler
 
     # Land Use (Shapefile)
     land_use_file_name = config.get("RWSM", "land_use")
@@ -484,334 +1496,1132 @@ def run_analysis(config=None, is_gui=False):
     # Soils (Shapefile)
     soils_file_name = config.get("RWSM", "soils_file_name")
     soils_field = config.get("RWSM", "soils_field")
-    soils_bin_field = config.get("RWSM", "soils_bin_field")
 
-    # Slope (Raster)
-    slope_file_name = config.get("RWSM", "slope_file_name")
+    statistics_only = helpers.get_config_boolean(config, "statistics_only")
+
+    # Land Use Operations -------------------------------------------------
+    sampler.set_stage(watershed_name, "land use clip")
+    arcpy.Clip_analysis(
+        in_features=land_use_file_name,
+        clip_features=watershed_val,
+        out_feature_class="lu_" + watershed_name
+    )
+    run.add_time(watershed_name, "land use clip analysis complete")
+
+    # Adds land use lookup bin and description
+    sampler.set_stage(watershed_name, "land use join")
+    helpers.fasterJoin(
+        fc="lu_" + watershed_name,
+        fcField=land_use_field,
+        joinFC=land_use_LU_file_name,
+        joinFCField=land_use_LU_code_field,
+        fields=(
+            land_use_LU_bin_field,
+            land_use_LU_desc_field,
+            land_use_LU_class_field
+        )
+    )
+
+    # Dissolve land use, statistics only runs intersect the clipped pieces directly
+    if statistics_only:
+        land_use_clip = "lu_" + watershed_name
+    else:
+        sampler.set_stage(watershed_name, "land use dissolve")
+        land_use_clip = arcpy.Dissolve_management(
+            in_features="lu_" + watershed_name,
+            out_feature_class="luD_" + watershed_name,
+            dissolve_field=[
+                land_use_field,
+                land_use_LU_desc_field,
+                land_use_LU_bin_field,
+                land_use_LU_class_field
+            ],
+            statistics_fields="",
+            multi_part="SINGLE_PART"
+        )
+        run.add_time(watershed_name, "land use dissolve complete")
+
+    # Check size of land use area, stop analysis if no data found.
+    if int(arcpy.GetCount_management(land_use_clip).getOutput(0)) > 0:
+        run.add_message("{}: Land use clip and dissolve has data, continuing analysis...".format(
+            watershed_name))
+    else:
+        run.add_message("{}: Land use clip and dissolve yielded no data, skipping watershed...".format(
+            watershed_name))
+        return None
+
+    # Clip soils
+    sampler.set_stage(watershed_name, "soils clip")
+    arcpy.Clip_analysis(
+        in_features=soils_file_name,
+        clip_features=watershed_val,
+        out_feature_class="soils_" + watershed_name
+    )
+    run.add_time(watershed_name, "soil clip analysis complete")
+
+    if statistics_only:
+        soils_clip = "soils_" + watershed_name
+    else:
+        sampler.set_stage(watershed_name, "soils dissolve")
+        soils_clip = arcpy.Dissolve_management(
+            in_features="soils_" + watershed_name,
+            out_feature_class="soilsD_" + watershed_name,
+            dissolve_field=soils_field,
+            statistics_fields="",
+            multi_part="SINGLE_PART"
+        )
+        run.add_time(watershed_name, "soils dissolve analysis complete")
+
+    if int(arcpy.GetCount_management(soils_clip).getOutput(0)) > 0:
+        run.add_message("{}: Soils clip and dissolve contains data, continuing analysis...".format(
+            watershed_name))
+    else:
+        run.add_message("{}: Soils clip and dissolve yielded no rows, skipping watershed...".format(
+            watershed_name))
+        return None
+
+    # Intersect Land Use and Soils ----------------------------------------
+    sampler.set_stage(watershed_name, "intersect")
+    if statistics_only:
+        # Pieces carry their land use and soils keys, statistics sum them by key
+        intersect = arcpy.Intersect_analysis(
+            in_features=[land_use_clip, soils_clip],
+            out_feature_class=run.get_output_fc(watershed_name),
+            join_attributes="NO_FID"
+        )
+        run.add_time(watershed_name, "land use and soils intersect complete")
+    else:
+        intersect_land_use_and_soils = arcpy.Intersect_analysis(
+            in_features=[land_use_clip, soils_clip],
+            out_feature_class="int_" + watershed_name,
+            join_attributes="NO_FID"
+        )
+        run.add_time(watershed_name, "land use and soils intersect complete")
+
+        sampler.set_stage(watershed_name, "multipart to singlepart")
+        intersect_land_use_and_soils_singles = arcpy.MultipartToSinglepart_management(
+            in_features=intersect_land_use_and_soils,
+            out_feature_class="intX_" + watershed_name
+        )
+        run.add_time(watershed_name, "Multipart to single part complete")
+
+        sampler.set_stage(watershed_name, "eliminate")
+        intersect = helpers.elimSmallPolys(
+            fc=intersect_land_use_and_soils_singles,
+            outName=run.get_output_fc(watershed_name),
+            clusTol=0.005
+        )
+        run.add_time(watershed_name, "elimSmallPolys")
+
+    # Add unique ID field -------------------------------------------------
+    sampler.set_stage(watershed_name, "unique id")
+    arcpy.AddField_management(
+        in_table=intersect,
+        field_name='uID',
+        field_type='LONG'
+    )
+    with arcpy.da.UpdateCursor(intersect, ('OID@', 'uID')) as cursor:
+        for row in cursor:
+            row[1] = row[0]
+            cursor.updateRow(row)
+    run.add_time(watershed_name, "uID field added")
+
+    return intersect
+
+
+def zonal_watershed(inputs, run, watershed_name, intersect):
+    """Add slope, precipitation and covariate means to an intersected watershed
+
+    The exact engine holds helpers.GEOPROCESSING_LOCK only while reading polygons and cells and
+    writing means, other engines hold it throughout.
+
+    Arguments:
+        inputs {Analysis_Inputs} -- loaded inputs
+        run {Analysis_Run} -- run choosing the zonal engine and collecting tile timings
+        watershed_name {string} -- watershed name
+        intersect {feature class} -- intersected feature class with uID field
+
+    Returns:
+        tuple -- zonal engine and seconds spent on the means
+    """
+
+    zonal_engine = run.get_zonal_engine(watershed_name)
+    zonal_start_time = time.time()
+    if zonal_engine == "exact":
+        add_zonal_means(inputs, run, zonal_engine, intersect, watershed_name)
+    else:
+        with helpers.GEOPROCESSING_LOCK:
+            add_zonal_means(inputs, run, zonal_engine, intersect, watershed_name)
+    zonal_seconds = time.time() - zonal_start_time
+    run.add_time(watershed_name, "slope, precipitation and covariate means added")
+    return (zonal_engine, zonal_seconds)
+
+
+def attribute_watershed(inputs, run, watershed_name, intersect):
+    """Derive slope bins, codes, runoff coefficients, runoff volumes and loads of a watershed
+
+    Arguments:
+        inputs {Analysis_Inputs} -- loaded inputs
+        run {Analysis_Run} -- run receiving messages
+        watershed_name {string} -- watershed name
+        intersect {feature class} -- intersected feature class with zonal means
+    """
+
+    config = inputs.config
+    sampler = run.sampler
+    land_use_field = config.get("RWSM", "land_use_field")
+    land_use_LU_bin_field = config.get("RWSM", "land_use_LU_bin_field")
+    soils_field = config.get("RWSM", "soils_field")
+    soils_bin_field = config.get("RWSM", "soils_bin_field")
     slope_bin_field = config.get("RWSM", "slope_bin_field")
+    runoff_coeff_field = config.get("RWSM", "runoff_coeff_field")
 
-    # precipitation (Raster)
-    precipitation_file_name = config.get("RWSM", "precipitation_file_name")
+    # Resident lookup tables
+    slope_bins = inputs.slope_bins
+    slope_bins_w_codes = inputs.slope_bins_w_codes
+    codes_to_coeff_lookup = inputs.codes_to_coeff_lookup
+
+    # Add Slope bin field -------------------------------------------------
+    if not inputs.slope_histogram:
+        arcpy.AddField_management(intersect, slope_bin_field, "TEXT")
+        run.add_time(watershed_name, "slope bin field added")
+
+    # Slope histogram, codes, coefficients and runoff volume ------------
+    sampler.set_stage(watershed_name, "attributes")
+    if inputs.slope_histogram:
+        add_histogram_attributes(
+            config, intersect, watershed_name, inputs.slope_classes,
+            slope_bins_w_codes, codes_to_coeff_lookup)
+        run.add_time(watershed_name, "slope histogram, codes and runoff volume added")
+    else:
+        # Add soils, land use, and slope fields -------------------------------
+        arcpy.AddField_management(intersect, "watershed", "TEXT")
+        arcpy.AddField_management(intersect, soils_bin_field, "TEXT")
+        arcpy.AddField_management(intersect, "land_use", "LONG")
+        with arcpy.da.UpdateCursor(intersect, ("watershed", soils_bin_field, soils_field, "land_use", land_use_field, slope_bin_field, 'slope_mean')) as cursor:
+            for row in cursor:
+                # Shift columns
+                row[0] = watershed_name
+                row[1] = row[2]
+                row[3] = row[4]
+
+                # Add slope bin to feature data
+                slope_bin = filter(
+                    lambda x: x[0] <= row[6] < x[1], slope_bins)
+                if len(slope_bin) > 0:
+                    slope_bin = str(slope_bin[0]).strip(
+                        '[').strip(']').replace(', ', '-')
+                else:
+                    slope_bin = "NaN"
+                row[5] = slope_bin
+
+                cursor.updateRow(row)
+        run.add_time(watershed_name, "soils, land use, and slope fields added")
+
+        # Add land use code fields ---------------------------------------------
+        code_field = 'code_' + land_use_LU_bin_field
+        base_field = 'runoff_vol_' + runoff_coeff_field
+        arcpy.AddField_management(intersect, code_field, "DOUBLE")
+        arcpy.AddField_management(intersect, base_field, "DOUBLE")
+        run.add_time(watershed_name, "land use code and runoff volume fields added")
+
+        # Write in values for new fields --------------------------------------
+        with arcpy.da.UpdateCursor(intersect, (soils_bin_field, land_use_LU_bin_field, slope_bin_field, code_field)) as cursor:
+            for row in cursor:
+                # arcpy.AddMessage("{},{},{},{}".format(row[0],row[1],row[2],row[3]))
+                # TODO: Identify why NaNs exist
+                slpBin1 = int(row[2].split('-')[0]
+                              ) if row[2] != 'NaN' else 0
+                slpBinVal = [k[2]
+                             for k in slope_bins_w_codes if k[0] == slpBin1][0]
+                row[3] = helpers.calculateCode(
+                    slpBinVal, row[0], float(row[1]), soils_bin_field)
+                cursor.updateRow(row)
+        run.add_time(watershed_name, "land use codes added")
+
+        # Join runoff coeff lookup table and calculate runoff volume
+        arcpy.AddField_management(
+            intersect, runoff_coeff_field, "Double")
+        with arcpy.da.UpdateCursor(intersect, (runoff_coeff_field, code_field)) as cursor:
+            for row in cursor:
+                row[0] = codes_to_coeff_lookup[row[1]]
+                cursor.updateRow(row)
+        run.add_time(watershed_name, "output fields added")
+
+        # Convert precipitation from mm to m and multiple by runoff vol.
+        with arcpy.da.UpdateCursor(
+            in_table=intersect,
+            field_names=['SHAPE@AREA', runoff_coeff_field,
+                         base_field, 'precipitation_mean'],
+            where_clause='"{0}" is not null'.format(runoff_coeff_field)
+        ) as cursor:
+            for row in cursor:
+                # convert ppt from mm to m and multiply by area and runoff coeff
+                row[2] = (row[3] / 1000.0) * row[0] * row[1]
+                cursor.updateRow(row)
+        run.add_time(watershed_name, "precipitation converted")
+
+    # Pollutant loads -----------------------------------------------------
+    if run.writer.concentrations is not None:
+        sampler.set_stage(watershed_name, "loads")
+        unmatched = add_load_attributes(
+            config, intersect, run.writer.concentrations)
+        if unmatched:
+            run.messages.add_warning("{}: no concentrations for {}, loads set to zero".format(
+                watershed_name, ", ".join("/".join(combination) for combination in unmatched)))
+        run.add_time(watershed_name, "pollutant loads added")
+
+
+def get_watershed_tiles(run, watershed_name, watershed_val):
+    """Split an oversized watershed into tiles, see core.get_tile_count
+
+    Arguments:
+        run {Analysis_Run} -- run holding tiling thresholds and watershed probes
+        watershed_name {string} -- watershed name
+        watershed_val {geometry} -- dissolved watershed geometry
+
+    Returns:
+        tuple -- (tile name, tile geometry) per tile holding part of the watershed and a polyline
+            of the grid lines between tiles, None if the watershed is not split
+    """
+
+    if run.tile_max_area <= 0 and run.tile_max_features <= 0:
+        return None
+    probe = run.watershed_probes.get(watershed_name, {})
+    # Probes and geometries both cover every part of a watershed, see iter_watersheds
+    n_features = probe.get("land_use_features", 0) + probe.get("soils_features", 0)
+    n_tiles = helpers.get_tile_count(
+        watershed_val.area, n_features, run.tile_max_area, run.tile_max_features)
+    if n_tiles <= 1:
+        return None
+
+    extent = watershed_val.extent
+    spatial_reference = watershed_val.spatialReference
+    (tile_extents, xs, ys) = helpers.split_extent(
+        extent.XMin, extent.YMin, extent.XMax, extent.YMax, n_tiles)
+    tiles = []
+    for (xmin, ymin, xmax, ymax) in tile_extents:
+        square = arcpy.Polygon(arcpy.Array([
+            arcpy.Point(xmin, ymin), arcpy.Point(xmin, ymax), arcpy.Point(xmax, ymax),
+            arcpy.Point(xmax, ymin), arcpy.Point(xmin, ymin)]), spatial_reference)
+        tile = watershed_val.intersect(square, 4)
+        if tile.area > 0:
+            tiles.append(("{}_tile{}".format(watershed_name, len(tiles) + 1), tile))
+    edge_lines = arcpy.Polyline(arcpy.Array(
+        [arcpy.Array([arcpy.Point(x, extent.YMin), arcpy.Point(x, extent.YMax)]) for x in xs] +
+        [arcpy.Array([arcpy.Point(extent.XMin, y), arcpy.Point(extent.XMax, y)]) for y in ys]),
+        spatial_reference)
+    run.add_message("{}: split into {} tiles".format(watershed_name, len(tiles)))
+    return (tiles, edge_lines)
+
+
+def rejoin_tile_edges(inputs, run, watershed_name, output_fc, edge_lines):
+    """Dissolve polygons cut at tile edges back together and derive their attributes again
+
+    Pieces touching the grid lines between tiles are dissolved by their land use and soils
+    keys, single part, as the untiled dissolve would have kept them. The means of a rejoined
+    polygon are the area weighted means of its pieces; slope bins, codes, coefficients,
+    runoff volumes and loads are then derived from the rejoined polygon, not its pieces. Any
+    other field is carried over from the first of its pieces.
+
+    Arguments:
+        inputs {Analysis_Inputs} -- loaded inputs
+        run {Analysis_Run} -- run receiving messages
+        watershed_name {string} -- watershed name
+        output_fc {string} -- merged output feature class of the tiles
+        edge_lines {geometry} -- grid lines between tiles
+    """
+
+    config = inputs.config
+    key_fields = [config.get("RWSM", option) for option in (
+        "land_use_field", "land_use_LU_desc_field", "land_use_LU_bin_field",
+        "land_use_LU_class_field", "soils_field")]
+    edge_oids = []
+    with arcpy.da.SearchCursor(output_fc, ("OID@", "SHAPE@")) as cursor:
+        for (oid, shape) in cursor:
+            if not shape.disjoint(edge_lines):
+                edge_oids.append(oid)
+    if not edge_oids:
+        return
+    oid_name = arcpy.AddFieldDelimiters(output_fc, arcpy.Describe(output_fc).OIDFieldName)
+    where_clause = "{} IN ({})".format(oid_name, ",".join(str(oid) for oid in edge_oids))
+
+    # Mean times area and area with a mean, summed by the dissolve
+    edges = arcpy.Select_analysis(output_fc, "tileE_" + watershed_name, where_clause)
+    mean_fields = [field.name for field in arcpy.ListFields(edges) if field.name.endswith("_mean")]
+    sum_fields = []
+    for field in mean_fields:
+        sum_fields += [field[:-5] + "_wsum", field[:-5] + "_warea"]
+    for field in sum_fields:
+        arcpy.AddField_management(edges, field, "DOUBLE")
+    n_means = len(mean_fields)
+    with arcpy.da.UpdateCursor(edges, ["SHAPE@AREA"] + mean_fields + sum_fields) as cursor:
+        for row in cursor:
+            for i in range(n_means):
+                if row[1 + i] is not None:
+                    row[1 + n_means + 2 * i] = row[1 + i] * row[0]
+                    row[2 + n_means + 2 * i] = row[0]
+            cursor.updateRow(row)
+
+    # Fields neither keyed nor averaged ride through the dissolve as FIRST_<field>
+    carried_fields = [
+        field for field in arcpy.ListFields(edges)
+        if field.type in ADD_FIELD_TYPES and field.editable and field.name not in
+        key_fields + mean_fields + sum_fields + ["uID", "Shape_Area", "Shape_Length"]]
+    joined = arcpy.Dissolve_management(
+        in_features=edges,
+        out_feature_class="tileJ_" + watershed_name,
+        dissolve_field=key_fields,
+        statistics_fields=[[field, "SUM"] for field in sum_fields] +
+        [[field.name, "FIRST"] for field in carried_fields],
+        multi_part="SINGLE_PART"
+    )
+    arcpy.AddField_management(joined, "uID", "LONG")
+    for field in mean_fields:
+        arcpy.AddField_management(joined, field, "DOUBLE")
+    with arcpy.da.UpdateCursor(joined, ["OID@", "uID"] + mean_fields +
+                               ["SUM_" + field for field in sum_fields]) as cursor:
+        for row in cursor:
+            row[1] = row[0]
+            for i in range(n_means):
+                (weighted, area) = (row[2 + n_means + 2 * i], row[3 + n_means + 2 * i])
+                row[2 + i] = weighted / area if area else None
+            cursor.updateRow(row)
+    attribute_watershed(inputs, run, watershed_name, joined)
+
+    # Fields attribute_watershed did not derive again take the value of the first piece
+    joined_fields = set(field.name for field in arcpy.ListFields(joined))
+    carried_fields = [field for field in carried_fields if field.name not in joined_fields]
+    for field in carried_fields:
+        arcpy.AddField_management(joined, field.name, ADD_FIELD_TYPES[field.type],
+                                  field_length=field.length if field.type == "String" else None)
+    if carried_fields:
+        n_carried = len(carried_fields)
+        with arcpy.da.UpdateCursor(joined, [field.name for field in carried_fields] +
+                                   ["FIRST_" + field.name for field in carried_fields]) as cursor:
+            for row in cursor:
+                cursor.updateRow(list(row[n_carried:]) * 2)
+
+    # Replace the pieces with the rejoined polygons
+    with arcpy.da.UpdateCursor(output_fc, ["OID@"], where_clause) as cursor:
+        for row in cursor:
+            cursor.deleteRow()
+    arcpy.Append_management(joined, output_fc, "NO_TEST")
+    run.add_time(watershed_name, "{} pieces cut at tile edges rejoined into {} polygons".format(
+        len(edge_oids), helpers.getCountInt(joined)))
+
+
+def merge_watershed_tiles(inputs, run, watershed_name, tile_fcs, edge_lines):
+    """Merge the tile outputs of a watershed into its output feature class
+
+    Statistics only runs keep the pieces cut at tile edges, their statistics are summed by
+    key as for any other piece; otherwise the pieces are rejoined, see rejoin_tile_edges.
+
+    Arguments:
+        inputs {Analysis_Inputs} -- loaded inputs
+        run {Analysis_Run} -- run receiving the output feature class
+        watershed_name {string} -- watershed name
+        tile_fcs {list} -- attributed output feature classes of the tiles, deleted once merged
+        edge_lines {geometry} -- grid lines between tiles
+
+    Returns:
+        string -- output feature class
+    """
+
+    run.sampler.set_stage(watershed_name, "merge tiles")
+    output_fc = run.get_output_fc(watershed_name)
+    arcpy.Merge_management(tile_fcs, output_fc)
+    for tile_fc in tile_fcs:
+        arcpy.Delete_management(tile_fc)
+    run.add_time(watershed_name, "{} tiles merged".format(len(tile_fcs)))
+
+    if not helpers.get_config_boolean(inputs.config, "statistics_only"):
+        rejoin_tile_edges(inputs, run, watershed_name, output_fc, edge_lines)
+
+    # uIDs restart in every tile
+    with arcpy.da.UpdateCursor(output_fc, ('OID@', 'uID')) as cursor:
+        for row in cursor:
+            row[1] = row[0]
+            cursor.updateRow(row)
+    return output_fc
+
+
+def analyze_tiled_watershed(inputs, run, watershed_name, tiles, edge_lines):
+    """Clip, intersect and attribute a watershed tile by tile, then add it to the run's statistics
+
+    Arguments:
+        inputs {Analysis_Inputs} -- loaded inputs
+        run {Analysis_Run} -- run receiving output feature class and statistics
+        watershed_name {string} -- watershed name
+        tiles {list} -- (tile name, tile geometry) tuples, see get_watershed_tiles
+        edge_lines {geometry} -- grid lines between tiles
+
+    Returns:
+        string -- output feature class, None if no tile has land use or soils data
+    """
+
+    watershed_start_time = time.time()
+    zonal_engine = run.get_zonal_engine(watershed_name)
+    zonal_seconds = 0.0
+    tile_fcs = []
+    for (tile_name, tile_val) in tiles:
+        intersect = overlay_watershed(inputs, run, tile_name, tile_val)
+        if intersect is None:
+            continue
+        (zonal_engine, seconds) = zonal_watershed(inputs, run, watershed_name, intersect)
+        zonal_seconds += seconds
+        attribute_watershed(inputs, run, watershed_name, intersect)
+        tile_fcs.append(run.get_output_fc(tile_name))
+    if not tile_fcs:
+        return None
+
+    output_fc = merge_watershed_tiles(inputs, run, watershed_name, tile_fcs, edge_lines)
+    run.add_statistics(watershed_name, output_fc)
+    run.log_engine(watershed_name, zonal_engine, zonal_seconds,
+                   time.time() - watershed_start_time)
+    return output_fc
+
+
+def analyze_watershed(inputs, run, watershed_name, watershed_val):
+    """Clip, intersect and attribute one watershed, then add it to the run's statistics
+
+    Arguments:
+        inputs {Analysis_Inputs} -- loaded inputs
+        run {Analysis_Run} -- run receiving output feature class and statistics
+        watershed_name {string} -- watershed name, illegal characters removed
+        watershed_val {geometry} -- dissolved watershed geometry
+
+    Returns:
+        string -- output feature class, None if the watershed has no land use or soils data
+    """
+
+    # Oversized watersheds are analysed tile by tile
+    tiling = get_watershed_tiles(run, watershed_name, watershed_val)
+    if tiling is not None:
+        (tiles, edge_lines) = tiling
+        return analyze_tiled_watershed(inputs, run, watershed_name, tiles, edge_lines)
+
+    watershed_start_time = time.time()
+    intersect = overlay_watershed(inputs, run, watershed_name, watershed_val)
+    if intersect is None:
+        return None
+    (zonal_engine, zonal_seconds) = zonal_watershed(inputs, run, watershed_name, intersect)
+    attribute_watershed(inputs, run, watershed_name, intersect)
+
+    # Update statistics writer and results store --------------------------
+    output_fc = run.get_output_fc(watershed_name)
+    run.add_statistics(watershed_name, output_fc)
+    run.log_engine(watershed_name, zonal_engine, zonal_seconds,
+                   time.time() - watershed_start_time)
+
+    return output_fc
+
+
+def dissolve_output(config, output_fc):
+    """Cartographic output of a statistics only run: pieces dissolved by their attribute keys
+
+    Generated on demand and kept next to the output feature class, a second call reuses it.
+
+    Arguments:
+        config {instance} -- ConfigParser instance the run used
+        output_fc {feature class} -- output feature class of a watershed
+
+    Returns:
+        string -- dissolved feature class, <output_fc>_dissolved
+    """
+
+    dissolved_fc = output_fc + "_dissolved"
+    if arcpy.Exists(dissolved_fc):
+        return dissolved_fc
 
-    # Run-off Coefficient (CSV or Table)
-    runoff_coeff_file_name = config.get("RWSM", "runoff_coeff_file_name")
     runoff_coeff_field = config.get("RWSM", "runoff_coeff_field")
+    key_fields = [
+        "watershed",
+        config.get("RWSM", "land_use_field"),
+        config.get("RWSM", "land_use_LU_desc_field"),
+        config.get("RWSM", "land_use_LU_bin_field"),
+        config.get("RWSM", "land_use_LU_class_field"),
+        config.get("RWSM", "soils_field"),
+        config.get("RWSM", "soils_bin_field"),
+        config.get("RWSM", "slope_bin_field"),
+        'code_' + config.get("RWSM", "land_use_LU_bin_field"),
+        runoff_coeff_field
+    ]
+    fields = [field.name for field in arcpy.ListFields(output_fc)]
+    sum_fields = ['runoff_vol_' + runoff_coeff_field] + \
+        [loads.load_field(pollutant) for pollutant in loads.get_pollutants(config)]
+    arcpy.Dissolve_management(
+        in_features=output_fc,
+        out_feature_class=dissolved_fc,
+        dissolve_field=[field for field in key_fields if field in fields],
+        statistics_fields=[[field, "SUM"] for field in sum_fields if field in fields],
+        multi_part="SINGLE_PART"
+    )
+    return dissolved_fc
+
+
+def dissolve_workspace(config, workspace):
+    """Dissolve every watershed output feature class of a finished statistics only run
+
+    Arguments:
+        config {instance} -- ConfigParser instance the run used
+        workspace {string} -- run workspace holding the output geodatabase
+
+    Returns:
+        list -- dissolved feature classes
+    """
+
+    dissolved = []
+    for gdb in sorted(os.listdir(workspace)):
+        if not (gdb.startswith("output_") and gdb.endswith(".gdb")):
+            continue
+        arcpy.env.workspace = os.path.join(workspace, gdb)
+        for fc in sorted(arcpy.ListFeatureClasses()):
+            if not fc.endswith("_dissolved"):
+                dissolved.append(dissolve_output(config, os.path.join(workspace, gdb, fc)))
+    return dissolved
 
-    # Populate Slope Bins data structure ------------------------------------------
-    if is_gui:
-        arcpy.SetProgressor("default", "Computing slope bins...")
 
-    slope_raster = arcpy.sa.Raster(slope_file_name)
-    slope_bins = helpers.load_slope_bins(config)
-    slope_bins_w_codes = helpers.load_slope_bins(config)
-    map(lambda x: x.append((slope_bins_w_codes.index(x) + 1) * 100), slope_bins_w_codes)
+def copy_previous_output(run, watershed_name, previous_fc):
+    """Copy an unchanged watershed's output feature class from a previous run
 
-    # Get precipitation raster ----------------------------------------------------
-    if is_gui:
-        arcpy.SetProgressor("default", "Importing precipitation raster...")
-    precipitation_raster = arcpy.sa.Raster(precipitation_file_name)
+    Arguments:
+        run {Analysis_Run} -- run receiving output feature class
+        watershed_name {string} -- watershed name, illegal characters removed
+        previous_fc {string} -- output feature class of the previous run
+
+    Returns:
+        string -- output feature class
+    """
 
-    # Set aside structure for holding intersected watershed references ------------
-    intersected_watersheds = []
+    run.sampler.set_stage(watershed_name, "carry over")
+    output_fc = run.get_output_fc(watershed_name)
+    arcpy.Copy_management(previous_fc, output_fc)
+    run.add_message("{}: unchanged, output carried over from {}".format(
+        watershed_name, previous_fc))
+    return output_fc
 
-    # Setup statistics output object ----------------------------------------------
-    if is_gui:
-        arcpy.SetProgressor("default", "Initiating statistics writer...")
-    writer = Stats_Writer(config, watersheds.get_names(), slope_bins)
 
-    # Initialize data structures for updating progressor label
-    if is_gui:
-        n_watersheds = len(watersheds.get_names())
-        cnt = 1
+def carry_over_watershed(run, watershed_name, previous_fc):
+    """Copy an unchanged watershed's output feature class from a previous run into the statistics
 
-    # List of tuples for holding error information
-    watershed_errors = []
+    Arguments:
+        run {Analysis_Run} -- run receiving output feature class and statistics
+        watershed_name {string} -- watershed name, illegal characters removed
+        previous_fc {string} -- output feature class of the previous run
 
-    # Load code to coefficient lookup table
-    codes_to_coeff_lookup = helpers.get_code_to_coeff_lookup(config)
+    Returns:
+        string -- output feature class
+    """
 
-    # Iterate through watersheds, run precipitation clip analysis -----------------
-    with arcpy.da.SearchCursor(dissolved_watersheds, (watersheds_field, "SHAPE@")) as cursor:
-        for watershed in cursor:
-            try:
-                # Prepare watershed data ----------------------------------------------
-                watershed_name = watershed[0]
-                watershed_val = watershed[1]
-
-                if is_gui:
-                    msg = "Analysing {}, watershed {} of {}...".format(
-                        watershed_name, cnt, n_watersheds)
-                    arcpy.SetProgressor("step", msg, 0, n_watersheds, cnt)
+    output_fc = copy_previous_output(run, watershed_name, previous_fc)
+    run.add_statistics(watershed_name, output_fc)
+    return output_fc
+
+
+def iter_watersheds(inputs, watershed_names):
+    """Geometry of every selected watershed, its single part rows unioned into one
+
+    Dissolved watersheds are single part, a watershed may span several rows; each watershed is
+    analysed once over all of its parts. Rows are read under helpers.GEOPROCESSING_LOCK, one
+    watershed at a time.
+
+    Arguments:
+        inputs {Analysis_Inputs} -- loaded inputs
+        watershed_names {list} -- names of the watersheds to yield
+
+    Returns:
+        generator -- (watershed name, geometry) tuples, in the order of the dissolved watersheds
+    """
 
+    watersheds_field = inputs.config.get("RWSM", "watersheds_field")
+    selected = set(watershed_names)
+    oids = collections.OrderedDict()
+    with helpers.GEOPROCESSING_LOCK:
+        with arcpy.da.SearchCursor(inputs.dissolved_watersheds, ("OID@", watersheds_field)) as cursor:
+            for (oid, watershed_name) in cursor:
                 # Remove illegal characters from watershed name
                 watershed_name = helpers.strip_chars(
                     watershed_name, '!@#$%^&*()-+=,<>?/\~`[]{}.')
+                if watershed_name in selected:
+                    oids.setdefault(watershed_name, []).append(oid)
+        oid_name = arcpy.AddFieldDelimiters(
+            inputs.dissolved_watersheds, arcpy.Describe(inputs.dissolved_watersheds).OIDFieldName)
 
-                # Land Use Operations -------------------------------------------------
-                arcpy.Clip_analysis(
-                    in_features=land_use_file_name,
-                    clip_features=watershed_val,
-                    out_feature_class="lu_" + watershed_name
-                )
-                if is_gui:
-                    msg = "{}: land use clip analysis complete: {}".format(
-                        watershed_name, helpers.format_time(start_time))
-                    arcpy.AddMessage(msg)
-
-                # Adds land use lookup bin and description
-                helpers.fasterJoin(
-                    fc="lu_" + watershed_name,
-                    fcField=land_use_field,
-                    joinFC=land_use_LU_file_name,
-                    joinFCField=land_use_LU_code_field,
-                    fields=(
-                        land_use_LU_bin_field,
-                        land_use_LU_desc_field,
-                        land_use_LU_class_field
-                    )
-                )
-
-                # Dissolve land use
-                land_use_clip = arcpy.Dissolve_management(
-                    in_features="lu_" + watershed_name,
-                    out_feature_class="luD_" + watershed_name,
-                    dissolve_field=[
-                        land_use_field,
-                        land_use_LU_desc_field,
-                        land_use_LU_bin_field,
-                        land_use_LU_class_field
-                    ],
-                    statistics_fields="",
-                    multi_part="SINGLE_PART"
-                )
-                if is_gui:
-                    msg = "{}: land use dissolve complete: {}".format(
-                        watershed_name, helpers.format_time(start_time))
-                    arcpy.AddMessage(msg)
-
-                # Check size of land use area, stop analysis if no data found.
-                if int(arcpy.GetCount_management(land_use_clip).getOutput(0)) > 0:
-                    if is_gui:
-                        msg = "{}: Land use clip and dissolve has data, continuing analysis...".format(
-                            watershed_name)
-                        arcpy.AddMessage(msg)
-                else:
-                    if is_gui:
-                        msg = "{}: Land use clip and dissolve yielded no data, skipping watershed...".format(
-                            watershed_name)
-                        arcpy.AddMessage(msg)
-                    break
-
-                # Clip soils
-                arcpy.Clip_analysis(
-                    in_features=soils_file_name,
-                    clip_features=watershed_val,
-                    out_feature_class="soils_" + watershed_name
-                )
-                if is_gui:
-                    msg = "{}: soil clip analysis complete: {}".format(
-                        watershed_name, helpers.format_time(start_time))
-                    arcpy.AddMessage(msg)
-
-                soils_clip = arcpy.Dissolve_management(
-                    in_features="soils_" + watershed_name,
-                    out_feature_class="soilsD_" + watershed_name,
-                    dissolve_field=soils_field,
-                    statistics_fields="",
-                    multi_part="SINGLE_PART"
-                )
-                if is_gui:
-                    msg = "{}: soils dissolve analysis complete: {}".format(
-                        watershed_name, helpers.format_time(start_time))
-                    arcpy.AddMessage(msg)
-
-                if int(arcpy.GetCount_management(soils_clip).getOutput(0)) > 0:
-                    if is_gui:
-                        msg = "{}: Soils clip and dissolve contains data, continuing analysis...".format(
-                            watershed_name)
-                        arcpy.AddMessage(msg)
-                else:
-                    if is_gui:
-                        msg = "{}: Soils clip and dissolve yielded no rows, skipping watershed...".format(
-                            watershed_name)
-                        arcpy.AddMessage(msg)
-                    break
-
-                # Intersect Land Use and Soils ----------------------------------------
-                intersect_land_use_and_soils = arcpy.Intersect_analysis(
-                    in_features=[land_use_clip, soils_clip],
-                    out_feature_class="int_" + watershed_name,
-                    join_attributes="NO_FID"
-                )
-                if is_gui:
-                    msg = "{}: land use and soils intersect complete: {}".format(
-                        watershed_name, helpers.format_time(start_time))
-                    arcpy.AddMessage(msg)
-
-                intersect_land_use_and_soils_singles = arcpy.MultipartToSinglepart_management(
-                    in_features=intersect_land_use_and_soils,
-                    out_feature_class="intX_" + watershed_name
-                )
-                if is_gui:
-                    msg = "{}: Multipart to single part complete: {}".format(
-                        watershed_name, helpers.format_time(start_time))
-                    arcpy.AddMessage(msg)
-
-                intersect = helpers.elimSmallPolys(
-                    fc=intersect_land_use_and_soils_singles,
-                    outName=os.path.join(
-                        workspace, out_file_name, watershed_name),
-                    clusTol=0.005
-                )
-                if is_gui:
-                    msg = "{}: elimSmallPolys: {}".format(
-                        watershed_name, helpers.format_time(start_time))
-                    arcpy.AddMessage(msg)
-
-                # Add unique ID field -------------------------------------------------
-                arcpy.AddField_management(
-                    in_table=intersect,
-                    field_name='uID',
-                    field_type='LONG'
-                )
-                with arcpy.da.UpdateCursor(intersect, ('OID@', 'uID')) as cursor:
-                    for row in cursor:
-                        row[1] = row[0]
-                        cursor.updateRow(row)
-                if is_gui:
-                    msg = "{}: uID field added: {}".format(
-                        watershed_name, helpers.format_time(start_time))
-                    arcpy.AddMessage(msg)
-
-                # Add Slope bin field -------------------------------------------------
-                helpers.rasterAvgs(intersect, slope_raster,
-                                   'slope', watershed_name)
-                arcpy.AddField_management(intersect, slope_bin_field, "TEXT")
-                if is_gui:
-                    msg = "{}: slope bin field added: {}".format(
-                        watershed_name, helpers.format_time(start_time))
-                    arcpy.AddMessage(msg)
-
-                # Precipitation -------------------------------------------------------
-                helpers.rasterAvgs(intersect, precipitation_raster,
-                                   'precipitation', watershed_name)
-                if is_gui:
-                    msg = "{}: Precipitation added: {}".format(
-                        watershed_name, helpers.format_time(start_time))
-                    arcpy.AddMessage(msg)
-
-                # Add soils, land use, and slope fields -------------------------------
-                arcpy.AddField_management(intersect, "watershed", "TEXT")
-                arcpy.AddField_management(intersect, soils_bin_field, "TEXT")
-                arcpy.AddField_management(intersect, "land_use", "LONG")
-                with arcpy.da.UpdateCursor(intersect, ("watershed", soils_bin_field, soils_field, "land_use", land_use_field, slope_bin_field, 'slope_mean')) as cursor:
-                    for row in cursor:
-                        # Shift columns
-                        row[0] = watershed_name
-                        row[1] = row[2]
-                        row[3] = row[4]
-
-                        # Add slope bin to feature data
-                        slope_bin = filter(
-                            lambda x: x[0] <= row[6] < x[1], slope_bins)
-                        if len(slope_bin) > 0:
-                            slope_bin = str(slope_bin[0]).strip(
-                                '[').strip(']').replace(', ', '-')
-                        else:
-                            slope_bin = "NaN"
-                        row[5] = slope_bin
-
-                        cursor.updateRow(row)
-                if is_gui:
-                    msg = "{}: soils, land use, and slope fields added: {}".format(
-                        watershed_name, helpers.format_time(start_time))
-                    arcpy.AddMessage(msg)
-
-                # Add land use code fields ---------------------------------------------
-                code_field = 'code_' + land_use_LU_bin_field
-                base_field = 'runoff_vol_' + runoff_coeff_field
-                arcpy.AddField_management(intersect, code_field, "DOUBLE")
-                arcpy.AddField_management(intersect, base_field, "DOUBLE")
-                if is_gui:
-                    msg = "{}: land use code and runoff volume fields added: {}".format(
-                        watershed_name, helpers.format_time(start_time))
-                    arcpy.AddMessage(msg)
-
-                # Write in values for new fields --------------------------------------
-                with arcpy.da.UpdateCursor(intersect, (soils_bin_field, land_use_LU_bin_field, slope_bin_field, code_field)) as cursor:
-                    for row in cursor:
-                        # arcpy.AddMessage("{},{},{},{}".format(row[0],row[1],row[2],row[3]))
-                        # TODO: Identify why NaNs exist
-                        slpBin1 = int(row[2].split('-')[0]
-                                      ) if row[2] != 'NaN' else 0
-                        slpBinVal = [k[2]
-                                     for k in slope_bins_w_codes if k[0] == slpBin1][0]
-                        row[3] = helpers.calculateCode(
-                            slpBinVal, row[0], float(row[1]), soils_bin_field)
-                        cursor.updateRow(row)
-                if is_gui:
-                    msg = "{}: land use codes added: {}".format(
-                        watershed_name, helpers.format_time(start_time))
-                    arcpy.AddMessage(msg)
-
-                # Join runoff coeff lookup table and calculate runoff volume
-                arcpy.AddField_management(
-                    intersect, runoff_coeff_field, "Double")
-                with arcpy.da.UpdateCursor(intersect, (runoff_coeff_field, code_field)) as cursor:
-                    for row in cursor:
-                        row[0] = codes_to_coeff_lookup[row[1]]
-                        cursor.updateRow(row)
-                if is_gui:
-                    msg = "{}: output fields added: {}".format(
-                        watershed_name, helpers.format_time(start_time))
-                    arcpy.AddMessage(msg)
-
-                # Convert precipitation from mm to m and multiple by runoff vol.
-                with arcpy.da.UpdateCursor(
-                    in_table=intersect,
-                    field_names=['SHAPE@AREA', runoff_coeff_field,
-                                 base_field, 'precipitation_mean'],
-                    where_clause='"{0}" is not null'.format(runoff_coeff_field)
-                ) as cursor:
-                    for row in cursor:
-                        # convert ppt from mm to m and multiply by area and runoff coeff
-                        row[2] = (row[3] / 1000.0) * row[0] * row[1]
-                        cursor.updateRow(row)
-                if is_gui:
-                    msg = "{}: precipitation converted: {}".format(
-                        watershed_name, helpers.format_time(start_time))
-                    arcpy.AddMessage(msg)
-
-                # Update statistics writer --------------------------------------------
-                writer.add_fc_table(os.path.join(
-                    workspace, out_file_name, watershed_name))
-                if is_gui:
-                    msg = "{}: statistics computed: {}\n".format(
-                        watershed_name, helpers.format_time(start_time))
-                    arcpy.AddMessage(msg)
-
-                # Increment count -----------------------------------------------------
-                cnt += 1
-
-            except Exception as error:
-                if is_gui:
-                    msg = "{}: Error computing analysis: {}".format(
-                        watershed_name, error)
-                    arcpy.AddMessage(msg)
-                watershed_errors.append((watershed_name, error))
+    for (watershed_name, watershed_oids) in oids.items():
+        with helpers.GEOPROCESSING_LOCK:
+            where_clause = "{} IN ({})".format(oid_name, ",".join(str(oid) for oid in watershed_oids))
+            geometry = None
+            with arcpy.da.SearchCursor(inputs.dissolved_watersheds, ("SHAPE@",), where_clause) as cursor:
+                for (shape,) in cursor:
+                    geometry = shape if geometry is None else geometry.union(shape)
+        yield (watershed_name, geometry)
+
+
+def run_watersheds(inputs, run, watershed_names, unchanged=None):
+    """Analyse a set of watersheds, recording errors rather than stopping
+
+    Arguments:
+        inputs {Analysis_Inputs} -- loaded inputs
+        run {Analysis_Run} -- opened run
+        watershed_names {list} -- sorted names of the watersheds to analyse
+
+    Keyword Arguments:
+        unchanged {dictionary} -- previous output feature classes to carry over, keyed by watershed name (default: {None})
+    """
+
+    unchanged = unchanged or {}
+    n_watersheds = len(watershed_names)
+    cnt = 1
+
+    # Iterate through watersheds, run precipitation clip analysis -----------------
+    for (watershed_name, watershed_val) in iter_watersheds(inputs, watershed_names):
+        # Cancellation is honoured between watersheds, completed ones are kept
+        if run.messages.is_cancelled():
+            run.cancelled = True
+            break
+        if run.profiler is not None:
+            run.profiler.start(watershed_name)
+        try:
+            msg = "Analysing {}, watershed {} of {}...".format(
+                watershed_name, cnt, n_watersheds)
+            run.messages.set_step(msg, cnt, n_watersheds)
+            if watershed_name in unchanged:
+                carry_over_watershed(
+                    run, watershed_name, unchanged[watershed_name])
+            else:
+                analyze_watershed(inputs, run, watershed_name, watershed_val)
+        except Exception as error:
+            run.add_message("{}: Error computing analysis: {}".format(
+                watershed_name, error))
+            run.watershed_errors.append((watershed_name, error))
+        finally:
+            if run.profiler is not None:
+                run.profiler.stop()
+        cnt += 1
+
+
+def run_pipeline(inputs, run, watershed_names, unchanged=None):
+    """Analyse a set of watersheds in stages connected by bounded queues, recording errors rather than stopping
+
+    Overlay, zonal means, attributes and statistics each run on their own thread, so while one
+    watershed is clipped the previous ones are reduced, attributed and summarised. Geoprocessing
+    is serialised by helpers.GEOPROCESSING_LOCK; stages overlap where one geoprocesses and the
+    others reduce cells or accumulate statistics. Watersheds pass every stage in order, tiles
+    of an oversized watershed as separate items merged by the statistics stage.
+
+    Arguments:
+        inputs {Analysis_Inputs} -- loaded inputs
+        run {Analysis_Run} -- opened run
+        watershed_names {list} -- sorted names of the watersheds to analyse
+
+    Keyword Arguments:
+        unchanged {dictionary} -- previous output feature classes to carry over, keyed by watershed name (default: {None})
+    """
+
+    import pipeline  # only pipelined runs start stage threads
+
+    config = inputs.config
+    unchanged = unchanged or {}
+    n_watersheds = len(watershed_names)
+    cnt = 1
+    lock = helpers.GEOPROCESSING_LOCK
+    if run.profiler is not None:
+        run.add_message("Profiling covers setup only, watersheds in flight share the stage threads")
+
+    def tile_errors(function):
+        # Tiles carry their errors on to the statistics stage, which completes their watershed
+        def stage(watershed):
+            if watershed["tile_set"] is None:
+                return function(watershed)
+            if watershed.get("error") is None:
+                try:
+                    function(watershed)
+                except Exception as error:
+                    watershed["error"] = error
+            return watershed
+        return stage
+
+    def overlay(watershed):
+        with lock:
+            if watershed["previous_fc"] is not None:
+                copy_previous_output(run, watershed["name"], watershed["previous_fc"])
+                return watershed
+            watershed["intersect"] = overlay_watershed(
+                inputs, run, watershed["name"], watershed["geometry"])
+        return watershed if watershed["intersect"] is not None else None
+
+    def zonal_means(watershed):
+        if watershed["intersect"] is not None:
+            (watershed["zonal_engine"], watershed["zonal_seconds"]) = zonal_watershed(
+                inputs, run, watershed["watershed"], watershed["intersect"])
+        return watershed
+
+    def attributes(watershed):
+        if watershed["intersect"] is not None:
+            with lock:
+                attribute_watershed(inputs, run, watershed["watershed"], watershed["intersect"])
+        return watershed
+
+    def statistics(watershed):
+        watershed_name = watershed["watershed"]
+        tile_set = watershed["tile_set"]
+        if tile_set is None:
+            run.add_statistics(watershed_name, run.get_output_fc(watershed_name))
+            if watershed["intersect"] is not None:
+                run.log_engine(watershed_name, watershed["zonal_engine"], watershed["zonal_seconds"],
+                               time.time() - watershed["start_time"])
+            return watershed
+
+        # Tiles arrive in order, the watershed is merged once its last tile is in
+        tile_set["tiles"].append(watershed)
+        if len(tile_set["tiles"]) < tile_set["n_tiles"]:
+            return watershed
+        tiles = [tile for tile in tile_set["tiles"] if tile["intersect"] is not None]
+        errors = [tile["error"] for tile in tile_set["tiles"] if tile.get("error") is not None]
+        if errors:
+            raise errors[0]
+        if not tiles:
+            return None
+        with lock:
+            output_fc = merge_watershed_tiles(
+                inputs, run, watershed_name, [run.get_output_fc(tile["name"]) for tile in tiles],
+                tile_set["edge_lines"])
+        run.add_statistics(watershed_name, output_fc)
+        run.log_engine(watershed_name, tiles[-1]["zonal_engine"],
+                       sum(tile["zonal_seconds"] for tile in tiles),
+                       time.time() - tile_set["start_time"])
+        return watershed
+
+    def on_error(stage_name, watershed, error):
+        run.add_message("{}: Error computing analysis ({}): {}".format(
+            watershed["watershed"], stage_name, error))
+        run.watershed_errors.append((watershed["watershed"], error))
+
+    watershed_pipeline = pipeline.Pipeline(
+        [("overlay", tile_errors(overlay)), ("zonal", tile_errors(zonal_means)),
+         ("attributes", tile_errors(attributes)), ("statistics", statistics)],
+        queue_size=int(helpers.get_config_option(config, "pipeline_queue_size", 2)),
+        interval=float(helpers.get_config_option(config, "pipeline_interval", 1.0)),
+        on_error=on_error)
+    watershed_pipeline.start()
+    try:
+        # A watershed enters as one item over all of its parts, items never share output names
+        for (watershed_name, watershed_val) in iter_watersheds(inputs, watershed_names):
+            # Cancellation is honoured between watersheds, those in flight are completed
+            if run.messages.is_cancelled():
+                run.cancelled = True
+                break
+            msg = "Analysing {}, watershed {} of {}...".format(
+                watershed_name, cnt, n_watersheds)
+            run.messages.set_step(msg, cnt, n_watersheds)
+
+            # Oversized watersheds enter the pipeline tile by tile
+            tile_set = None
+            units = [(watershed_name, watershed_val)]
+            if watershed_name not in unchanged:
+                with lock:
+                    tiling = get_watershed_tiles(run, watershed_name, watershed_val)
+                if tiling is not None:
+                    (units, edge_lines) = tiling
+                    tile_set = {"tiles": [], "n_tiles": len(units), "edge_lines": edge_lines,
+                                "start_time": time.time()}
+            for (unit_name, unit_val) in units:
+                watershed_pipeline.put({
+                    "name": unit_name, "watershed": watershed_name, "geometry": unit_val,
+                    "previous_fc": unchanged.get(watershed_name), "intersect": None,
+                    "tile_set": tile_set, "start_time": time.time()})
+            cnt += 1
+    finally:
+        watershed_pipeline.close()
+
+    watershed_pipeline.write_metrics(os.path.join(run.workspace, "pipeline_queues.csv"),
+                                     os.path.join(run.workspace, "pipeline_stages.csv"))
+    for row in watershed_pipeline.get_summary():
+        run.add_message("Pipeline {}: {} watersheds, busy {:.1f} s, starved {:.1f} s, blocked {:.1f} s, "
+                        "queue depth mean {:.1f} max {}".format(
+                            row[0], row[1], row[3], row[4], row[5], row[6], row[7]))
+
+
+def write_process_config(config, file_name, overrides):
+    """Write the configuration of worker processes
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+        file_name {string} -- configuration file written
+        overrides {dictionary} -- parameter values overriding the configuration
+    """
+
+    process_config = helpers.get_empty_config()
+    process_config.add_section("RWSM")
+    for option in config.options("RWSM"):
+        process_config.set("RWSM", option, config.get("RWSM", option, raw=True))
+    for (option, value) in overrides.items():
+        process_config.set("RWSM", option, str(value))
+    with open(file_name, "w") as config_file:
+        process_config.write(config_file)
+
+
+def run_processes(inputs, run, watershed_names, unchanged=None, n_processes=2):
+    """Analyse a set of watersheds in worker processes attached to one data plane
+
+    The parent publishes its lookup tables and raster stack as memory mapped files once;
+    every worker attaches to them read-only, so workers share one copy of the rasters
+    rather than loading their own. Each worker writes its own workspace; once they finish,
+    their accumulators, results store rows and output feature classes are folded into the
+    run's workspace in watershed order, so statistics, the results store and the merged or
+    per-watershed outputs read as those of a single process run.
+
+    Arguments:
+        inputs {Analysis_Inputs} -- loaded inputs
+        run {Analysis_Run} -- opened run
+        watershed_names {list} -- sorted names of the watersheds to analyse
+
+    Keyword Arguments:
+        unchanged {dictionary} -- previous output feature classes to carry over, keyed by watershed name (default: {None})
+        n_processes {int} -- worker processes (default: {2})
+    """
+
+    import worker  # worker imports rwsm
+
+    unchanged = unchanged or {}
+    carried_over = [name for name in watershed_names if name in unchanged]
+    if carried_over:
+        run_watersheds(inputs, run, carried_over, unchanged)
+    changed = [name for name in watershed_names if name not in unchanged]
+    groups = [group for group in (changed[i::n_processes] for i in range(n_processes)) if group]
+    if not groups:
+        return
+
+    run.set_stage(None, "data plane", "Publishing data plane...")
+    header_file_name = data_plane.publish_data_plane(
+        inputs, os.path.join(run.workspace, "data_plane"), run.messages)
+    config_file_name = os.path.join(run.workspace, "process.ini")
+    write_process_config(run.config, config_file_name, {
+        "processes": 1, "previous_run": "", "manifest": False, "preflight": False,
+        "precipitation_batch": "", "rollup_hierarchy": "", "uncertainty": False,
+        "merged_output": False})
+
+    run.set_stage(None, "processes", "Analysing {} watersheds in {} processes...".format(
+        len(changed), len(groups)))
+    processes = []
+    for (i, group) in enumerate(groups):
+        watersheds_file_name = os.path.join(run.workspace, "process{}_watersheds.txt".format(i + 1))
+        with open(watersheds_file_name, "w") as watersheds_file:
+            watersheds_file.write("\n".join(group) + "\n")
+        process = worker.Worker_Process(config_file_name, [
+            "--watersheds-file", watersheds_file_name,
+            "--workspace", os.path.join(run.workspace, "process{}".format(i + 1)),
+            "--data-plane", header_file_name])
+        process.start()
+        processes.append(process)
+
+    # Relay messages of every worker, cancellation reaches all of them through the shared cancel file
+    final_events = [None] * len(processes)
+    while not all(process.finished for process in processes):
+        pending = []
+        for (i, process) in enumerate(processes):
+            if process.finished:
                 continue
+            for event in process.get_events(worker.POLL_INTERVAL / len(processes)):
+                if event["event"] in worker.FINAL_EVENTS:
+                    final_events[i] = event
+                elif event["event"] in ("message", "warning", "error"):
+                    pending.append(event)
+        worker.report_messages(pending, run.messages)
+        if run.messages.is_cancelled():
+            run.cancelled = True
+            processes[0].cancel()
+    for process in processes:
+        process.wait()
+
+    # Worker outputs are copied into the run's workspace, readers of the run find every watershed there
+    results = {}
+    for (i, (group, event)) in enumerate(zip(groups, final_events)):
+        if event is None or event["event"] == "failed":
+            error = event["message"] if event is not None else "worker exited without a result"
+            run.add_message("Process {}: {}".format(i + 1, error))
+            run.watershed_errors += [(watershed_name, error) for watershed_name in group]
+            continue
+        workspace = event["workspace"]
+        accumulators = run.writer.load_accumulators(os.path.join(workspace, "accumulators.json"))
+        store = None
+        if run.store and os.path.isdir(os.path.join(workspace, "results_store")):
+            store = results_store.Results_Store(os.path.join(workspace, "results_store"))
+        for (watershed_name, output_fc) in event["watersheds"]:
+            if str(watershed_name) in accumulators:
+                results[str(watershed_name)] = (accumulators[str(watershed_name)], str(output_fc), store)
+        errors_file_name = os.path.join(workspace, "results_errors.csv")
+        if os.path.isfile(errors_file_name):
+            run.watershed_errors += [tuple(row) for row in helpers.load_csv(errors_file_name)[1:] if row]
+        run.add_message("Process {}: {} of {} watersheds analysed in {}".format(
+            i + 1, len(event["watersheds"]), len(group), workspace))
+
+    run.set_stage(None, "merge processes", "Merging worker results...")
+    for watershed_name in changed:
+        if watershed_name not in results:
+            continue
+        (accumulator, worker_fc, store) = results[watershed_name]
+        try:
+            if run.merged_output:
+                output_fc = worker_fc
+                run.append_merged(watershed_name, worker_fc)
+            else:
+                output_fc = run.get_output_fc(watershed_name)
+                arcpy.Copy_management(worker_fc, output_fc)
+            if store is not None:
+                run.store.add_store(store, watershed_name)
+        except Exception as error:
+            run.add_message("{}: Error merging worker results: {}".format(watershed_name, error))
+            run.watershed_errors.append((watershed_name, error))
+            continue
+        run.writer.add_accumulator(watershed_name, accumulator)
+        run.intersected_watersheds.append((watershed_name, output_fc))
+
+
+def validate_inputs(config, messages=None):
+    """Validate inputs before any geoprocessing, problems would otherwise surface mid-run
 
-    # Write stats to csv files and watersheds with errors
-    writer.write_ws_stats_table(os.path.join(workspace, "results_wsStats.csv"))
-    writer.write_lu_stats_table(os.path.join(workspace, "results_luStats.csv"))
-    if is_gui:
-        msg = "Analysis complete: {}".format(helpers.format_time(start_time))
-        arcpy.AddMessage(msg)
-        if len(watershed_errors) > 0:
-            msg = "Errors encountered while computing analysis for the following watersheds:"
-            arcpy.AddMessage(msg)
-            for (watershed_name, error) in watershed_errors:
-                arcpy.AddMessage(watershed_name)
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+
+    Keyword Arguments:
+        messages {Tool_Messages} -- receiver of validation findings (default: {None})
+
+    Raises:
+        ValueError -- validation found errors
+    """
+
+    messages = messages or Tool_Messages()
+    messages.set_progressor("Validating inputs...")
+    plan = planner.validate(config)
+    for (level, msg, option) in plan.messages:
+        if level == planner.ERROR:
+            messages.add_error(msg)
+        elif level == planner.WARNING:
+            messages.add_warning(msg)
         else:
-            msg = "There were no errors during the analysis"
-            arcpy.AddMessage(msg)
+            messages.add_message(msg)
+    if plan.has_errors():
+        raise ValueError("Input validation failed: " +
+                         "; ".join(plan.get_errors()))
+
+
+def run_analysis(config=None, is_gui=False, watershed_names=None, messages=None, workspace=None,
+                 data_plane_file_name=None):
+    """Primary RWSM analysis loop
+    
+    Keyword Arguments:
+        config {instance} -- ConfigParser instance holding parameter values (default: {None})
+        is_gui {bool} -- indicates if running from ArcMap toolbox GUI (default: {False})
+        watershed_names {list} -- subset of watersheds to analyse, all watersheds if None (default: {None})
+        messages {Tool_Messages} -- receiver of messages, progress and cancellation, toolbox messages if None (default: {None})
+        workspace {string} -- workspace folder prefix, rwsm within the configured workspace if None (default: {None})
+        data_plane_file_name {string} -- header of a data plane to attach to rather than loading inputs (default: {None})
+
+    Returns:
+        tuple -- workspace path and list of (watershed name, output feature class) tuples
+    """
+
+
+    # Logger used for command line debugging, not supported in beta.
+    # logger = helpers.get_logger(LOG_LEVEL)
+    # logger.info('Starting analysis...')
+
+    # Load values from config file
+    if not config:
+        CONFIG_FILE_NAME = "rwsm.ini"
+        if os.path.isfile(CONFIG_FILE_NAME):
+            config = helpers.load_config(CONFIG_FILE_NAME)
+
+    messages = messages or Tool_Messages(is_gui)
+    if helpers.get_config_boolean(config, "preflight"):
+        validate_inputs(config, messages)
+
+    # Create workspace, load rasters, slope bins and lookup tables
+    run = Analysis_Run(config, is_gui, workspace=workspace, messages=messages)
+    if run.profiler is not None:
+        # Setup is profiled with the whole run, when no watershed subset is selected
+        run.profiler.start("setup")
+    inputs = Analysis_Inputs(config)
+    if data_plane_file_name:
+        inputs.attach(data_plane_file_name, run.workspace, run.get_temp_workspace(), run)
+    else:
+        inputs.load(run.workspace, run.get_temp_workspace(), run)
+
+    run.open(inputs, inputs.select_watersheds(watershed_names))
+    if run.profiler is not None:
+        run.profiler.stop()
+
+    # Fingerprint watersheds, carry over those unchanged since a previous run
+    previous_run = helpers.get_config_option(config, "previous_run")
+    unchanged = {}
+    fingerprints = None
+    if previous_run or helpers.get_config_boolean(config, "manifest"):
+        run.set_stage(None, "fingerprint", "Fingerprinting watersheds...")
+        global_fingerprint = incremental.get_global_fingerprint(config)
+        fingerprints = incremental.fingerprint_watersheds(
+            config, inputs.dissolved_watersheds)
+    if previous_run:
+        unchanged = incremental.get_unchanged(
+            incremental.load_manifest(previous_run), global_fingerprint,
+            fingerprints, run.watershed_names)
+        run.add_message("Incremental run: {} of {} watersheds changed since {}".format(
+            len(run.watershed_names) - len(unchanged), len(run.watershed_names), previous_run))
+
+    n_processes = int(helpers.get_config_option(config, "processes", 1))
+    if n_processes > 1:
+        run_processes(inputs, run, run.watershed_names, unchanged, n_processes)
+    elif helpers.get_config_boolean(config, "pipeline"):
+        run_pipeline(inputs, run, run.watershed_names, unchanged)
+    else:
+        run_watersheds(inputs, run, run.watershed_names, unchanged)
+    run.close()
+
+    # Roll statistics up through watershed groupings, no further geoprocessing
+    hierarchy_file_name = helpers.get_config_option(config, "rollup_hierarchy")
+    if hierarchy_file_name:
+        import rollup  # rollup imports rwsm
+        rollup.rollup(config, run.writer.accumulators, inputs.slope_bins,
+                      hierarchy_file_name, run.workspace, messages)
+
+    # Monte Carlo runoff volume bands from the results store
+    if helpers.get_config_boolean(config, "uncertainty") and run.store:
+        uncertainty.run_uncertainty(config, run.workspace, run.messages)
+    if fingerprints is not None:
+        incremental.write_manifest(
+            run.workspace, global_fingerprint, fingerprints, run.intersected_watersheds)
+
+    return (run.workspace, run.intersected_watersheds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the RWSM hydrology analysis from the command line.")
+    parser.add_argument("config", nargs="?", default="rwsm.ini",
+                        help="configuration file (default: rwsm.ini)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="validate inputs and estimate runtime, memory and scratch disk without running")
+    parser.add_argument("--plan-output",
+                        help="CSV file for per-watershed estimates of a dry run")
+    parser.add_argument("--profile", nargs="?", const="deterministic", choices=profiling.PROFILE_MODES,
+                        help="profile every watershed, or those listed in profile_watersheds (default mode: deterministic)")
+    parser.add_argument("--dissolve", metavar="WORKSPACE",
+                        help="dissolve the output feature classes of a finished statistics only run by attribute keys")
+    args = parser.parse_args()
+
+    config = helpers.load_config(args.config)
+    if args.profile:
+        config.set("RWSM", "profile", args.profile)
+    if args.dissolve:
+        for fc in dissolve_workspace(config, args.dissolve):
+            print(fc)
+        sys.exit(0)
+    if args.dry_run:
+        plan = planner.plan_analysis(config)
+        for line in plan.report():
+            print(line)
+        if args.plan_output:
+            plan.write_estimates(args.plan_output)
+        sys.exit(1 if plan.has_errors() else 0)
+    run_analysis(config=config)
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+
+"""screening.py: Whole-region screening run on coarse inputs, with errors estimated against sampled full-resolution watersheds."""
+
+__copyright__ = """
+    Copyright (C) 2018 San Francisco Estuary Institute (SFEI)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import csv
+import time
+import argparse
+import numpy
+import arcpy
+import helpers
+import compare
+import rwsm
+
+ERROR_FILE_NAME = "results_screening_error.csv"
+SAMPLES_FILE_NAME = "results_screening_samples.csv"
+
+ERROR_HEADERS = ["Column", "Watersheds Sampled", "Mean Rel. Error", "Mean Abs. Rel. Error",
+                 "Max Abs. Rel. Error", "Bound Abs. Rel. Error", "Sampled Total Rel. Error"]
+
+SAMPLES_HEADERS = ["Watershed", "Column", "Screening Value", "Full Resolution Value", "Rel. Error"]
+
+# Watershed statistics slope bin columns, "Slope Bin <lower>-<upper> % Tot."
+SLOPE_BIN_HEADER = re.compile(r"^Slope Bin (\S+?)-\S+ % Tot\.$")
+
+
+def prepare_screening_inputs(config, gdb, factor, tolerance, messages):
+    """Decimated rasters and generalized features for a screening run
+
+    Slope and precipitation are aggregated to cells factor times larger, their mean over the
+    full resolution cells; land use and soils polygons are simplified to tolerance.
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+        gdb {string} -- geodatabase receiving the screening inputs
+        factor {int} -- cells aggregated along each side of a coarse cell
+        tolerance {string} -- simplification tolerance, a linear unit such as '10 Meters'
+        messages {Tool_Messages} -- receiver of messages
+
+    Returns:
+        dictionary -- configuration overrides pointing at the screening inputs
+    """
+
+    overrides = {}
+    arcpy.CheckOutExtension('Spatial')
+    for option in ("slope_file_name", "precipitation_file_name"):
+        out_name = os.path.join(gdb, "screening_" + option.replace("_file_name", ""))
+        if arcpy.Exists(out_name):
+            arcpy.Delete_management(out_name)
+        arcpy.sa.Aggregate(config.get("RWSM", option), factor,
+                           "MEAN", "EXPAND", "DATA").save(out_name)
+        overrides[option] = out_name
+    arcpy.CheckInExtension('Spatial')
+
+    for option in ("land_use", "soils_file_name"):
+        out_name = os.path.join(gdb, "screening_" + option.replace("_file_name", ""))
+        if arcpy.Exists(out_name):
+            arcpy.Delete_management(out_name)
+        arcpy.SimplifyPolygon_cartography(
+            config.get("RWSM", option), out_name, "POINT_REMOVE", tolerance,
+            collapsed_point_option="NO_KEEP")
+        overrides[option] = out_name
+        messages.add_message("Screening: {} simplified, {} of {} features".format(
+            option, helpers.getCountInt(out_name), helpers.getCountInt(config.get("RWSM", option))))
+    return overrides
+
+
+def get_config(config_file_name, overrides):
+    """Configuration of a screening or sampled run
+
+    Arguments:
+        config_file_name {string} -- path to configuration file
+        overrides {dictionary} -- parameter values overriding the configuration file
+
+    Returns:
+        instance -- ConfigParser instance
+    """
+
+    config = helpers.load_config(config_file_name)
+    for (option, value) in overrides.items():
+        config.set("RWSM", option, str(value))
+    # Both runs compute every requested watershed from their own inputs
+    config.set("RWSM", "previous_run", "")
+    return config
+
+
+def select_samples(watershed_names, n_samples, seed=None):
+    """Watersheds run at full resolution to estimate the screening error
+
+    Arguments:
+        watershed_names {list} -- watershed names of the screening run
+        n_samples {int} -- number of watersheds to sample
+
+    Keyword Arguments:
+        seed {int} -- random seed, repeatable samples when set (default: {None})
+
+    Returns:
+        list -- sorted sampled watershed names
+    """
+
+    if not watershed_names:
+        return []
+    random_state = numpy.random.RandomState(seed)
+    n_samples = min(max(n_samples, 1), len(watershed_names))
+    return sorted(random_state.choice(sorted(watershed_names), n_samples, replace=False).tolist())
+
+
+def get_column_key(header):
+    """Key matching a statistics column between runs
+
+    Slope bin columns are keyed by their lower bound; the upper bound of the open ended top
+    bin is the raster's maximum slope, which is lower on an aggregated raster.
+
+    Arguments:
+        header {string} -- watershed statistics column header
+
+    Returns:
+        object -- header, or (prefix, lower bound) for a slope bin column
+    """
+
+    match = SLOPE_BIN_HEADER.match(header)
+    if match:
+        return ("Slope Bin", match.group(1))
+    return header
+
+
+def get_errors(screening_file_name, full_file_name, percentile):
+    """Relative errors of the screening watershed statistics against full resolution statistics
+
+    Arguments:
+        screening_file_name {string} -- watershed statistics CSV of the screening run
+        full_file_name {string} -- watershed statistics CSV of the sampled full resolution run
+        percentile {float} -- percentile of absolute relative errors reported as the error bound
+
+    Returns:
+        tuple -- error rows per column and sample rows per watershed and column
+    """
+
+    screening_rows = helpers.load_csv(screening_file_name)
+    full_rows = helpers.load_csv(full_file_name)
+    screening = dict((row[0], row) for row in screening_rows[1:] if row)
+    full = dict((row[0], row) for row in full_rows[1:] if row)
+    watershed_names = sorted(set(screening).intersection(full))
+    full_columns = dict((get_column_key(header), i) for (i, header) in enumerate(full_rows[0]))
+
+    error_rows = []
+    sample_rows = []
+    for (i, header) in enumerate(screening_rows[0]):
+        key = get_column_key(header)
+        if i == 0 or key not in full_columns:
+            continue
+        j = full_columns[key]
+        pairs = [(name, compare.to_float(screening[name][i]), compare.to_float(full[name][j]))
+                 for name in watershed_names]
+        pairs = [(name, coarse, fine) for (name, coarse, fine) in pairs
+                 if coarse is not None and fine is not None]
+        if not pairs:
+            continue
+        coarse = numpy.array([value for (name, value, fine) in pairs])
+        fine = numpy.array([value for (name, coarse_value, value) in pairs])
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            errors = numpy.where(coarse == fine, 0.0, (coarse - fine) / numpy.abs(fine))
+            total_error = 0.0 if numpy.sum(coarse) == numpy.sum(fine) else \
+                (numpy.sum(coarse) - numpy.sum(fine)) / abs(numpy.sum(fine))
+        abs_errors = numpy.abs(errors)
+        error_rows.append([header, len(pairs), numpy.mean(errors), numpy.mean(abs_errors),
+                           numpy.max(abs_errors), numpy.percentile(abs_errors, percentile),
+                           total_error])
+        sample_rows += [[name, header, coarse_value, fine_value, error] for (
+            (name, coarse_value, fine_value), error) in zip(pairs, errors.tolist())]
+    return (error_rows, sample_rows)
+
+
+def write_table(file_name, headers, rows):
+    """Write rows to CSV
+
+    Arguments:
+        file_name {string} -- CSV file name
+        headers {list} -- column headers
+        rows {list} -- rows
+    """
+
+    with open(file_name, "wb") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(headers)
+        for row in rows:
+            writer.writerow(row)
+
+
+def run_screening(config_file_name, messages=None):
+    """Run every watershed on coarse inputs, then a sample at full resolution to estimate the error
+
+    The screening run writes the usual statistics tables. Sampled watersheds are compared column
+    by column with their full resolution statistics; the error table holds, per column, the mean
+    signed and absolute relative errors, the largest and the screening_error_percentile absolute
+    relative error, the bound to expect of unsampled watersheds.
+
+    Arguments:
+        config_file_name {string} -- path to configuration file
+
+    Keyword Arguments:
+        messages {Tool_Messages} -- receiver of messages (default: {None})
+
+    Returns:
+        tuple -- screening workspace, sampled full resolution workspace and error table file name,
+            None when no watershed could be sampled
+    """
+
+    messages = messages or rwsm.Tool_Messages()
+    config = helpers.load_config(config_file_name)
+    factor = int(helpers.get_config_option(config, "screening_factor", 4))
+    tolerance = helpers.get_config_option(config, "screening_tolerance", "10 Meters")
+    n_samples = int(helpers.get_config_option(config, "screening_samples", 5))
+    seed = helpers.get_config_option(config, "screening_seed")
+    percentile = float(helpers.get_config_option(config, "screening_error_percentile", 95))
+    workspace = config.get("RWSM", "workspace")
+
+    start_time = time.time()
+    gdb_name = "screening_inputs.gdb"
+    if not arcpy.Exists(os.path.join(workspace, gdb_name)):
+        arcpy.CreateFileGDB_management(workspace, gdb_name)
+    overrides = prepare_screening_inputs(
+        config, os.path.join(workspace, gdb_name), factor, tolerance, messages)
+    (screening_workspace, screening_watersheds) = rwsm.run_analysis(
+        config=get_config(config_file_name, overrides), messages=messages,
+        workspace=os.path.join(workspace, "rwsm_screening"))
+    screening_time = time.time() - start_time
+
+    samples = select_samples([watershed_name for (watershed_name, fc) in screening_watersheds],
+                             n_samples, None if seed is None else int(seed))
+    if not samples:
+        # No watershed completed, there is nothing to compare against full resolution
+        messages.add_warning("Screening: no watershed completed at screening resolution, nothing to sample")
+        return (screening_workspace, None, None)
+    start_time = time.time()
+    (full_workspace, full_watersheds) = rwsm.run_analysis(
+        config=get_config(config_file_name, {}), watershed_names=samples, messages=messages,
+        workspace=os.path.join(workspace, "rwsm_screening_samples"))
+    full_time = time.time() - start_time
+
+    (error_rows, sample_rows) = get_errors(
+        os.path.join(screening_workspace, "results_wsStats.csv"),
+        os.path.join(full_workspace, "results_wsStats.csv"), percentile)
+    error_file_name = os.path.join(screening_workspace, ERROR_FILE_NAME)
+    write_table(error_file_name, ERROR_HEADERS, error_rows)
+    write_table(os.path.join(screening_workspace, SAMPLES_FILE_NAME), SAMPLES_HEADERS, sample_rows)
+
+    messages.add_message("Screening: {} watersheds in {:.1f} s, {} sampled at full resolution in {:.1f} s".format(
+        len(screening_watersheds), screening_time, len(samples), full_time))
+    for row in error_rows:
+        messages.add_message("Screening: {} P{:g} abs. rel. error {:.3f}, max {:.3f}".format(
+            row[0], percentile, row[5], row[4]))
+    return (screening_workspace, full_workspace, error_file_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Screen the whole region on coarse inputs and estimate the error on sampled watersheds.")
+    parser.add_argument("config", nargs="?", default="rwsm.ini",
+                        help="configuration file (default: rwsm.ini)")
+    args = parser.parse_args()
+
+    (screening_workspace, full_workspace, error_file_name) = run_screening(args.config)
+    print(error_file_name)
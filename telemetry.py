@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+
+"""telemetry.py: Background sampling of process memory, CPU, scratch disk and file handles."""
+
+__copyright__ = """
+    Copyright (C) 2018 San Francisco Estuary Institute (SFEI)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import time
+import datetime
+import threading
+
+# psutil is optional, platform calls are used when it is not installed
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Metrics for which peak values are reported
+PEAK_METRICS = ["rss_bytes", "private_bytes", "cpu_percent",
+                "scratch_bytes", "open_handles"]
+
+
+def get_memory_bytes():
+    """Resident and private memory of the current process
+
+    Returns:
+        tuple -- resident set size and private (committed) bytes, None where unavailable
+    """
+
+    if psutil is not None:
+        info = psutil.Process(os.getpid()).memory_info()
+        return (info.rss, info.vms)
+
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD),
+                        ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t),
+                        ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t),
+                        ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(
+            ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb)
+        return (counters.WorkingSetSize, counters.PagefileUsage)
+
+    if os.path.exists("/proc/self/statm"):
+        with open("/proc/self/statm") as statm:
+            (size, resident) = [int(value) for value in statm.read().split()[:2]]
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        return (resident * page_size, size * page_size)
+
+    return (None, None)
+
+
+def get_open_handles():
+    """Number of open file handles (Windows handles, POSIX file descriptors)
+
+    Returns:
+        int -- open handles, None where unavailable
+    """
+
+    if psutil is not None:
+        process = psutil.Process(os.getpid())
+        if hasattr(process, "num_handles"):
+            return process.num_handles()
+        return process.num_fds()
+
+    if sys.platform == "win32":
+        import ctypes
+        count = ctypes.c_ulong()
+        ctypes.windll.kernel32.GetProcessHandleCount(
+            ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(count))
+        return count.value
+
+    if os.path.isdir("/proc/self/fd"):
+        return len(os.listdir("/proc/self/fd"))
+
+    return None
+
+
+def get_directory_bytes(path):
+    """Total size of the files within a directory, e.g. a file geodatabase
+
+    Arguments:
+        path {string} -- directory path
+
+    Returns:
+        int -- size in bytes, None if the directory does not exist
+    """
+
+    if path is None or not os.path.isdir(path):
+        return None
+    total = 0
+    for (root, dirs, files) in os.walk(path):
+        for file_name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file_name))
+            except OSError:
+                # Files are created and removed by geoprocessing while sampling
+                continue
+    return total
+
+
+class Resource_Sampler(threading.Thread):
+    """Background thread recording resource use, tagged with the current watershed and stage
+
+    Samples are appended as JSON lines and flushed as they are taken, so the file shows the
+    watershed and stage responsible even if the process dies. Peaks are summarized on stop.
+
+    Arguments:
+        threading.Thread {class} -- sampler runs as a daemon thread
+
+    Returns:
+        Resource_Sampler -- Resource_Sampler instance
+    """
+
+    def __init__(self, output_file_name, interval=5.0, scratch_path=None):
+        """Class initialization
+
+        Arguments:
+            output_file_name {string} -- path of the JSON lines metrics file
+
+        Keyword Arguments:
+            interval {float} -- seconds between samples, sampling is disabled if not positive (default: {5.0})
+            scratch_path {string} -- scratch geodatabase whose size is recorded (default: {None})
+        """
+
+        threading.Thread.__init__(self, name="rwsm-resource-sampler")
+        self.daemon = True
+        self.output_file_name = output_file_name
+        self.interval = interval
+        self.scratch_path = scratch_path
+        self.watershed = None
+        self.stage = None
+        self.peaks = {}
+        self.watershed_peaks = {}
+        self.n_samples = 0
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.last_cpu = None
+
+    def set_stage(self, watershed, stage):
+        """Tag subsequent samples with a watershed and stage
+
+        Arguments:
+            watershed {string} -- watershed name, None outside the watershed loop
+            stage {string} -- name of the analysis stage
+        """
+
+        self.watershed = watershed
+        self.stage = stage
+
+    def start(self):
+        """Start sampling, does nothing if sampling is disabled"""
+
+        if self.interval > 0:
+            threading.Thread.start(self)
+
+    def get_cpu_percent(self):
+        """CPU utilization since the previous sample, percent of one core
+
+        Returns:
+            float -- CPU utilization, None for the first sample
+        """
+
+        times = os.times()
+        now = (time.time(), times[0] + times[1])
+        percent = None
+        if self.last_cpu is not None and now[0] > self.last_cpu[0]:
+            percent = 100.0 * (now[1] - self.last_cpu[1]) / \
+                (now[0] - self.last_cpu[0])
+        self.last_cpu = now
+        return percent
+
+    def sample(self):
+        """Take one sample
+
+        Returns:
+            dictionary -- metric values tagged with time, watershed and stage
+        """
+
+        (rss_bytes, private_bytes) = get_memory_bytes()
+        return {
+            "time": datetime.datetime.now().isoformat(),
+            "elapsed": round(time.time() - self.start_time, 3),
+            "watershed": self.watershed,
+            "stage": self.stage,
+            "rss_bytes": rss_bytes,
+            "private_bytes": private_bytes,
+            "cpu_percent": self.get_cpu_percent(),
+            "scratch_bytes": get_directory_bytes(self.scratch_path),
+            "open_handles": get_open_handles()
+        }
+
+    def record(self, metrics, metrics_file):
+        """Write a sample and update peak values
+
+        Arguments:
+            metrics {dictionary} -- sample from sample
+            metrics_file {file} -- open metrics file
+        """
+
+        with self.lock:
+            metrics_file.write(json.dumps(metrics) + "\n")
+            metrics_file.flush()
+            self.n_samples += 1
+            for name in PEAK_METRICS:
+                value = metrics[name]
+                if value is not None and (name not in self.peaks or value > self.peaks[name]["value"]):
+                    self.peaks[name] = {
+                        "value": value,
+                        "watershed": metrics["watershed"],
+                        "stage": metrics["stage"],
+                        "elapsed": metrics["elapsed"]
+                    }
+            if metrics["watershed"] is not None and metrics["rss_bytes"] is not None:
+                self.watershed_peaks[metrics["watershed"]] = max(
+                    self.watershed_peaks.get(metrics["watershed"], 0), metrics["rss_bytes"])
+
+    def run(self):
+        """Sampling loop"""
+
+        with open(self.output_file_name, "a") as metrics_file:
+            while not self.stopped.is_set():
+                self.record(self.sample(), metrics_file)
+                self.stopped.wait(self.interval)
+            # Final sample at the end of the analysis
+            self.record(self.sample(), metrics_file)
+
+    def stop(self):
+        """Stop sampling and write the peak summary next to the metrics file
+
+        Returns:
+            dictionary -- summary of peak values, None if sampling was disabled
+        """
+
+        if not self.is_alive():
+            return None
+        self.stopped.set()
+        self.join()
+
+        summary = self.get_summary()
+        summary_file_name = os.path.splitext(self.output_file_name)[
+            0] + "_summary.json"
+        with open(summary_file_name, "w") as summary_file:
+            json.dump(summary, summary_file, indent=2)
+        return summary
+
+    def get_summary(self):
+        """Peak values with the watershed and stage at which they occurred
+
+        Returns:
+            dictionary -- number of samples, interval, overall peaks and peak RSS per watershed
+        """
+
+        with self.lock:
+            return {
+                "samples": self.n_samples,
+                "interval": self.interval,
+                "peaks": dict(self.peaks),
+                "watershed_peak_rss_bytes": dict(self.watershed_peaks)
+            }
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+"""uncertainty.py: Monte Carlo runoff volume uncertainty from a run's results store, NumPy only."""
+
+__copyright__ = """
+    Copyright (C) 2018 San Francisco Estuary Institute (SFEI)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import csv
+import argparse
+import numpy
+import core
+import results_store
+
+DISTRIBUTIONS = ("normal", "lognormal", "uniform")
+
+OUTPUT_FILE_NAME = "results_uncertainty.csv"
+
+
+def draw_factors(random_state, distribution, spread, shape):
+    """Multiplicative perturbation factors with a mean of one
+
+    Arguments:
+        random_state {RandomState} -- NumPy random number generator
+        distribution {string} -- normal, lognormal or uniform
+        spread {float} -- relative standard deviation (normal, lognormal) or half width (uniform)
+        shape {tuple} -- shape of the factor array
+
+    Raises:
+        ValueError -- unknown distribution
+
+    Returns:
+        array -- non-negative factors
+    """
+
+    if distribution == "normal":
+        return numpy.maximum(1.0 + spread * random_state.standard_normal(shape), 0.0)
+    if distribution == "lognormal":
+        sigma = numpy.sqrt(numpy.log(1.0 + spread ** 2))
+        return numpy.exp(sigma * random_state.standard_normal(shape) - sigma ** 2 / 2.0)
+    if distribution == "uniform":
+        return numpy.maximum(1.0 + spread * random_state.uniform(-1.0, 1.0, shape), 0.0)
+    raise ValueError("Unknown uncertainty distribution {}, expected one of {}".format(
+        distribution, ", ".join(DISTRIBUTIONS)))
+
+
+def get_coefficient_groups(store):
+    """Coefficient group of every polygon, the land use code, soil and slope bin combination
+
+    Polygons of a group share their coefficient perturbation across every watershed, as they
+    share a row of the runoff coefficient table.
+
+    Arguments:
+        store {Results_Store} -- results store of a run
+
+    Returns:
+        tuple -- group index per row and number of groups
+    """
+
+    names = ("land_use_code", "soil", "slope_bin")
+    shape = tuple(max(len(store.categories[name]), 1) for name in names)
+    keys = numpy.ravel_multi_index(
+        tuple(numpy.asarray(store.column(name)) for name in names), shape)
+    (unique, groups) = numpy.unique(keys, return_inverse=True)
+    return (groups, len(unique))
+
+
+def simulate_runoff(base, coefficients, polygon_groups, coeff_factors, precipitation_factors, chunk_size):
+    """Runoff volume of every sample for one watershed, as batched matrix products
+
+    Samples are evaluated in chunks so the (samples, polygons) coefficient matrix holds at most
+    about chunk_size values.
+
+    Arguments:
+        base {array} -- precipitation (m) times area (m2) per polygon
+        coefficients {array} -- runoff coefficient per polygon
+        polygon_groups {array} -- coefficient group per polygon
+        coeff_factors {array} -- (samples, groups) coefficient factors
+        precipitation_factors {array} -- precipitation factor per sample
+        chunk_size {int} -- bound on values per chunk
+
+    Returns:
+        array -- runoff volume (m3) per sample
+    """
+
+    n_samples = len(precipitation_factors)
+    volumes = numpy.zeros(n_samples)
+    step = max(1, chunk_size // max(len(base), 1))
+    for start in range(0, n_samples, step):
+        stop = min(start + step, n_samples)
+        sampled = numpy.clip(
+            coefficients[numpy.newaxis, :] * coeff_factors[start:stop][:, polygon_groups], 0.0, 1.0)
+        volumes[start:stop] = sampled.dot(base) * precipitation_factors[start:stop]
+    return volumes
+
+
+def run_uncertainty(config, workspace, messages=None):
+    """Percentile bands of runoff volume per watershed from perturbed coefficients and precipitation
+
+    Coefficients are perturbed per land use code, soil and slope bin combination, precipitation
+    per watershed; all perturbations are drawn up front and applied to the polygons of the run's
+    results store, no geoprocessing is repeated.
+
+    Arguments:
+        config {instance} -- ConfigParser instance holding parameter values
+        workspace {string} -- run workspace holding the results store
+
+    Keyword Arguments:
+        messages {Tool_Messages} -- receiver of messages (default: {None})
+
+    Returns:
+        string -- written file name
+    """
+
+    n_samples = int(core.get_config_option(config, "uncertainty_samples", 1000))
+    coeff_distribution = core.get_config_option(
+        config, "uncertainty_coeff_distribution", "normal")
+    coeff_spread = float(core.get_config_option(config, "uncertainty_coeff_spread", 0.1))
+    precipitation_distribution = core.get_config_option(
+        config, "uncertainty_precipitation_distribution", "normal")
+    precipitation_spread = float(core.get_config_option(
+        config, "uncertainty_precipitation_spread", 0.1))
+    percentiles = [float(percentile) for percentile in core.get_config_option(
+        config, "uncertainty_percentiles", "5,50,95").split(",")]
+    seed = core.get_config_option(config, "uncertainty_seed")
+    chunk_size = int(core.get_config_option(config, "chunk_size", 100000))
+
+    store = results_store.Results_Store(os.path.join(workspace, "results_store"))
+    watershed_names = store.categories["watershed"]
+    (groups, n_groups) = get_coefficient_groups(store)
+    base = numpy.nan_to_num(numpy.asarray(store.column("precipitation"), dtype=numpy.float64)) / 1000.0 * \
+        numpy.asarray(store.column("area"), dtype=numpy.float64)
+    coefficients = numpy.nan_to_num(numpy.asarray(
+        store.column("coefficient"), dtype=numpy.float64))
+    runoff_volume = numpy.nan_to_num(numpy.asarray(
+        store.column("runoff_volume"), dtype=numpy.float64))
+
+    random_state = numpy.random.RandomState(None if seed is None else int(seed))
+    coeff_factors = draw_factors(
+        random_state, coeff_distribution, coeff_spread, (n_samples, n_groups))
+    precipitation_factors = draw_factors(
+        random_state, precipitation_distribution, precipitation_spread,
+        (n_samples, len(watershed_names)))
+
+    headers = ["Watershed", "Runoff Vol. (m3)", "Mean Runoff Vol. (m3)", "Std. Dev. Runoff Vol. (m3)"] + \
+        ["P{:g} Runoff Vol. (m3)".format(percentile) for percentile in percentiles]
+    rows = []
+    for (i, watershed_name) in enumerate(watershed_names):
+        if messages is not None and messages.is_cancelled():
+            messages.add_warning("Uncertainty analysis cancelled")
+            break
+        watershed_rows = store.rows({"watershed": watershed_name})
+        volumes = simulate_runoff(
+            base[watershed_rows], coefficients[watershed_rows], groups[watershed_rows],
+            coeff_factors, precipitation_factors[:, i], chunk_size)
+        rows.append([watershed_name, numpy.sum(runoff_volume[watershed_rows]),
+                     numpy.mean(volumes), numpy.std(volumes)] +
+                    numpy.percentile(volumes, percentiles).tolist())
+
+    output_file_name = os.path.join(workspace, OUTPUT_FILE_NAME)
+    with open(output_file_name, "wb") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(headers)
+        for row in rows:
+            writer.writerow(row)
+
+    if messages is not None:
+        messages.add_message("Uncertainty: {} samples for {} watersheds written to {}".format(
+            n_samples, len(rows), output_file_name))
+    return output_file_name
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Monte Carlo runoff volume percentiles from a finished run's results store.")
+    parser.add_argument("config", help="configuration file the run used")
+    parser.add_argument("workspace", help="run workspace holding results_store")
+    args = parser.parse_args()
+
+    print(run_uncertainty(core.load_config(args.config), args.workspace))
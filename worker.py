@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+
+"""worker.py: Runs the analysis in a separate process, relaying progress back to the toolbox as events."""
+
+__copyright__ = """
+    Copyright (C) 2018 San Francisco Estuary Institute (SFEI)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import time
+import Queue
+import argparse
+import threading
+import traceback
+import subprocess
+import helpers
+import rwsm
+import precipitation_batch
+
+WORKER_FILE_NAME = os.path.realpath(__file__).replace(".pyc", ".py")
+
+# Seconds between batches of messages reported to the toolbox, and between polls of the worker
+MESSAGE_INTERVAL = 2.0
+POLL_INTERVAL = 0.25
+
+# Events ending a run
+FINAL_EVENTS = ("done", "cancelled", "failed")
+
+
+class Event_Channel(object):
+    """Tool_Messages counterpart for the worker process, writes each call as a JSON line
+
+    The run is cancelled when the cancel file appears or the toolbox stops reading,
+    e.g. when the background process hosting the toolbox is ended.
+
+    Arguments:
+        object {object} -- Remenant of python 2.7, declares new-style class
+
+    Returns:
+        Event_Channel -- Event_Channel instance
+    """
+
+    def __init__(self, stream, cancel_file_name=None):
+        """Class initialization
+
+        Arguments:
+            stream {file} -- stream read by the toolbox
+
+        Keyword Arguments:
+            cancel_file_name {string} -- file whose existence requests cancellation (default: {None})
+        """
+
+        self.stream = stream
+        self.cancel_file_name = cancel_file_name
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def send(self, event, **values):
+        """Write an event
+
+        Arguments:
+            event {string} -- event type
+        """
+
+        values["event"] = event
+        values["time"] = time.time()
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self.stream.write(json.dumps(values) + "\n")
+                self.stream.flush()
+            except (IOError, OSError):
+                self.closed = True
+
+    def add_message(self, msg):
+        """Send a message event"""
+
+        self.send("message", message=msg)
+
+    def add_warning(self, msg):
+        """Send a warning event"""
+
+        self.send("warning", message=msg)
+
+    def add_error(self, msg):
+        """Send an error event"""
+
+        self.send("error", message=msg)
+
+    def set_progressor(self, msg):
+        """Send a default progressor event"""
+
+        self.send("progressor", message=msg)
+
+    def set_step(self, msg, position, n_steps):
+        """Send a step progressor event"""
+
+        self.send("step", message=msg, position=position, n_steps=n_steps)
+
+    def set_stage(self, watershed_name, stage):
+        """Send an analysis stage event"""
+
+        self.send("stage", watershed=watershed_name, stage=stage)
+
+    def is_cancelled(self):
+        """Whether the toolbox asked to cancel or stopped listening
+
+        Returns:
+            bool -- True if cancelled
+        """
+
+        return self.closed or (self.cancel_file_name is not None and
+                               os.path.exists(self.cancel_file_name))
+
+
+def run_worker(config_file_name, cancel_file_name=None, watershed_names=None, workspace=None,
+               data_plane_file_name=None):
+    """Run the analysis, or precipitation batch, sending events to standard output
+
+    Arguments:
+        config_file_name {string} -- path to configuration file
+
+    Keyword Arguments:
+        cancel_file_name {string} -- file whose existence requests cancellation (default: {None})
+        watershed_names {list} -- subset of watersheds to analyse, all watersheds if None (default: {None})
+        workspace {string} -- workspace folder prefix, rwsm within the configured workspace if None (default: {None})
+        data_plane_file_name {string} -- header of a data plane to attach to rather than loading inputs (default: {None})
+
+    Returns:
+        int -- process exit code
+    """
+
+    channel = Event_Channel(sys.stdout, cancel_file_name)
+    try:
+        config = helpers.load_config(config_file_name)
+        intersected_watersheds = []
+        if helpers.get_config_option(config, "precipitation_batch"):
+            workspace = precipitation_batch.run_precipitation_batch(
+                config=config, messages=channel)
+        else:
+            (workspace, intersected_watersheds) = rwsm.run_analysis(
+                config=config, watershed_names=watershed_names, messages=channel,
+                workspace=workspace, data_plane_file_name=data_plane_file_name)
+        channel.send("cancelled" if channel.is_cancelled() else "done", workspace=workspace,
+                     watersheds=[[name, str(fc)] for (name, fc) in intersected_watersheds])
+        return 0
+    except Exception as error:
+        channel.send("failed", message="{}: {}".format(type(error).__name__, error),
+                     traceback=traceback.format_exc())
+        return 1
+
+
+def get_python_executable():
+    """Python interpreter for the worker process
+
+    Within ArcMap sys.executable is ArcMap itself, the interpreter of the same
+    installation is used instead.
+
+    Returns:
+        string -- interpreter path
+    """
+
+    for name in ("python.exe", "pythonw.exe"):
+        file_name = os.path.join(sys.exec_prefix, name)
+        if os.path.isfile(file_name):
+            return file_name
+    return sys.executable
+
+
+class Worker_Process(object):
+    """Worker process started from the toolbox, with its events collected on a queue
+
+    Arguments:
+        object {object} -- Remenant of python 2.7, declares new-style class
+
+    Returns:
+        Worker_Process -- Worker_Process instance
+    """
+
+    def __init__(self, config_file_name, arguments=None):
+        """Class initialization
+
+        Arguments:
+            config_file_name {string} -- path to configuration file
+
+        Keyword Arguments:
+            arguments {list} -- further command line arguments of the worker (default: {None})
+        """
+
+        self.config_file_name = config_file_name
+        self.arguments = arguments or []
+        self.cancel_file_name = config_file_name + ".cancel"
+        self.events = Queue.Queue()
+        self.finished = False
+        self.process = None
+
+    def start(self):
+        """Start the worker and the thread reading its output"""
+
+        if os.path.exists(self.cancel_file_name):
+            os.remove(self.cancel_file_name)
+        creation_flags = 0x08000000 if sys.platform == "win32" else 0  # CREATE_NO_WINDOW
+        self.process = subprocess.Popen(
+            [get_python_executable(), WORKER_FILE_NAME,
+             self.config_file_name, "--cancel-file", self.cancel_file_name] + self.arguments,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            cwd=os.path.dirname(WORKER_FILE_NAME), creationflags=creation_flags)
+        reader = threading.Thread(
+            target=self.read_events, name="rwsm-worker-reader")
+        reader.daemon = True
+        reader.start()
+
+    def read_events(self):
+        """Queue events as the worker writes them, other output is queued as messages"""
+
+        for line in iter(self.process.stdout.readline, b""):
+            try:
+                event = json.loads(line)
+            except ValueError:
+                event = None
+            if not isinstance(event, dict) or "event" not in event:
+                event = {"event": "message", "message": line.rstrip()}
+            self.events.put(event)
+        self.events.put(None)
+
+    def get_events(self, timeout):
+        """Events received so far, waiting up to timeout for the first
+
+        Arguments:
+            timeout {float} -- seconds to wait
+
+        Returns:
+            list -- events, in order
+        """
+
+        events = []
+        try:
+            event = self.events.get(timeout=timeout)
+            while True:
+                if event is None:
+                    self.finished = True
+                    break
+                events.append(event)
+                event = self.events.get_nowait()
+        except Queue.Empty:
+            pass
+        return events
+
+    def cancel(self):
+        """Ask the worker to stop after the current watershed"""
+
+        if not os.path.exists(self.cancel_file_name):
+            open(self.cancel_file_name, "w").close()
+
+    def wait(self):
+        """Wait for the worker to exit
+
+        Returns:
+            int -- worker exit code
+        """
+
+        return_code = self.process.wait()
+        if os.path.exists(self.cancel_file_name):
+            os.remove(self.cancel_file_name)
+        return return_code
+
+
+def report_messages(events, messages):
+    """Report a batch of message events, consecutive messages of a level in one call
+
+    Arguments:
+        events {list} -- message, warning and error events
+        messages {Tool_Messages} -- receiver of messages
+    """
+
+    methods = {"message": messages.add_message,
+               "warning": messages.add_warning,
+               "error": messages.add_error}
+    group = []
+    for (i, event) in enumerate(events):
+        group.append(event["message"])
+        if i + 1 == len(events) or events[i + 1]["event"] != event["event"]:
+            methods[event["event"]]("\n".join(group))
+            group = []
+
+
+def relay_events(worker_process, messages, interval=MESSAGE_INTERVAL):
+    """Report worker events in throttled batches until the worker exits
+
+    Only the latest progressor update of a batch is shown. Cancellation requested
+    through messages is forwarded to the worker.
+
+    Arguments:
+        worker_process {Worker_Process} -- started worker
+        messages {Tool_Messages} -- receiver of messages and progress
+
+    Keyword Arguments:
+        interval {float} -- minimum seconds between batches (default: {MESSAGE_INTERVAL})
+
+    Returns:
+        dictionary -- final event (done, cancelled or failed), None if the worker exited without one
+    """
+
+    pending = []
+    progress = None
+    final_event = None
+    last_report = 0
+    while not worker_process.finished:
+        for event in worker_process.get_events(POLL_INTERVAL):
+            if event["event"] in ("progressor", "step"):
+                progress = event
+            elif event["event"] in FINAL_EVENTS:
+                final_event = event
+            elif event["event"] in ("message", "warning", "error"):
+                pending.append(event)
+
+        if messages.is_cancelled():
+            worker_process.cancel()
+
+        if worker_process.finished or time.time() - last_report >= interval:
+            report_messages(pending, messages)
+            if progress is not None and progress["event"] == "step":
+                messages.set_step(
+                    progress["message"], progress["position"], progress["n_steps"])
+            elif progress is not None:
+                messages.set_progressor(progress["message"])
+            pending = []
+            progress = None
+            last_report = time.time()
+
+    worker_process.wait()
+    return final_event
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the RWSM analysis, writing progress events to standard output.")
+    parser.add_argument("config", help="configuration file")
+    parser.add_argument("--cancel-file",
+                        help="stop after the current watershed once this file exists")
+    parser.add_argument("--watersheds-file",
+                        help="file listing the watersheds to analyse, one per line")
+    parser.add_argument("--workspace",
+                        help="workspace folder prefix")
+    parser.add_argument("--data-plane",
+                        help="header of a data plane published by the parent process")
+    args = parser.parse_args()
+    watershed_names = None
+    if args.watersheds_file:
+        with open(args.watersheds_file) as watersheds_file:
+            watershed_names = [line.strip() for line in watersheds_file if line.strip()]
+    sys.exit(run_worker(args.config, args.cancel_file, watershed_names,
+                        args.workspace, args.data_plane))
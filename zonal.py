@@ -0,0 +1,597 @@
+#!/usr/bin/env python
+
+"""zonal.py: NumPy zonal reductions used by the RWSM analysis."""
+
+__copyright__ = """
+    Copyright (C) 2018 San Francisco Estuary Institute (SFEI)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU Lesser General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import csv
+import time
+import numpy
+from multiprocessing.pool import ThreadPool
+
+# Zonal means engines: ZonalStatisticsAsTable with centroid fallback, or exact cell coverage
+ZONAL_ENGINES = ("arcpy", "exact")
+
+# Columns of tile timing tables, see coverage_means and zonal_means
+TILE_TIMING_FIELDS = ("watershed", "reduction", "row", "col", "rows", "cols", "polygons", "cells", "seconds")
+
+
+def bin_index(values, slope_bins):
+    """Index of the slope bin containing each value, lower bound inclusive
+
+    Arguments:
+        values {array} -- values to classify (e.g. slope means)
+        slope_bins {list} -- list of [lower, upper] bins
+
+    Returns:
+        array -- bin index per value, -1 where no bin contains the value
+    """
+
+    values = numpy.asarray(values, dtype=float)
+    idx = numpy.empty(len(values), dtype=int)
+    idx.fill(-1)
+    for (i, slope_bin) in enumerate(slope_bins):
+        mask = (idx < 0) & (values >= slope_bin[0]) & (values < slope_bin[1])
+        idx[mask] = i
+    return idx
+
+
+def class_fractions(zone_ids, table_zone_ids, class_areas):
+    """Align tabulated class areas with a set of zones and normalize them to area fractions
+
+    Arguments:
+        zone_ids {array} -- zone identifiers to align to (e.g. uID of each polygon)
+        table_zone_ids {array} -- zone identifiers of the tabulated rows
+        class_areas {array} -- 2D array of tabulated areas, one row per table zone, one column per class
+
+    Returns:
+        tuple -- 2D array of area fractions (zones x classes) and boolean array flagging zones with tabulated area
+    """
+
+    zone_ids = numpy.asarray(zone_ids)
+    table_zone_ids = numpy.asarray(table_zone_ids)
+    class_areas = numpy.asarray(class_areas, dtype=float)
+    fractions = numpy.zeros((len(zone_ids), class_areas.shape[1]))
+    if len(table_zone_ids) == 0:
+        return (fractions, numpy.zeros(len(zone_ids), dtype=bool))
+
+    order = numpy.argsort(table_zone_ids)
+    sorted_ids = table_zone_ids[order]
+    idx = numpy.clip(numpy.searchsorted(sorted_ids, zone_ids),
+                     0, len(sorted_ids) - 1)
+    found = sorted_ids[idx] == zone_ids
+
+    areas = class_areas[order[idx[found]]]
+    totals = numpy.sum(areas, axis=1)
+    has_area = totals > 0
+    rows = numpy.nonzero(found)[0][has_area]
+    fractions[rows] = areas[has_area] / totals[has_area][:, numpy.newaxis]
+
+    has_cells = numpy.zeros(len(zone_ids), dtype=bool)
+    has_cells[rows] = True
+    return (fractions, has_cells)
+
+
+def zonal_means(zones, values, valid, n_zones, tile_size=0, workers=1, timings=None):
+    """Mean of values within each zone of a rasterized zone array
+
+    With a tile size, cell counts and sums are accumulated per tile on a pool of threads and
+    merged in tile order.
+
+    Arguments:
+        zones {array} -- integer zone identifier per cell, 0 outside all zones
+        values {array} -- cell values aligned with zones
+        valid {array} -- boolean array flagging cells holding data
+        n_zones {int} -- largest zone identifier
+
+    Keyword Arguments:
+        tile_size {int} -- rows and columns per tile, the array is not tiled if 0 (default: {0})
+        workers {int} -- threads reducing tiles (default: {1})
+        timings {list} -- receives a dictionary per tile: position, size, cells and seconds (default: {None})
+
+    Returns:
+        tuple -- array of means indexed by zone identifier (NaN for empty zones) and array of cell counts
+    """
+
+    def reduce_tile(tile):
+        start_time = time.time()
+        (row0, col0, nrows, ncols) = tile
+        window = (slice(row0, row0 + nrows), slice(col0, col0 + ncols))
+        mask = (zones[window] > 0) & valid[window]
+        zone_cells = zones[window][mask]
+        tile_sums = numpy.bincount(zone_cells, weights=values[window][mask],
+                                   minlength=n_zones + 1)
+        tile_counts = numpy.bincount(zone_cells, minlength=n_zones + 1)
+        timing = {"row": row0, "col": col0, "rows": nrows, "cols": ncols,
+                  "cells": len(zone_cells), "seconds": time.time() - start_time}
+        return (tile_sums, tile_counts, timing)
+
+    sums = numpy.zeros(n_zones + 1)
+    counts = numpy.zeros(n_zones + 1, dtype=int)
+    tiles = tile_windows(zones.shape[0], zones.shape[1], int(tile_size))
+    for (tile_sums, tile_counts, timing) in map_tiles(reduce_tile, tiles, workers):
+        sums += tile_sums
+        counts += tile_counts
+        if timings is not None:
+            timings.append(timing)
+
+    means = numpy.empty(len(sums))
+    means.fill(numpy.nan)
+    has_cells = counts > 0
+    means[has_cells] = sums[has_cells] / counts[has_cells]
+    return (means, counts)
+
+
+def sample_points(x, y, values, valid, grid):
+    """Sample a raster window at point locations, as ExtractValuesToPoints does
+
+    Arguments:
+        x {array} -- point x coordinates
+        y {array} -- point y coordinates
+        values {array} -- 2D raster window
+        valid {array} -- 2D boolean array flagging cells holding data
+        grid {dictionary} -- grid of the raster window, see helpers.get_raster_grid
+
+    Returns:
+        array -- sampled values, NaN for points outside the window or on cells without data
+    """
+
+    cols = numpy.floor((numpy.asarray(x) - grid['xmin']) /
+                       grid['cell_width']).astype(int)
+    rows = numpy.floor((grid['ymax'] - numpy.asarray(y)) /
+                       grid['cell_height']).astype(int)
+    inside = (cols >= 0) & (cols < values.shape[1]) & \
+        (rows >= 0) & (rows < values.shape[0])
+    sampled = numpy.empty(len(cols))
+    sampled.fill(numpy.nan)
+    hit = numpy.nonzero(inside)[0]
+    hit = hit[valid[rows[hit], cols[hit]]]
+    sampled[hit] = values[rows[hit], cols[hit]]
+    return sampled
+
+
+def window_bounds(grid, xmin, ymin, xmax, ymax):
+    """Rows and columns of a grid covering an extent, clipped to the grid
+
+    Arguments:
+        grid {dictionary} -- grid holding xmin, ymax, cell_width, cell_height, ncols and nrows
+        xmin {float} -- extent minimum x
+        ymin {float} -- extent minimum y
+        xmax {float} -- extent maximum x
+        ymax {float} -- extent maximum y
+
+    Returns:
+        tuple -- first row, first column, number of rows and number of columns
+    """
+
+    col0 = max(int(numpy.floor((xmin - grid['xmin']) / grid['cell_width'])), 0)
+    col1 = min(int(numpy.ceil((xmax - grid['xmin']) / grid['cell_width'])), grid['ncols'])
+    row0 = max(int(numpy.floor((grid['ymax'] - ymax) / grid['cell_height'])), 0)
+    row1 = min(int(numpy.ceil((grid['ymax'] - ymin) / grid['cell_height'])), grid['nrows'])
+    return (row0, col0, max(row1 - row0, 0), max(col1 - col0, 0))
+
+
+def polygon_edges(polygons):
+    """Edges of every ring of a list of polygons
+
+    Arguments:
+        polygons {list} -- one list of rings per polygon, each ring an (n, 2) array of x, y vertices
+
+    Returns:
+        tuple -- arrays of edge start x, start y, end x, end y and owning polygon index
+    """
+
+    starts = []
+    ends = []
+    owners = []
+    for (i, rings) in enumerate(polygons):
+        for ring in rings:
+            ring = numpy.asarray(ring, dtype=numpy.float64).reshape(-1, 2)
+            if len(ring) < 3:
+                continue
+            closed = numpy.vstack([ring, ring[:1]])
+            starts.append(closed[:-1])
+            ends.append(closed[1:])
+            owners.append(numpy.zeros(len(ring), dtype=int) + i)
+    if not starts:
+        empty = numpy.zeros(0)
+        return (empty, empty, empty, empty, numpy.zeros(0, dtype=int))
+    starts = numpy.concatenate(starts)
+    ends = numpy.concatenate(ends)
+    return (starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1], numpy.concatenate(owners))
+
+
+def polygon_windows(u0, v0, u1, v1, owners, n_polygons):
+    """Cell window covering each polygon, in cell units
+
+    Arguments:
+        u0 {array} -- edge start columns (fractional)
+        v0 {array} -- edge start rows (fractional, increasing downwards)
+        u1 {array} -- edge end columns
+        v1 {array} -- edge end rows
+        owners {array} -- polygon index of each edge
+        n_polygons {int} -- number of polygons
+
+    Returns:
+        tuple -- first row, first column, number of rows and number of columns per polygon
+    """
+
+    bounds = []
+    for (low, high) in ((numpy.minimum(v0, v1), numpy.maximum(v0, v1)),
+                        (numpy.minimum(u0, u1), numpy.maximum(u0, u1))):
+        lower = numpy.zeros(n_polygons) + numpy.inf
+        upper = numpy.zeros(n_polygons) - numpy.inf
+        numpy.minimum.at(lower, owners, low)
+        numpy.maximum.at(upper, owners, high)
+        empty = numpy.isinf(lower)
+        lower[empty] = 0
+        upper[empty] = 0
+        first = numpy.floor(lower).astype(int)
+        count = numpy.maximum(numpy.ceil(upper).astype(int) - first, 1)
+        count[empty] = 0
+        bounds += [first, count]
+    (row0, nrows, col0, ncols) = bounds
+    return (row0, col0, nrows, ncols)
+
+
+def cell_coverage(u0, v0, u1, v1, owners, n_polygons):
+    """Exact fraction of every cell covered by each polygon
+
+    Edges are split wherever they cross a cell boundary. By Green's theorem, each piece adds
+    the area between itself and the bottom of its cell to that cell, and its full width to
+    every cell below it within the column; summed over closed rings this is the polygon area
+    within each cell. Holes and either ring orientation are handled, the sign of each polygon
+    is set so its total coverage is positive.
+
+    Arguments:
+        u0 {array} -- edge start columns (fractional)
+        v0 {array} -- edge start rows (fractional, increasing downwards)
+        u1 {array} -- edge end columns
+        v1 {array} -- edge end rows
+        owners {array} -- polygon index of each edge
+        n_polygons {int} -- number of polygons
+
+    Returns:
+        tuple -- flat coverage array holding one column-major (rows x columns) block per polygon,
+            block offsets, and the first row, first column, rows and columns of each block
+    """
+
+    (row0, col0, nrows, ncols) = polygon_windows(u0, v0, u1, v1, owners, n_polygons)
+    sizes = nrows * ncols
+    offsets = numpy.concatenate([[0], numpy.cumsum(sizes)[:-1]]).astype(int)
+    n_cells = int(numpy.sum(sizes))
+    coverage = numpy.zeros(n_cells)
+    if len(owners) == 0 or n_cells == 0:
+        return (coverage, offsets, row0, col0, nrows, ncols)
+
+    # Split edges at every column and row boundary they cross, as edge parameters t in [0, 1]
+    du = u1 - u0
+    dv = v1 - v0
+    first_u = numpy.ceil(numpy.minimum(u0, u1))
+    first_v = numpy.ceil(numpy.minimum(v0, v1))
+    n_u = numpy.where(du != 0, numpy.floor(numpy.maximum(u0, u1)) - first_u + 1, 0).astype(int)
+    n_v = numpy.where(dv != 0, numpy.floor(numpy.maximum(v0, v1)) - first_v + 1, 0).astype(int)
+    n_u = numpy.maximum(n_u, 0)
+    n_v = numpy.maximum(n_v, 0)
+    counts = 2 + n_u + n_v
+    edge = numpy.repeat(numpy.arange(len(owners)), counts)
+    position = numpy.arange(len(edge)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    crossing = position - 2
+    on_u = (crossing >= 0) & (crossing < n_u[edge])
+    on_v = crossing >= n_u[edge]
+    t = numpy.where(position == 1, 1.0, 0.0)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        t = numpy.where(on_u, (first_u[edge] + crossing - u0[edge]) / du[edge], t)
+        t = numpy.where(on_v, (first_v[edge] + crossing - n_u[edge] - v0[edge]) / dv[edge], t)
+    t = numpy.clip(t, 0.0, 1.0)
+    order = numpy.lexsort((t, edge))
+    t = t[order]
+    edge = edge[order]
+
+    # Pieces between consecutive parameters of an edge lie within one cell
+    same = edge[:-1] == edge[1:]
+    e = edge[:-1][same]
+    t_start = t[:-1][same]
+    t_end = t[1:][same]
+    u_start = u0[e] + t_start * du[e]
+    u_end = u0[e] + t_end * du[e]
+    v_mid = v0[e] + (t_start + t_end) / 2.0 * dv[e]
+    width = u_end - u_start
+    p = owners[e]
+    # Pieces on the bottom boundary of the window belong to the last row, adding nothing to it
+    rows = numpy.clip(numpy.floor(v_mid).astype(int) - row0[p], 0, nrows[p] - 1)
+    cols = numpy.clip(numpy.floor((u_start + u_end) / 2.0).astype(int) - col0[p], 0, ncols[p] - 1)
+    flat = offsets[p] + cols * nrows[p] + rows
+
+    coverage += numpy.bincount(flat, weights=(row0[p] + rows + 1 - v_mid) * width, minlength=n_cells)
+    below = rows + 1 < nrows[p]
+    steps = numpy.bincount(flat[below] + 1, weights=width[below], minlength=n_cells)
+
+    # Cumulative sum of the steps down each column of each block
+    column_lengths = numpy.repeat(nrows, ncols)
+    column_starts = numpy.cumsum(column_lengths) - column_lengths
+    totals = numpy.cumsum(steps)
+    prior = numpy.where(column_starts > 0, totals[numpy.maximum(column_starts - 1, 0)], 0.0)
+    coverage += totals - numpy.repeat(prior, column_lengths)
+
+    owner = numpy.repeat(numpy.arange(n_polygons), sizes)
+    signs = numpy.where(numpy.bincount(owner, weights=coverage, minlength=n_polygons) < 0, -1.0, 1.0)
+    coverage = numpy.clip(coverage * signs[owner], 0.0, 1.0)
+    return (coverage, offsets, row0, col0, nrows, ncols)
+
+
+def tile_windows(nrows, ncols, tile_size):
+    """Square tiles covering a raster window, in row-major order
+
+    Arguments:
+        nrows {int} -- rows of the window
+        ncols {int} -- columns of the window
+        tile_size {int} -- rows and columns per tile, one tile for the whole window if 0
+
+    Returns:
+        list -- first row, first column, number of rows and number of columns per tile
+    """
+
+    if tile_size <= 0:
+        return [(0, 0, nrows, ncols)]
+    return [(row, col, min(tile_size, nrows - row), min(tile_size, ncols - col))
+            for row in range(0, nrows, tile_size) for col in range(0, ncols, tile_size)]
+
+
+def map_tiles(function, tiles, workers=1):
+    """Apply a function to every tile on a pool of threads
+
+    NumPy releases the GIL in its reductions, so threads share the work of one process.
+    Results are returned in tile order whichever thread finishes first.
+
+    Arguments:
+        function {function} -- function of one tile
+        tiles {list} -- tiles
+
+    Keyword Arguments:
+        workers {int} -- number of threads, tiles run in the calling thread if 1 (default: {1})
+
+    Returns:
+        list -- result per tile
+    """
+
+    if workers <= 1 or len(tiles) <= 1:
+        return [function(tile) for tile in tiles]
+    pool = ThreadPool(min(workers, len(tiles)))
+    try:
+        return pool.map(function, tiles)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def clip_ring(ring, xmin, ymin, xmax, ymax):
+    """Clip a ring to a rectangle (Sutherland-Hodgman)
+
+    Parts of a concave ring outside the rectangle collapse onto its boundary; such edges enclose
+    no area, so coverage is unchanged.
+
+    Arguments:
+        ring {array} -- (n, 2) array of x, y vertices
+        xmin {float} -- rectangle minimum x
+        ymin {float} -- rectangle minimum y
+        xmax {float} -- rectangle maximum x
+        ymax {float} -- rectangle maximum y
+
+    Returns:
+        array -- (m, 2) array of clipped vertices, empty if the ring lies outside the rectangle
+    """
+
+    ring = numpy.asarray(ring, dtype=numpy.float64).reshape(-1, 2)
+    for (axis, limit, upper) in ((0, xmin, False), (0, xmax, True), (1, ymin, False), (1, ymax, True)):
+        if len(ring) == 0:
+            break
+        following = numpy.roll(ring, -1, axis=0)
+        inside = ring[:, axis] <= limit if upper else ring[:, axis] >= limit
+        crossing = inside != numpy.roll(inside, -1)
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            t = numpy.where(crossing, (limit - ring[:, axis]) / (following[:, axis] - ring[:, axis]), 0.0)
+        points = numpy.empty((len(ring), 2, 2))
+        points[:, 0] = ring
+        points[:, 1] = ring + t[:, numpy.newaxis] * (following - ring)
+        points[:, 1, axis] = limit
+        # Each vertex inside is kept, followed by the crossing of its outgoing edge
+        ring = points[numpy.column_stack([inside, crossing])]
+    return ring
+
+
+def coverage_sums(polygons, values, valid, grid, max_cells=1000000):
+    """Coverage weighted sums and weights of raster cells within each polygon, over one window
+
+    Arguments:
+        polygons {list} -- one list of rings per polygon, each ring an (n, 2) array of x, y vertices
+        values {array} -- 3D (bands, rows, columns) raster window
+        valid {array} -- boolean array shaped as values flagging cells holding data
+        grid {dictionary} -- grid of the raster window, see helpers.get_raster_grid
+
+    Keyword Arguments:
+        max_cells {int} -- bound on cells held per batch (default: {1000000})
+
+    Returns:
+        tuple -- (bands, polygons) arrays of coverage weighted sums and covered cells holding data
+    """
+
+    n_bands = values.shape[0]
+    (x0, y0, x1, y1, owners) = polygon_edges(polygons)
+    u0 = (x0 - grid['xmin']) / grid['cell_width']
+    u1 = (x1 - grid['xmin']) / grid['cell_width']
+    v0 = (grid['ymax'] - y0) / grid['cell_height']
+    v1 = (grid['ymax'] - y1) / grid['cell_height']
+
+    n_polygons = len(polygons)
+    (row0, col0, nrows, ncols) = polygon_windows(u0, v0, u1, v1, owners, n_polygons)
+    batches = numpy.cumsum(nrows * ncols) // max(int(max_cells), 1)
+
+    sums = numpy.zeros((n_bands, n_polygons))
+    weights = numpy.zeros((n_bands, n_polygons))
+    for batch in numpy.unique(batches).tolist():
+        members = numpy.nonzero(batches == batch)[0]
+        local = numpy.zeros(n_polygons, dtype=int) - 1
+        local[members] = numpy.arange(len(members))
+        selected = local[owners] >= 0
+        (coverage, offsets, b_row0, b_col0, b_nrows, b_ncols) = cell_coverage(
+            u0[selected], v0[selected], u1[selected], v1[selected],
+            local[owners[selected]], len(members))
+
+        sizes = b_nrows * b_ncols
+        owner = numpy.repeat(numpy.arange(len(members)), sizes)
+        index = numpy.arange(len(coverage)) - offsets[owner]
+        rows = b_row0[owner] + index % numpy.maximum(b_nrows[owner], 1)
+        cols = b_col0[owner] + index // numpy.maximum(b_nrows[owner], 1)
+        inside = (rows >= 0) & (rows < values.shape[1]) & \
+            (cols >= 0) & (cols < values.shape[2])
+        inside = numpy.nonzero(inside)[0]
+        for band in range(n_bands):
+            hit = inside[valid[band, rows[inside], cols[inside]]]
+            sums[band, members] = numpy.bincount(
+                owner[hit], weights=coverage[hit] * values[band, rows[hit], cols[hit]],
+                minlength=len(members))
+            weights[band, members] = numpy.bincount(
+                owner[hit], weights=coverage[hit], minlength=len(members))
+    return (sums, weights)
+
+
+def tile_polygons(polygons, grid, tile, windows):
+    """Polygons overlapping a tile, clipped to it where they extend beyond it
+
+    Arguments:
+        polygons {list} -- one list of rings per polygon
+        grid {dictionary} -- grid of the raster window
+        tile {tuple} -- first row, first column, rows and columns of the tile
+        windows {tuple} -- first row, first column, rows and columns of every polygon window
+
+    Returns:
+        tuple -- indices of the overlapping polygons and their rings within the tile
+    """
+
+    (t_row0, t_col0, t_nrows, t_ncols) = tile
+    (row0, col0, nrows, ncols) = windows
+    overlapping = (row0 < t_row0 + t_nrows) & (row0 + nrows > t_row0) & \
+        (col0 < t_col0 + t_ncols) & (col0 + ncols > t_col0) & (nrows > 0)
+    contained = (row0 >= t_row0) & (row0 + nrows <= t_row0 + t_nrows) & \
+        (col0 >= t_col0) & (col0 + ncols <= t_col0 + t_ncols)
+    xmin = grid['xmin'] + t_col0 * grid['cell_width']
+    xmax = grid['xmin'] + (t_col0 + t_ncols) * grid['cell_width']
+    ymax = grid['ymax'] - t_row0 * grid['cell_height']
+    ymin = grid['ymax'] - (t_row0 + t_nrows) * grid['cell_height']
+
+    members = numpy.nonzero(overlapping)[0]
+    rings = []
+    for i in members.tolist():
+        if contained[i]:
+            rings.append(polygons[i])
+        else:
+            rings.append([clip_ring(ring, xmin, ymin, xmax, ymax) for ring in polygons[i]])
+    return (members, rings)
+
+
+def coverage_means(polygons, values, valid, grid, max_cells=1000000, tile_size=0, workers=1, timings=None):
+    """Coverage weighted mean of raster cells within each polygon
+
+    Every cell a polygon overlaps is weighted by the fraction of the cell it covers, so small and
+    thin polygons receive a value without falling back to their centroid. Polygons are processed
+    in batches whose windows hold about max_cells cells. Coverage is computed once for all bands
+    of a multi-band window.
+
+    With a tile size, the window is split into tiles reduced on a pool of threads; polygons
+    crossing tile edges are clipped to each tile. Partial sums are merged in tile order, so
+    results do not depend on the number of threads.
+
+    Arguments:
+        polygons {list} -- one list of rings per polygon, each ring an (n, 2) array of x, y vertices
+        values {array} -- 2D raster window, or 3D (bands, rows, columns) window
+        valid {array} -- boolean array shaped as values flagging cells holding data
+        grid {dictionary} -- grid of the raster window, see helpers.get_raster_grid
+
+    Keyword Arguments:
+        max_cells {int} -- bound on cells held per batch (default: {1000000})
+        tile_size {int} -- rows and columns per tile, the window is not tiled if 0 (default: {0})
+        workers {int} -- threads reducing tiles (default: {1})
+        timings {list} -- receives a dictionary per tile: position, size, polygons and seconds (default: {None})
+
+    Returns:
+        tuple -- array of means per polygon (NaN without covered cells holding data) and array of
+            covered cells holding data per polygon, (bands, polygons) arrays for a 3D window
+    """
+
+    bands = values.ndim == 3
+    if not bands:
+        values = values[numpy.newaxis]
+        valid = valid[numpy.newaxis]
+    n_bands = values.shape[0]
+    n_polygons = len(polygons)
+
+    tiles = tile_windows(values.shape[1], values.shape[2], int(tile_size))
+    if len(tiles) > 1:
+        (x0, y0, x1, y1, owners) = polygon_edges(polygons)
+        windows = polygon_windows(
+            (x0 - grid['xmin']) / grid['cell_width'], (grid['ymax'] - y0) / grid['cell_height'],
+            (x1 - grid['xmin']) / grid['cell_width'], (grid['ymax'] - y1) / grid['cell_height'],
+            owners, n_polygons)
+
+    def reduce_tile(tile):
+        start_time = time.time()
+        (row0, col0, nrows, ncols) = tile
+        if len(tiles) > 1:
+            (members, tile_rings) = tile_polygons(polygons, grid, tile, windows)
+        else:
+            (members, tile_rings) = (numpy.arange(n_polygons), polygons)
+        tile_grid = dict(grid, xmin=grid['xmin'] + col0 * grid['cell_width'],
+                         ymax=grid['ymax'] - row0 * grid['cell_height'], nrows=nrows, ncols=ncols)
+        (tile_sums, tile_weights) = coverage_sums(
+            tile_rings, values[:, row0:row0 + nrows, col0:col0 + ncols],
+            valid[:, row0:row0 + nrows, col0:col0 + ncols], tile_grid, max_cells)
+        timing = {"row": row0, "col": col0, "rows": nrows, "cols": ncols,
+                  "polygons": len(members), "seconds": time.time() - start_time}
+        return (members, tile_sums, tile_weights, timing)
+
+    sums = numpy.zeros((n_bands, n_polygons))
+    weights = numpy.zeros((n_bands, n_polygons))
+    for (members, tile_sums, tile_weights, timing) in map_tiles(reduce_tile, tiles, workers):
+        sums[:, members] += tile_sums
+        weights[:, members] += tile_weights
+        if timings is not None:
+            timings.append(timing)
+
+    means = numpy.empty((n_bands, n_polygons))
+    means.fill(numpy.nan)
+    covered = weights > 0
+    means[covered] = sums[covered] / weights[covered]
+    if not bands:
+        return (means[0], weights[0])
+    return (means, weights)
+
+
+def write_tile_timings(file_name, timings):
+    """Write per-tile timings to CSV
+
+    Arguments:
+        file_name {string} -- CSV file name
+        timings {list} -- tile timing dictionaries, tagged with watershed and reduction
+    """
+
+    with open(file_name, "wb") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(TILE_TIMING_FIELDS)
+        for timing in timings:
+            writer.writerow([timing.get(field, "") for field in TILE_TIMING_FIELDS])